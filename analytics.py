@@ -0,0 +1,214 @@
+"""历史数据分析快照
+
+把 Product、ProductPrice、ActivityLog 按月导出成 Parquet 文件：
+
+    analytics/product/month=2025-01/part-0.parquet
+    analytics/product_price/month=2025-01/part-0.parquet
+    analytics/activity_log/month=2025-01/part-0.parquet
+
+每次导出只重写自上次以来有变化的月份（按行数和最大 updated_at/id 判断），
+不在当前数据日期范围内的月份分区（最早的记录被删除后）一并删除。
+查询时只读取需要的列和月份分区，并使用内存映射。
+
+商品分区有变化时同时重新生成月度销售汇总 (sales_summary.py)，多月趋势、同比
+等报表由网页端读取汇总，不访问线上数据库，也不在网页进程中加载 pandas。
+
+    python analytics.py export          增量导出（可放到每晚的 crontab 中）
+    python analytics.py export --full   全量重新导出
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, func
+
+import sales_summary
+from models import DEFAULT_STORE_ID, Product, ProductPrice, ActivityLog
+
+# 表名 -> (表对象, 分区日期列, 变更判断列)
+TABLES = {
+    'product': (Product.__table__, 'date', 'updated_at'),
+    'product_price': (ProductPrice.__table__, 'start_date', 'updated_at'),
+    'activity_log': (ActivityLog.__table__, 'created_at', 'id'),
+}
+
+MANIFEST = 'manifest.json'
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def month_key(value):
+    return value.strftime('%Y-%m')
+
+
+def iter_months(start, end):
+    current = month_start(start)
+    while current <= end:
+        yield current
+        current = next_month(current)
+
+
+def partition_path(base_dir, table_name, month):
+    return os.path.join(base_dir, table_name, f'month={month}', 'part-0.parquet')
+
+
+def _load_manifest(base_dir):
+    path = os.path.join(base_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_manifest(base_dir, manifest):
+    path = os.path.join(base_dir, MANIFEST)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _write_partition(path, frame):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _remove_stale_partitions(base_dir, table_name, keep, table_manifest):
+    """删除不在 keep 中的月份分区，返回删除的月份"""
+    table_dir = os.path.join(base_dir, table_name)
+    removed = []
+    if os.path.isdir(table_dir):
+        for name in sorted(os.listdir(table_dir)):
+            if name.startswith('month=') and name.split('=', 1)[1] not in keep:
+                shutil.rmtree(os.path.join(table_dir, name))
+                removed.append(name.split('=', 1)[1])
+    for key in [key for key in table_manifest if key not in keep]:
+        del table_manifest[key]
+    return removed
+
+
+def export_snapshot(engine, base_dir, full=False):
+    """导出有变化的月份，返回 {表名: [重写或删除的月份]}"""
+    manifest = {} if full else _load_manifest(base_dir)
+    written = {}
+
+    with engine.connect() as conn:
+        for table_name, (table, date_column, version_column) in TABLES.items():
+            date_col = table.c[date_column]
+            version_col = table.c[version_column]
+            table_manifest = manifest.setdefault(table_name, {})
+            written[table_name] = []
+
+            first, last = conn.execute(select(func.min(date_col), func.max(date_col))).one()
+            months = list(iter_months(first, last)) if first is not None else []
+            written[table_name].extend(
+                _remove_stale_partitions(base_dir, table_name, {month_key(month) for month in months}, table_manifest)
+            )
+
+            for month in months:
+                key = month_key(month)
+                in_month = (date_col >= month) & (date_col < next_month(month))
+                count, version = conn.execute(
+                    select(func.count(), func.max(version_col)).where(in_month)
+                ).one()
+                fingerprint = [count, str(version)]
+                path = partition_path(base_dir, table_name, key)
+                if table_manifest.get(key) == fingerprint and (count == 0 or os.path.exists(path)):
+                    continue
+
+                if count:
+                    result = conn.execute(select(table).where(in_month).order_by(table.c.id))
+                    frame = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+                    _write_partition(path, frame)
+                elif os.path.exists(path):
+                    os.remove(path)
+                table_manifest[key] = fingerprint
+                written[table_name].append(key)
+
+    manifest['exported_at'] = datetime.now().isoformat()
+    os.makedirs(base_dir, exist_ok=True)
+    if written['product'] or not os.path.exists(sales_summary.path(base_dir)):
+        export_sales_summary(base_dir, manifest['exported_at'])
+    _save_manifest(base_dir, manifest)
+    return written
+
+
+def load(base_dir, table_name, columns=None, start=None, end=None):
+    """读取 [start, end] 所在月份的分区，只加载 columns 中的列，返回 pyarrow.Table"""
+    table_dir = os.path.join(base_dir, table_name)
+    if not os.path.isdir(table_dir):
+        return None
+
+    months = sorted(
+        name.split('=', 1)[1] for name in os.listdir(table_dir) if name.startswith('month=')
+    )
+    if start is not None:
+        months = [m for m in months if m >= month_key(start)]
+    if end is not None:
+        months = [m for m in months if m <= month_key(end)]
+
+    tables = [
+        pq.read_table(partition_path(base_dir, table_name, month), columns=columns, memory_map=True)
+        for month in months
+        if os.path.exists(partition_path(base_dir, table_name, month))
+    ]
+    if not tables:
+        return None
+    return pa.concat_tables(tables)
+
+
+def export_sales_summary(base_dir, exported_at):
+    """按 (月份, 门店, 商品) 汇总所有月份的销售，写入 sales_summary.json 供网页端读取"""
+    table = load(base_dir, 'product', ['store_id', 'name', 'type', 'date', 'price_fen', 'quantity_g'])
+    rows = []
+    if table is not None:
+        frame = table.to_pandas()
+        frame = frame[frame['type'] == 'sale']
+        quantity_g = frame['quantity_g'].fillna(0).astype('int64')
+        frame = frame.assign(
+            month=frame['date'].dt.strftime('%Y-%m'),
+            store_id=frame['store_id'].fillna(DEFAULT_STORE_ID).astype('int64'),
+            quantity_g=quantity_g,
+            fen_grams=frame['price_fen'].fillna(0).astype('int64') * quantity_g
+        )
+        grouped = frame.groupby(['month', 'store_id', 'name'], as_index=False).agg(
+            quantity_g=('quantity_g', 'sum'),
+            fen_grams=('fen_grams', 'sum')
+        )
+        rows = [
+            (month, int(store_id), name, int(quantity), int(fen_grams))
+            for month, store_id, name, quantity, fen_grams in grouped[sales_summary.COLUMNS].itertuples(index=False)
+        ]
+    sales_summary.save(base_dir, rows, exported_at)
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出分析快照')
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--full', action='store_true', help='全量重新导出')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    with app.app_context():
+        written = export_snapshot(db.engine, app.config['ANALYTICS_DIR'], full=args.full)
+    for table_name, months in written.items():
+        print(f"{table_name}: {', '.join(months) if months else '无变化'}")
+
+
+if __name__ == '__main__':
+    main()
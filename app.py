@@ -1,42 +1,51 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Response, make_response, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, session
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from datetime import datetime, timedelta
+import hashlib
+import hmac
+import json
 import os
-import sys
 import logging
-import pandas as pd
-from io import BytesIO
 from config import Config
 from dotenv import load_dotenv
-from sqlalchemy import func
 from functools import lru_cache
 from flask_wtf.csrf import CSRFProtect, CSRFError
-
-# 配置日志
-logging.basicConfig(
-    stream=sys.stdout,
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy.exc import IntegrityError
+from models import db, VEGETABLES, DEFAULT_STORE_ID, User, ProductPrice, ActivityLog, Product, Store, Job
+import repository
+import reports
+import sync
+import auth
+import forecast
+import losses
+import sales_summary
+import idempotency
+import stock
+import live
+import database
+import changes
+import jobs
+import closing
+import warmup
+import profiling
+import logging_setup
+from coalescer import coalescer
+from numeric import parse_decimal, fen_to_yuan, grams_to_jin
 
 load_dotenv()
 
+# 配置日志：写日志只放入队列，由后台线程输出 (logging_setup.py)
+logging_setup.configure(Config)
+logger = logging.getLogger(__name__)
+
 # 获取当前文件所在目录的绝对路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
-logger.debug(f"Current directory: {current_dir}")
-logger.debug(f"Template folder: {os.path.join(current_dir, 'templates')}")
-logger.debug(f"Static folder: {os.path.join(current_dir, 'static')}")
 
 # 检查模板目录是否存在
 template_dir = os.path.join(current_dir, 'templates')
-if os.path.exists(template_dir):
-    logger.debug(f"Template directory exists: {template_dir}")
-    logger.debug(f"Template files: {os.listdir(template_dir)}")
-else:
-    logger.error(f"Template directory does not exist: {template_dir}")
+if not os.path.exists(template_dir):
+    logger.error("Template directory does not exist: %s", template_dir)
 
 app = Flask(__name__, 
     template_folder=template_dir,
@@ -48,101 +57,117 @@ app.config.from_object(Config)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///inventory.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_POOL_SIZE'] = 10
-app.config['SQLALCHEMY_MAX_OVERFLOW'] = 20
-app.config['SQLALCHEMY_POOL_TIMEOUT'] = 30
-app.config['SQLALCHEMY_POOL_RECYCLE'] = 1800
+app.config['DATABASE_REPLICA_URL'] = os.getenv('DATABASE_REPLICA_URL')
+app.config['JOB_DIR'] = os.path.join(current_dir, app.config['JOB_DIR'])
+app.config['BACKUP_DIR'] = os.path.join(current_dir, app.config['BACKUP_DIR'])
+app.config['PROFILE_DIR'] = os.path.join(current_dir, app.config['PROFILE_DIR'])
+database.configure(app)
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
 # 添加缓存配置
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 31536000  # 1年
 
+# 部署在反向代理之后时 remote_addr 是代理的地址，按 X-Forwarded-For 还原客户端 IP，
+# 否则所有用户共用一个登录限流桶
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
 # 初始化扩展
-db = SQLAlchemy(app)
+db.init_app(app)
+database.init_engines(app, db)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 csrf = CSRFProtect(app)
+auth.init_app(app)
+profiling.init_app(app)
+live.broker.poll_interval = app.config['LIVE_POLL_INTERVAL']
 
 # 添加错误处理
 @app.errorhandler(500)
 def internal_error(error):
-    logger.error(f"Internal Server Error: {str(error)}")
+    logger.error("Internal Server Error: %s", error)
     db.session.rollback()
     return render_template('error.html', error="服务器内部错误，请稍后重试"), 500
 
 @app.errorhandler(404)
 def not_found_error(error):
-    logger.error(f"Not Found Error: {str(error)}")
+    logger.info("Not Found: %s %s", request.method, request.path)
     return render_template('error.html', error="页面未找到"), 404
 
 @app.errorhandler(CSRFError)
 def handle_csrf_error(e):
-    logger.error(f"CSRF Error: {str(e)}")
+    logger.warning("CSRF Error: %s", e)
     flash('表单提交失败，请刷新页面重试', 'danger')
     return redirect(request.referrer or url_for('index'))
 
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
-    role = db.Column(db.String(20), default='user')  # 'admin' or 'user'
-    last_login = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, default=datetime.now)
-
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-    def is_admin(self):
-        print(f"Checking admin status for user {self.username}: role = {self.role}")
-        return self.role == 'admin'
-
-class ProductPrice(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    sale_price = db.Column(db.Float, nullable=False)
-    start_date = db.Column(db.DateTime, nullable=False, default=datetime.now)
-    end_date = db.Column(db.DateTime, nullable=True)  # 如果为null表示价格一直有效
-    created_at = db.Column(db.DateTime, default=datetime.now)
-    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
-
-    __table_args__ = (
-        db.UniqueConstraint('name', 'start_date', name='unique_price_period'),
-    )
-
-class ActivityLog(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
-    action = db.Column(db.String(100), nullable=False)
-    details = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
-    
-    user = db.relationship('User', backref=db.backref('activities', lazy=True))
-
-def log_activity(user_id, action, details=None):
+def log_activity(user_id, action, details=None, commit=True):
+    if commit and app.config['SQLITE_WRITE_COALESCE'] and not db.session().in_transaction():
+        # 业务数据已经提交，日志单独写入，与其他请求的日志合并成一次提交
+        values = {'user_id': user_id, 'action': action, 'details': details}
+        coalescer.execute(db.engine, lambda connection: connection.execute(ActivityLog.__table__.insert().values(values)))
+        return
     log = ActivityLog(user_id=user_id, action=action, details=details)
     db.session.add(log)
-    db.session.commit()
+    if commit:
+        db.session.commit()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-class Product(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False, index=True)
-    type = db.Column(db.String(20), nullable=False, index=True)  # 'purchase', 'sale', or 'inventory_check'
-    price = db.Column(db.Float, nullable=False)
-    quantity = db.Column(db.Integer, nullable=False)
-    actual_quantity = db.Column(db.Integer, default=0)  # For inventory check records
-    loss_quantity = db.Column(db.Integer, default=0)
-    date = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
-    notes = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.now)
-    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    return auth.load_user_snapshot(user_id)
+
+def current_store_id():
+    """当前请求操作的门店：普通用户固定为自己所属的门店，管理员可以切换"""
+    if not current_user.is_authenticated:
+        return DEFAULT_STORE_ID
+    if current_user.is_admin():
+        return session.get('store_id', current_user.store_id)
+    return current_user.store_id
+
+def get_store_product(id):
+    """按 id 读取当前门店的记录，其他门店的记录按不存在处理"""
+    product = Product.query.get_or_404(id)
+    if product.store_id != current_store_id():
+        abort(404)
+    return product
+
+def ensure_open(days, store_id):
+    """日期已结账时提示并返回 False；在写入记录的事务中调用"""
+    try:
+        closing.check_open(db.session, days, store_id)
+    except closing.DayClosed as e:
+        db.session.rollback()
+        flash(f'{e.day:%Y-%m-%d} 已结账，需要管理员重新开账后才能修改', 'danger')
+        return False
+    return True
+
+def closed_etag(*covers):
+    """页面涉及的日期都已结账时返回 ETag，否则返回 None
+
+    covers 为 closing.covering_close 的结果；重新开账后再结账会换一个 ETag。
+    """
+    if not covers or not all(covers):
+        return None
+    parts = [request.full_path, str(current_user.id), str(current_store_id())]
+    parts += [f'{close.id}@{close.closed_at.isoformat()}' for close in covers]
+    return hashlib.sha1(':'.join(parts).encode('utf-8')).hexdigest()
+
+def cache_closed(response, etag):
+    """已结账日期的内容不再变化，允许浏览器长期缓存；页面随登录用户和门店变化，按 Cookie 区分"""
+    response = make_response(response)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['CLOSED_DAY_MAX_AGE']
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+@app.context_processor
+def inject_store():
+    if not current_user.is_authenticated:
+        return {}
+    store_id = current_store_id()
+    stores = Store.query.order_by(Store.id).all() if current_user.is_admin() else []
+    return {'current_store_id': store_id, 'stores': stores}
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -152,13 +177,34 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        
+        if not auth.allow_login_attempt(request.remote_addr, username):
+            flash('登录尝试过于频繁，请稍后再试', 'danger')
+            return render_template('login.html'), 429
+        
         user = User.query.filter_by(username=username).first()
+        user_id, password_hash = (user.id, user.password_hash) if user is not None else (None, None)
+        # 先结束查询用户的事务再校验密码，校验期间不占用事务（SQLite 上也不占写锁）
+        db.session.commit()
+        try:
+            valid = password_hash is not None and auth.verify_password(password_hash, password)
+        except auth.LoginBusy:
+            flash('系统繁忙，请稍后再试', 'danger')
+            return render_template('login.html'), 503
         
-        if user and user.check_password(password):
-            user.last_login = datetime.now()
-            db.session.commit()
+        if valid:
+            # 哈希参数调整后，用本次输入的明文密码重新计算，在取得写锁之前算好
+            new_hash = None
+            if auth.needs_rehash(password_hash, app.config['PASSWORD_HASH_METHOD']):
+                new_hash = auth.hash_password(password, app.config['PASSWORD_HASH_METHOD'])
+            with database.writing():
+                user = db.session.get(User, user_id)
+                if new_hash is not None:
+                    user.password_hash = new_hash
+                user.last_login = datetime.now()
+                log_activity(user.id, '用户登录', commit=False)
+                db.session.commit()
             login_user(user)
-            log_activity(user.id, '用户登录')
             return redirect(url_for('index'))
         flash('用户名或密码错误', 'danger')
     
@@ -184,8 +230,9 @@ def register():
         
         user = User(username=username)
         user.set_password(password)
-        db.session.add(user)
-        db.session.commit()
+        with database.writing():
+            db.session.add(user)
+            db.session.commit()
         
         flash('注册成功，请登录', 'success')
         return redirect(url_for('login'))
@@ -198,26 +245,61 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+def publish_live(day, names):
+    """把受影响商品的最新汇总推送给打开的页面，随本次写入一起提交"""
+    live.publish(db.session, day, names, app.config['LIVE_EVENT_RETENTION'], current_store_id())
+
+def begin_idempotent(user_id, json_response=False):
+    """读取请求中的幂等键；重复提交时返回 (键, 第一次的响应)，否则返回 (键, None)"""
+    try:
+        key = idempotency.request_key()
+        saved = idempotency.lookup(db.session, key, user_id, request.endpoint) if key else None
+    except (ValueError, idempotency.KeyConflict):
+        if json_response:
+            return None, (jsonify({'error': 'invalid idempotency key'}), 422)
+        flash('提交标识无效，请刷新页面后重试', 'danger')
+        return None, redirect(url_for('index'))
+    if saved is None:
+        return key, None
+    return key, idempotency.replay_json(saved) if json_response else idempotency.replay_redirect(saved)
+
+def replay_after_conflict(key, user_id, json_response=False):
+    """提交时幂等键冲突，说明同一个键的并发请求已经写入，返回它的结果"""
+    db.session.rollback()
+    saved = idempotency.lookup(db.session, key, user_id, request.endpoint) if key else None
+    if saved is None:
+        return None
+    return idempotency.replay_json(saved) if json_response else idempotency.replay_redirect(saved)
+
 @app.route('/batch/<type>', methods=['GET', 'POST'])
 @login_required
+@database.writes('POST')
 def batch_operation(type):
     if type not in ['purchase', 'sale', 'inventory_check']:
         return redirect(url_for('index'))
     
     if request.method == 'POST':
+        idempotency_key, replay = begin_idempotent(current_user.id)
+        if replay is not None:
+            return replay
+        
         date = datetime.strptime(request.form['date'], '%Y-%m-%d')
         today = datetime.now().date()
+        store_id = current_store_id()
         
         # 验证日期是否为今天
         if date.date() > today:
             flash('不能添加未来日期的记录！', 'danger')
             return redirect(url_for('index'))
+        if not ensure_open([date], store_id):
+            return redirect(url_for('index'))
             
         notes = request.form.get('notes', '')
         
-        vegetables = ['空心菜', '水白菜', '水萝卜', '油麦菜', '菜心', '塔菜', '白萝卜', '快白菜', '小白菜', '大白菜']
+        vegetables = VEGETABLES
         total_items = 0
         items_details = []
+        touched = []
         
         for i, vegetable in enumerate(vegetables, 1):
             quantity_str = request.form.get(f'quantity_{vegetable}', '')
@@ -225,7 +307,7 @@ def batch_operation(type):
                 continue
                 
             try:
-                quantity = float(quantity_str)
+                quantity = parse_decimal(quantity_str)
                 if quantity <= 0:  # 如果数量小于等于0，跳过这个商品
                     continue
                     
@@ -233,100 +315,123 @@ def batch_operation(type):
                 
                 if type == 'sale':
                     # 获取预设价格
-                    price_record = ProductPrice.query.filter_by(name=vegetable).first()
+                    price_record = ProductPrice.query.filter_by(store_id=store_id, name=vegetable).first()
                     if not price_record:
                         flash(f'商品 {vegetable} 没有设置价格，请联系管理员', 'danger')
                         return redirect(url_for('index'))
-                    price = price_record.sale_price
+                    price = fen_to_yuan(price_record.sale_price_fen)
                 elif type == 'purchase':
-                    price = float(request.form.get(f'price_{vegetable}', 0))
+                    price = parse_decimal(request.form.get(f'price_{vegetable}', 0))
                     if price <= 0:
                         flash(f'商品 {vegetable} 的价格必须大于0', 'danger')
                         return redirect(url_for('index'))
                 else:  # inventory_check
-                    price = float(request.form.get(f'price_{vegetable}', 0))
-                    actual_quantity = float(request.form.get(f'actual_quantity_{vegetable}', 0))
+                    price = parse_decimal(request.form.get(f'price_{vegetable}', 0))
+                    actual_quantity = parse_decimal(request.form.get(f'actual_quantity_{vegetable}', 0))
                     loss_quantity = max(0, quantity - actual_quantity)  # 计算损耗数量
                     items_details.append(f"{vegetable}: 系统记录 {quantity}，实际盘点 {actual_quantity}，损耗 {loss_quantity}")
                 
                 if type == 'inventory_check':
-                    product = Product(
-                        name=vegetable,
-                        type=type,
-                        price=price,
-                        quantity=quantity,
-                        actual_quantity=actual_quantity,
-                        loss_quantity=loss_quantity,
-                        date=date,
-                        notes=notes
-                    )
+                    repository.add_record(db.session, vegetable, type, price, quantity, date, notes,
+                                          actual_quantity=actual_quantity, loss_quantity=loss_quantity,
+                                          store_id=store_id)
                 else:
-                    product = Product(
-                        name=vegetable,
-                        type=type,
-                        price=price,
-                        quantity=quantity,
-                        date=date,
-                        notes=notes
-                    )
-                db.session.add(product)
+                    repository.add_record(db.session, vegetable, type, price, quantity, date, notes,
+                                          check_stock=(type == 'sale'), store_id=store_id)
                 
+                touched.append(vegetable)
                 if type != 'inventory_check':
                     items_details.append(f"{vegetable}: {quantity}")
                 
             except ValueError:
+                db.session.rollback()
                 flash(f'商品 {vegetable} 的数量或价格格式不正确', 'danger')
                 return redirect(url_for('index'))
+            except stock.InsufficientStock as e:
+                # 已扣减的其他商品库存随事务一起回滚
+                db.session.rollback()
+                flash(f'商品 {vegetable} 库存不足，当前库存 {grams_to_jin(e.available_g)} 斤', 'danger')
+                return redirect(url_for('index'))
         
         if total_items == 0:
             flash('请至少输入一个商品的数量', 'danger')
             return redirect(url_for('index'))
             
         try:
+            publish_live(date.date(), touched)
+            if idempotency_key:
+                idempotency.record(db.session, idempotency_key, current_user.id, request.endpoint, 302,
+                                   {'message': '操作成功！', 'category': 'success', 'location': url_for('index')})
             db.session.commit()
             log_activity(current_user.id, f'批量{type}操作', f'添加了 {total_items} 个商品: {", ".join(items_details)}')
             flash('操作成功！', 'success')
-        except Exception as e:
+        except IntegrityError:
+            replay = replay_after_conflict(idempotency_key, current_user.id)
+            if replay is not None:
+                return replay
+            flash('操作失败，请重试', 'danger')
+        except Exception:
             db.session.rollback()
             flash('操作失败，请重试', 'danger')
-            print(f"Error: {str(e)}")
+            logger.exception("Batch %s failed", type)
         
         return redirect(url_for('index'))
     
     # GET 请求处理
     now = datetime.now()
-    price_dict = {p.name: p for p in ProductPrice.query.all()}
-    return render_template('batch_operation.html', type=type, now=now, price_dict=price_dict)
+    store_id = current_store_id()
+    price_dict = {p.name: p for p in ProductPrice.query.filter_by(store_id=store_id)}
+    # 进货时按预测销量预填建议数量(斤)
+    suggestions = {}
+    if type == 'purchase':
+        cached = forecast.get_suggestions(db.session, now.date(), compute_missing=False, store_id=store_id)
+        if not cached:
+            # 定时任务 forecast 还没算过时当场计算
+            with database.writing():
+                cached = forecast.get_suggestions(db.session, now.date(), app.config['FORECAST_HISTORY_DAYS'],
+                                                  store_id=store_id)
+        suggestions = {name: grams_to_jin(row.suggested_g) for name, row in cached.items()}
+    return render_template('batch_operation.html', type=type, now=now, price_dict=price_dict,
+                           suggestions=suggestions)
 
 @app.route('/update/<int:id>', methods=['GET', 'POST'])
 @login_required
+@database.writes('POST')
 def update_product(id):
-    product = Product.query.get_or_404(id)
+    product = get_store_product(id)
     
     if request.method == 'POST':
         old_data = {
             'name': product.name,
             'type': product.type,
-            'price': product.price,
-            'quantity': product.quantity,
+            'price': product.price_yuan,
+            'quantity': product.quantity_jin,
             'date': product.date.strftime('%Y-%m-%d'),
             'notes': product.notes
         }
         
+        new_date = datetime.strptime(request.form['date'], '%Y-%m-%d')
+        if not ensure_open([product.date, new_date], product.store_id):
+            return redirect(url_for('index'))
+        
         product.name = request.form['name']
         product.type = request.form['type']
-        product.price = float(request.form['price'])
-        product.quantity = int(request.form['quantity'])
-        product.date = datetime.strptime(request.form['date'], '%Y-%m-%d')
+        product.date = new_date
         product.notes = request.form['notes']
         
+        price = parse_decimal(request.form['price'])
+        quantity = parse_decimal(request.form['quantity'])
         if product.type == 'inventory_check':
-            product.actual_quantity = int(request.form['actual_quantity'])
-            product.loss_quantity = max(0, product.quantity - product.actual_quantity)
+            actual_quantity = parse_decimal(request.form['actual_quantity'])
+            product.set_amounts(price, quantity, actual_quantity, max(0, quantity - actual_quantity))
         else:
-            product.actual_quantity = 0
-            product.loss_quantity = 0
+            product.set_amounts(price, quantity)
         
+        stock.rebuild(db.session, [old_data['name'], product.name], product.store_id)
+        old_day = datetime.strptime(old_data['date'], '%Y-%m-%d').date()
+        if old_day != product.date.date():
+            publish_live(old_day, [old_data['name']])
+        publish_live(product.date.date(), [old_data['name'], product.name])
         db.session.commit()
         
         # 记录修改的详细信息
@@ -335,10 +440,10 @@ def update_product(id):
             changes.append(f"商品名称: {old_data['name']} -> {product.name}")
         if old_data['type'] != product.type:
             changes.append(f"类型: {old_data['type']} -> {product.type}")
-        if old_data['price'] != product.price:
-            changes.append(f"价格: {old_data['price']} -> {product.price}")
-        if old_data['quantity'] != product.quantity:
-            changes.append(f"数量: {old_data['quantity']} -> {product.quantity}")
+        if old_data['price'] != product.price_yuan:
+            changes.append(f"价格: {old_data['price']} -> {product.price_yuan}")
+        if old_data['quantity'] != product.quantity_jin:
+            changes.append(f"数量: {old_data['quantity']} -> {product.quantity_jin}")
         if old_data['date'] != product.date.strftime('%Y-%m-%d'):
             changes.append(f"日期: {old_data['date']} -> {product.date.strftime('%Y-%m-%d')}")
         if old_data['notes'] != product.notes:
@@ -367,6 +472,7 @@ def get_products_for_date(date_str):
 
 @app.route('/', methods=['GET'])
 @login_required
+@database.read_replica
 def index():
     date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
     try:
@@ -374,184 +480,218 @@ def index():
     except ValueError:
         selected_date = datetime.now()
     
-    start_date = datetime.combine(selected_date, datetime.min.time())
-    end_date = datetime.combine(selected_date, datetime.max.time())
-    
-    # 获取所有商品名称
-    vegetables = ['空心菜', '水白菜', '水萝卜', '油麦菜', '菜心', '塔菜', '白萝卜', '快白菜', '小白菜', '大白菜']
-    
-    # 初始化库存数据
-    inventory_data = {}
-    for vegetable in vegetables:
-        inventory_data[vegetable] = {
-            'purchase_quantity': 0,
-            'purchase_amount': 0,
-            'sale_quantity': 0,
-            'sale_amount': 0,
-            'actual_quantity': 0,
-            'loss_quantity': 0,
-            'profit': 0,
-            'current_stock': 0
-        }
+    start_date, end_date = reports.day_bounds(selected_date)
+    store_id = current_store_id()
+    etag = closed_etag(closing.covering_close(db.session, selected_date, store_id))
+    if etag and etag in request.if_none_match:
+        return cache_closed(Response(), etag)
     
-    # 获取当天的进货记录
-    purchases = Product.query.filter(
-        Product.date >= start_date,
-        Product.date <= end_date,
-        Product.type == 'purchase'
-    ).all()
+    # 当天进销存汇总，金额和数量在 SQL 中按分、克做整数求和；已结账的日期读取结账时保存的汇总
+    summary = closing.daily_summary(db.session, selected_date, store_id)
+    inventory_data = reports.to_display(summary)
+    total_purchase_value, total_sales_value, _ = reports.totals(summary)
     
-    # 获取当天的销售记录
-    sales = Product.query.filter(
-        Product.date >= start_date,
-        Product.date <= end_date,
-        Product.type == 'sale'
-    ).all()
+    # 详细记录只渲染第一页，其余由页面通过 /api/records 按需加载
+    products, next_cursor = repository.page_records(
+        db.session, start_date, end_date, limit=app.config['RECORDS_PAGE_SIZE'], store_id=store_id)
     
-    # 获取当天的盘点记录
-    inventory_checks = Product.query.filter(
-        Product.date >= start_date,
-        Product.date <= end_date,
-        Product.type == 'inventory_check'
-    ).all()
-    
-    # 获取历史库存数据（从最早记录到选定日期）
-    historical_purchases = Product.query.filter(
-        Product.date <= end_date,
-        Product.type == 'purchase'
-    ).all()
-    
-    historical_sales = Product.query.filter(
-        Product.date <= end_date,
-        Product.type == 'sale'
-    ).all()
-    
-    # 计算历史库存
-    for purchase in historical_purchases:
-        if purchase.name in inventory_data:
-            inventory_data[purchase.name]['current_stock'] += purchase.quantity
-    
-    for sale in historical_sales:
-        if sale.name in inventory_data:
-            inventory_data[sale.name]['current_stock'] -= sale.quantity
-    
-    # 统计当天的进货数据
-    for purchase in purchases:
-        if purchase.name in inventory_data:
-            inventory_data[purchase.name]['purchase_quantity'] += purchase.quantity
-            inventory_data[purchase.name]['purchase_amount'] += purchase.price * purchase.quantity
-    
-    # 统计当天的销售数据
-    for sale in sales:
-        if sale.name in inventory_data:
-            inventory_data[sale.name]['sale_quantity'] += sale.quantity
-            inventory_data[sale.name]['sale_amount'] += sale.price * sale.quantity
-            # 计算利润（销售金额 - 进货金额）
-            if inventory_data[sale.name]['purchase_quantity'] > 0:
-                avg_purchase_price = inventory_data[sale.name]['purchase_amount'] / inventory_data[sale.name]['purchase_quantity']
-                inventory_data[sale.name]['profit'] += (sale.price - avg_purchase_price) * sale.quantity
-    
-    # 统计当天的盘点数据
-    for check in inventory_checks:
-        if check.name in inventory_data:
-            inventory_data[check.name]['actual_quantity'] = check.actual_quantity
-            inventory_data[check.name]['loss_quantity'] = check.loss_quantity
-            inventory_data[check.name]['current_stock'] = check.actual_quantity
-    
-    # 获取所有记录用于详细记录表格
-    products = Product.query.filter(
-        Product.date >= start_date,
-        Product.date <= end_date
-    ).order_by(Product.date.desc()).all()
-    
-    # 计算总金额
-    total_purchase_value = sum(data['purchase_amount'] for data in inventory_data.values())
-    total_sales_value = sum(data['sale_amount'] for data in inventory_data.values())
-    
-    return render_template('index.html',
+    page = render_template('index.html',
                          date=selected_date,
+                         day_closed=etag is not None,
                          products=products,
+                         next_cursor=next_cursor,
                          inventory_data=inventory_data,
                          total_purchase_value=total_purchase_value,
                          total_sales_value=total_sales_value)
+    return cache_closed(page, etag) if etag else page
+
+@app.route('/api/records', methods=['GET'])
+@login_required
+@database.read_replica
+def api_records():
+    date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    try:
+        selected_date = datetime.strptime(date_str, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': '日期格式不正确'}), 400
+    
+    type = request.args.get('type') or None
+    if type and type not in ['purchase', 'sale', 'inventory_check']:
+        return jsonify({'error': '记录类型不正确'}), 400
+    limit = min(max(request.args.get('limit', app.config['RECORDS_PAGE_SIZE'], type=int), 1), 500)
+    
+    try:
+        products, next_cursor = repository.page_records(
+            db.session,
+            start_date=datetime.combine(selected_date, datetime.min.time()),
+            end_date=datetime.combine(selected_date, datetime.max.time()),
+            type=type,
+            name=request.args.get('name') or None,
+            search=request.args.get('q') or None,
+            cursor=request.args.get('cursor') or None,
+            limit=limit,
+            store_id=current_store_id()
+        )
+    except ValueError:
+        return jsonify({'error': '分页游标不正确'}), 400
+    
+    return jsonify({
+        'records': [repository.record_to_json(p) for p in products],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/delete/<int:id>', methods=['GET', 'POST'])
 @login_required
+@database.writes()
 def delete_product(id):
-    product = Product.query.get_or_404(id)
-    product_info = f"商品: {product.name}, 类型: {product.type}, 数量: {product.quantity}, 日期: {product.date.strftime('%Y-%m-%d')}"
+    product = get_store_product(id)
+    if not ensure_open([product.date], product.store_id):
+        return redirect(url_for('index'))
+    product_info = f"商品: {product.name}, 类型: {product.type}, 数量: {product.quantity_jin}, 日期: {product.date.strftime('%Y-%m-%d')}"
     db.session.delete(product)
+    stock.rebuild(db.session, [product.name], product.store_id)
+    publish_live(product.date.date(), [product.name])
     db.session.commit()
     log_activity(current_user.id, '删除商品记录', product_info)
     flash('记录已删除！', 'success')
     return redirect(url_for('index'))
 
+def enqueue_job(kind, params=None):
+    """为当前用户排队一个后台任务并提交；排队任务过多时返回 None"""
+    try:
+        job = jobs.enqueue(db.session, kind, params, current_user.id, current_store_id(),
+                           app.config['JOB_MAX_PENDING'])
+    except jobs.TooManyJobs:
+        db.session.rollback()
+        flash('您排队中的任务过多，请等待完成后再提交', 'warning')
+        return None
+    db.session.commit()
+    return job
+
 @app.route('/export', methods=['GET'])
 @login_required
+@database.writes()
 def export_excel():
-    today = datetime.now().date()
-    start_date = datetime.combine(today, datetime.min.time())
-    end_date = datetime.combine(today, datetime.max.time())
+    """导出进货、销售、盘点记录，日期参数 start/end 为 YYYY-MM-DD，默认今天；由后台任务生成文件"""
+    try:
+        today = datetime.now().strftime('%Y-%m-%d')
+        start = datetime.strptime(request.args.get('start', today), '%Y-%m-%d')
+        end = datetime.strptime(request.args.get('end', request.args.get('start', today)), '%Y-%m-%d')
+    except ValueError:
+        flash('日期格式应为 YYYY-MM-DD', 'danger')
+        return redirect(url_for('index'))
+    if end < start:
+        flash('结束日期不能早于开始日期', 'danger')
+        return redirect(url_for('index'))
     
-    products = Product.query.filter(
-        Product.date >= start_date,
-        Product.date <= end_date
-    ).order_by(Product.type, Product.name).all()
-    
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        # 进货记录
-        purchase_data = []
-        for p in products:
-            if p.type == 'purchase':
-                purchase_data.append({
-                    '商品名称': p.name,
-                    '进货价格': p.price,
-                    '数量': p.quantity,
-                    '进货日期': p.date.strftime('%Y-%m-%d'),
-                    '备注': p.notes
-                })
-        if purchase_data:
-            pd.DataFrame(purchase_data).to_excel(writer, sheet_name='进货记录', index=False)
-        
-        # 销售记录
-        sale_data = []
-        for p in products:
-            if p.type == 'sale':
-                sale_data.append({
-                    '商品名称': p.name,
-                    '销售价格': p.price,
-                    '数量': p.quantity,
-                    '销售日期': p.date.strftime('%Y-%m-%d'),
-                    '备注': p.notes
-                })
-        if sale_data:
-            pd.DataFrame(sale_data).to_excel(writer, sheet_name='销售记录', index=False)
-        
-        # 盘点记录
-        inventory_data = []
-        for p in products:
-            if p.type == 'inventory_check':
-                inventory_data.append({
-                    '商品名称': p.name,
-                    '进货价格': p.price,
-                    '盘点数量': p.quantity,
-                    '实际数量': p.actual_quantity,
-                    '亏损数量': p.loss_quantity,
-                    '盘点日期': p.date.strftime('%Y-%m-%d'),
-                    '备注': p.notes
-                })
-        if inventory_data:
-            pd.DataFrame(inventory_data).to_excel(writer, sheet_name='盘点记录', index=False)
-    
-    output.seek(0)
-    log_activity(current_user.id, '导出Excel', f'导出日期: {today.strftime("%Y-%m-%d")}')
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f'库存记录_{today.strftime("%Y%m%d")}.xlsx'
-    )
+    start_date, end_date = reports.day_bounds(start)[0], reports.day_bounds(end)[1]
+    job = enqueue_job('export', {'start': start_date.isoformat(), 'end': end_date.isoformat()})
+    if job is not None:
+        log_activity(current_user.id, '导出Excel', f'导出日期: {start:%Y-%m-%d} 至 {end:%Y-%m-%d}')
+        flash('导出任务已提交，完成后可在任务列表下载', 'info')
+    return redirect(url_for('job_list'))
+
+@app.route('/jobs', methods=['GET'])
+@login_required
+def job_list():
+    """当前用户的后台任务，管理员可以看到所有任务"""
+    query = Job.query
+    if not current_user.is_admin():
+        query = query.filter(Job.user_id == current_user.id)
+    recent = query.order_by(Job.id.desc()).limit(50).all()
+    return render_template('jobs.html', jobs=[jobs.to_json(job) for job in recent])
+
+def get_user_job(job_id):
+    """只能查看自己的任务，管理员不受限制"""
+    job = db.get_or_404(Job, job_id)
+    if job.user_id != current_user.id and not current_user.is_admin():
+        abort(404)
+    return job
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def api_job(job_id):
+    """任务状态和进度，页面轮询使用"""
+    return jsonify(jobs.to_json(get_user_job(job_id)))
+
+@app.route('/jobs/<int:job_id>/download', methods=['GET'])
+@login_required
+def download_job(job_id):
+    job = get_user_job(job_id)
+    if job.status != 'done' or not job.result_path or not os.path.exists(job.result_path):
+        abort(404)
+    return send_file(job.result_path, as_attachment=True, download_name=job.result_name)
+
+@app.route('/admin/jobs/analytics', methods=['POST'])
+@login_required
+@database.writes()
+def run_analytics_job():
+    """重新导出分析用的 Parquet 快照，full=1 时全部月份重写"""
+    if not current_user.is_admin():
+        flash('您没有权限执行此操作', 'danger')
+        return redirect(url_for('index'))
+    if enqueue_job('analytics', {'full': request.form.get('full') == '1'}) is not None:
+        flash('分析快照任务已提交', 'info')
+    return redirect(url_for('job_list'))
+
+@app.route('/admin/jobs/loss_rebuild', methods=['POST'])
+@login_required
+@database.writes()
+def run_loss_rebuild_job():
+    """按全部盘点记录重新计算损耗统计"""
+    if not current_user.is_admin():
+        flash('您没有权限执行此操作', 'danger')
+        return redirect(url_for('index'))
+    if enqueue_job('loss_rebuild') is not None:
+        flash('损耗重算任务已提交', 'info')
+    return redirect(url_for('job_list'))
+
+@app.route('/admin/jobs/backup', methods=['POST'])
+@login_required
+@database.writes()
+def run_backup_job():
+    """在后台备份数据库，incremental=1 时 PostgreSQL 只备份上次之后的变化"""
+    if not current_user.is_admin():
+        flash('您没有权限执行此操作', 'danger')
+        return redirect(url_for('index'))
+    if enqueue_job('backup', {'incremental': request.form.get('incremental') == '1'}) is not None:
+        flash('备份任务已提交', 'info')
+    return redirect(url_for('job_list'))
+
+@app.route('/admin/profiles')
+@login_required
+def profile_list():
+    """请求性能分析报告，在页面地址后加 ?_profile=1 生成"""
+    if not current_user.is_admin():
+        flash('您没有权限访问此页面', 'danger')
+        return redirect(url_for('index'))
+    return render_template('profiles.html', profiles=profiling.list_reports())
+
+@app.route('/admin/profiles/<report_id>')
+@login_required
+def profile_detail(report_id):
+    if not current_user.is_admin():
+        flash('您没有权限访问此页面', 'danger')
+        return redirect(url_for('index'))
+    report = profiling.load_report(report_id)
+    if report is None:
+        abort(404)
+    if request.args.get('format') == 'json':
+        return jsonify(report)
+    return render_template('profile.html', profile=report)
+
+@app.route('/admin/profiles/<report_id>/collapsed')
+@login_required
+def profile_collapsed(report_id):
+    """导出 collapsed stack 文件，可用 flamegraph.pl 或 speedscope 打开"""
+    if not current_user.is_admin():
+        flash('您没有权限访问此页面', 'danger')
+        return redirect(url_for('index'))
+    report = profiling.load_report(report_id)
+    if report is None:
+        abort(404)
+    return Response(profiling.collapsed(report), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={report_id}.collapsed.txt'})
 
 @app.route('/change_password', methods=['GET', 'POST'])
 @login_required
@@ -569,8 +709,12 @@ def change_password():
             flash('两次输入的新密码不一致', 'danger')
             return render_template('change_password.html')
         
-        current_user.set_password(new_password)
-        db.session.commit()
+        password_hash = auth.hash_password(new_password, app.config['PASSWORD_HASH_METHOD'])
+        with database.writing():
+            user = current_user.load()
+            user.password_hash = password_hash
+            db.session.commit()
+        auth.user_cache.invalidate(current_user.id)
         flash('密码修改成功', 'success')
         return redirect(url_for('index'))
     
@@ -588,6 +732,7 @@ def admin_users():
 
 @app.route('/admin/users/add', methods=['GET', 'POST'])
 @login_required
+@database.writes('POST')
 def add_user():
     if not current_user.is_admin():
         flash('您没有权限访问此页面', 'danger')
@@ -597,12 +742,17 @@ def add_user():
         username = request.form['username']
         password = request.form['password']
         role = request.form['role']
+        store_id = request.form.get('store_id', DEFAULT_STORE_ID, type=int)
         
         if User.query.filter_by(username=username).first():
             flash('用户名已存在', 'danger')
             return render_template('add_user.html')
         
-        user = User(username=username, role=role)
+        if db.session.get(Store, store_id) is None:
+            flash('门店不存在', 'danger')
+            return render_template('add_user.html')
+        
+        user = User(username=username, role=role, store_id=store_id)
         user.set_password(password)
         db.session.add(user)
         db.session.commit()
@@ -615,6 +765,7 @@ def add_user():
 
 @app.route('/admin/users/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
+@database.writes('POST')
 def edit_user(id):
     if not current_user.is_admin():
         flash('您没有权限访问此页面', 'danger')
@@ -625,11 +776,17 @@ def edit_user(id):
     if request.method == 'POST':
         user.username = request.form['username']
         user.role = request.form['role']
+        store_id = request.form.get('store_id', user.store_id, type=int)
+        if db.session.get(Store, store_id) is None:
+            flash('门店不存在', 'danger')
+            return render_template('edit_user.html', user=user)
+        user.store_id = store_id
         
         if request.form.get('password'):
             user.set_password(request.form['password'])
         
         db.session.commit()
+        auth.user_cache.invalidate(user.id)
         log_activity(current_user.id, f'编辑用户: {user.username}')
         flash('用户更新成功', 'success')
         return redirect(url_for('admin_users'))
@@ -638,6 +795,7 @@ def edit_user(id):
 
 @app.route('/admin/users/delete/<int:id>', methods=['GET'])
 @login_required
+@database.writes()
 def delete_user(id):
     if not current_user.is_admin():
         flash('您没有权限访问此页面', 'danger')
@@ -651,13 +809,90 @@ def delete_user(id):
     username = user.username
     db.session.delete(user)
     db.session.commit()
+    auth.user_cache.invalidate(id)
     
     log_activity(current_user.id, f'删除用户: {username}')
     flash('用户删除成功', 'success')
     return redirect(url_for('admin_users'))
 
+@app.route('/admin/stores', methods=['GET', 'POST'])
+@login_required
+@database.writes('POST')
+def admin_stores():
+    if not current_user.is_admin():
+        flash('您没有权限访问此页面', 'danger')
+        return redirect(url_for('index'))
+    
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        if not name:
+            flash('请输入门店名称', 'danger')
+        elif Store.query.filter_by(name=name).first():
+            flash('门店名称已存在', 'danger')
+        else:
+            db.session.add(Store(name=name))
+            db.session.commit()
+            log_activity(current_user.id, f'添加门店: {name}')
+            flash('门店添加成功', 'success')
+        return redirect(url_for('admin_stores'))
+    
+    return render_template('admin_stores.html', stores=Store.query.order_by(Store.id).all())
+
+@app.route('/store/switch', methods=['POST'])
+@login_required
+def switch_store():
+    """管理员切换当前查看和录入的门店"""
+    if not current_user.is_admin():
+        flash('您没有权限切换门店', 'danger')
+        return redirect(url_for('index'))
+    
+    store = db.session.get(Store, request.form.get('store_id', type=int) or 0)
+    if store is None:
+        flash('门店不存在', 'danger')
+    else:
+        session['store_id'] = store.id
+        flash(f'已切换到 {store.name}', 'success')
+    return redirect(request.referrer or url_for('index'))
+
+@app.route('/api/reports/stores', methods=['GET'])
+@login_required
+@database.read_replica
+def api_store_rollup():
+    """各门店按商品汇总进货、销售和损耗，日期参数 start/end 为 YYYY-MM-DD，默认今天"""
+    if not current_user.is_admin():
+        return jsonify({'error': '没有权限'}), 403
+    
+    try:
+        today = datetime.now().strftime('%Y-%m-%d')
+        start = datetime.strptime(request.args.get('start', today), '%Y-%m-%d')
+        end = datetime.strptime(request.args.get('end', today), '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': '日期格式应为 YYYY-MM-DD'}), 400
+    
+    # 所有门店在结束日期都已结账时，结果不再变化
+    etag = closed_etag(*[closing.covering_close(db.session, end, store.id) for store in Store.query])
+    if etag and etag in request.if_none_match:
+        return cache_closed(Response(), etag)
+    
+    rows = reports.store_rollup(db.session, start, datetime.combine(end, datetime.max.time()))
+    response = jsonify([
+        {
+            'store_id': row['store_id'],
+            'store': row['store'],
+            'name': row['name'],
+            'purchase_quantity': float(grams_to_jin(row['purchase_g'])),
+            'purchase_amount': float(fen_to_yuan(row['purchase_fen'])),
+            'sale_quantity': float(grams_to_jin(row['sale_g'])),
+            'sale_amount': float(fen_to_yuan(row['sale_fen'])),
+            'loss_quantity': float(grams_to_jin(row['loss_g']))
+        }
+        for row in rows
+    ])
+    return cache_closed(response, etag) if etag else response
+
 @app.route('/admin/activities', methods=['GET'])
 @login_required
+@database.read_replica
 def admin_activities():
     if not current_user.is_admin():
         flash('您没有权限访问此页面', 'danger')
@@ -690,6 +925,7 @@ def admin_activities():
 
 @app.route('/inventory', methods=['GET'])
 @login_required
+@database.read_replica
 def inventory():
     # 获取日期参数，默认为今天
     date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
@@ -698,101 +934,81 @@ def inventory():
     except ValueError:
         selected_date = datetime.now()
     
-    # 获取所有商品名称
-    vegetables = ['空心菜', '水白菜', '水萝卜', '油麦菜', '菜心', '塔菜', '白萝卜', '快白菜', '小白菜', '大白菜']
+    store_id = current_store_id()
+    etag = closed_etag(closing.covering_close(db.session, selected_date, store_id))
+    if etag and etag in request.if_none_match:
+        return cache_closed(Response(), etag)
     
-    # 获取选定日期的所有记录
-    start_date = datetime.combine(selected_date, datetime.min.time())
-    end_date = datetime.combine(selected_date, datetime.max.time())
+    # 计算每个商品的库存情况，已结账的日期读取结账时保存的汇总
+    summary = closing.daily_summary(db.session, selected_date, store_id)
+    inventory_data = reports.to_display(summary)
+    total_purchase, total_sales, total_profit = reports.totals(summary)
     
-    # 获取当天的进货记录
-    purchases = Product.query.filter(
-        Product.date >= start_date,
-        Product.date <= end_date,
-        Product.type == 'purchase'
-    ).all()
-    
-    # 获取当天的销售记录
-    sales = Product.query.filter(
-        Product.date >= start_date,
-        Product.date <= end_date,
-        Product.type == 'sale'
-    ).all()
-    
-    # 获取当天的盘点记录
-    inventory_checks = Product.query.filter(
-        Product.date >= start_date,
-        Product.date <= end_date,
-        Product.type == 'inventory_check'
-    ).all()
-    
-    # 计算每个商品的库存情况
-    inventory_data = {}
-    for vegetable in vegetables:
-        inventory_data[vegetable] = {
-            'purchase_quantity': 0,
-            'purchase_amount': 0,
-            'sale_quantity': 0,
-            'sale_amount': 0,
-            'actual_quantity': 0,
-            'loss_quantity': 0,
-            'profit': 0,
-            'current_stock': 0
-        }
-    
-    # 获取历史库存数据（从最早记录到选定日期）
-    historical_purchases = Product.query.filter(
-        Product.date <= end_date,
-        Product.type == 'purchase'
-    ).all()
-    
-    historical_sales = Product.query.filter(
-        Product.date <= end_date,
-        Product.type == 'sale'
-    ).all()
-    
-    # 计算历史库存
-    for purchase in historical_purchases:
-        if purchase.name in inventory_data:
-            inventory_data[purchase.name]['current_stock'] += purchase.quantity
-    
-    for sale in historical_sales:
-        if sale.name in inventory_data:
-            inventory_data[sale.name]['current_stock'] -= sale.quantity
-    
-    # 统计当天的进货数据
-    for purchase in purchases:
-        if purchase.name in inventory_data:
-            inventory_data[purchase.name]['purchase_quantity'] += purchase.quantity
-            inventory_data[purchase.name]['purchase_amount'] += purchase.price * purchase.quantity
-    
-    # 统计当天的销售数据
-    for sale in sales:
-        if sale.name in inventory_data:
-            inventory_data[sale.name]['sale_quantity'] += sale.quantity
-            inventory_data[sale.name]['sale_amount'] += sale.price * sale.quantity
-            # 计算利润（销售金额 - 进货金额）
-            purchase_price = inventory_data[sale.name]['purchase_amount'] / inventory_data[sale.name]['purchase_quantity'] if inventory_data[sale.name]['purchase_quantity'] > 0 else 0
-            inventory_data[sale.name]['profit'] += (sale.price - purchase_price) * sale.quantity
-    
-    # 统计当天的盘点数据
-    for check in inventory_checks:
-        if check.name in inventory_data:
-            inventory_data[check.name]['actual_quantity'] = check.actual_quantity
-            inventory_data[check.name]['loss_quantity'] = check.loss_quantity
-            inventory_data[check.name]['current_stock'] = check.actual_quantity
-    
-    # 计算总金额
-    total_purchase = sum(data['purchase_amount'] for data in inventory_data.values())
-    total_sales = sum(data['sale_amount'] for data in inventory_data.values())
-    total_profit = sum(data['profit'] for data in inventory_data.values())
-    
-    return render_template('inventory.html',
+    page = render_template('inventory.html',
                          date=selected_date,
+                         day_closed=etag is not None,
                          inventory_data=inventory_data,
                          total_purchase=total_purchase,
                          total_sales=total_sales,
                          total_profit=total_profit)
+    return cache_closed(page, etag) if etag else page
+
+@app.route('/day/close', methods=['POST'])
+@login_required
+@database.writes()
+def close_day():
+    """日结：保存当天汇总，该日期及之前的记录不能再修改
+
+    只有管理员可以结账（重新开账同样需要管理员）。当天还在营业，结账今天需要 confirm=1。
+    """
+    if not current_user.is_admin():
+        flash('您没有权限执行此操作', 'danger')
+        return redirect(url_for('index'))
+    try:
+        day = datetime.strptime(request.form.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        flash('日期格式不正确', 'danger')
+        return redirect(url_for('index'))
+    if day == datetime.now().date() and request.form.get('confirm') != '1':
+        flash('今天还在营业，结账后今天及之前的记录都不能再修改；确认结账请勾选确认后再提交', 'warning')
+        return redirect(url_for('index', date=day.strftime('%Y-%m-%d')))
+    
+    try:
+        closing.close_day(db.session, day, current_user.id, current_store_id())
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+        return redirect(url_for('index'))
+    except IntegrityError:
+        # 同一天被同时结账，另一个请求已经完成
+        db.session.rollback()
+    log_activity(current_user.id, '日结', f'结账日期: {day:%Y-%m-%d}')
+    flash(f'{day:%Y-%m-%d} 已结账', 'success')
+    return redirect(url_for('index', date=day.strftime('%Y-%m-%d')))
+
+@app.route('/admin/day/reopen', methods=['POST'])
+@login_required
+@database.writes()
+def reopen_day():
+    """重新开账：该日期及之后的结账全部取消"""
+    if not current_user.is_admin():
+        flash('您没有权限执行此操作', 'danger')
+        return redirect(url_for('index'))
+    try:
+        day = datetime.strptime(request.form.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        flash('日期格式不正确', 'danger')
+        return redirect(url_for('index'))
+    
+    days = closing.reopen(db.session, day, current_store_id())
+    db.session.commit()
+    if days:
+        log_activity(current_user.id, '重新开账', ', '.join(d.strftime('%Y-%m-%d') for d in days))
+        flash(f'已重新开账 {len(days)} 天', 'success')
+    else:
+        flash('该日期之后没有结账记录', 'info')
+    return redirect(url_for('index', date=day.strftime('%Y-%m-%d')))
 
 @app.route('/admin/prices', methods=['GET'])
 @login_required
@@ -801,13 +1017,17 @@ def admin_prices():
         flash('您没有权限访问此页面', 'danger')
         return redirect(url_for('index'))
     
+    store_id = current_store_id()
+    
     # 获取当前有效的价格
     current_prices = ProductPrice.query.filter(
+        ProductPrice.store_id == store_id,
         (ProductPrice.end_date == None) | (ProductPrice.end_date > datetime.now())
     ).order_by(ProductPrice.name, ProductPrice.start_date.desc()).all()
     
     # 获取所有历史价格
     historical_prices = ProductPrice.query.filter(
+        ProductPrice.store_id == store_id,
         ProductPrice.end_date <= datetime.now()
     ).order_by(ProductPrice.name, ProductPrice.start_date.desc()).all()
     
@@ -818,25 +1038,29 @@ def admin_prices():
 
 @app.route('/admin/prices/edit', methods=['GET', 'POST'])
 @login_required
+@database.writes('POST')
 def edit_prices():
     if not current_user.is_admin():
         flash('您没有权限访问此页面', 'danger')
         return redirect(url_for('index'))
     
+    store_id = current_store_id()
+    
     if request.method == 'POST':
-        vegetables = ['空心菜', '水白菜', '水萝卜', '油麦菜', '菜心', '塔菜', '白萝卜', '快白菜', '小白菜', '大白菜']
+        vegetables = VEGETABLES
         
         for vegetable in vegetables:
-            sale_price = float(request.form.get(f'sale_price_{vegetable}', 0))
             start_date_str = request.form.get(f'start_date_{vegetable}')
             end_date_str = request.form.get(f'end_date_{vegetable}')
             
             try:
+                sale_price = parse_decimal(request.form.get(f'sale_price_{vegetable}', 0))
                 start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
                 end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
                 
                 # 检查是否有重叠的时间段
                 existing_price = ProductPrice.query.filter(
+                    ProductPrice.store_id == store_id,
                     ProductPrice.name == vegetable,
                     ProductPrice.start_date <= start_date,
                     (ProductPrice.end_date == None) | (ProductPrice.end_date >= start_date)
@@ -847,15 +1071,16 @@ def edit_prices():
                     return redirect(url_for('edit_prices'))
                 
                 price = ProductPrice(
+                    store_id=store_id,
                     name=vegetable,
-                    sale_price=sale_price,
                     start_date=start_date,
                     end_date=end_date
                 )
+                price.set_sale_price(sale_price)
                 db.session.add(price)
                 
             except ValueError:
-                flash(f'商品 {vegetable} 的日期格式不正确', 'danger')
+                flash(f'商品 {vegetable} 的价格或日期格式不正确', 'danger')
                 return redirect(url_for('edit_prices'))
         
         db.session.commit()
@@ -865,6 +1090,7 @@ def edit_prices():
     
     # GET请求处理
     current_prices = ProductPrice.query.filter(
+        ProductPrice.store_id == store_id,
         (ProductPrice.end_date == None) | (ProductPrice.end_date > datetime.now())
     ).order_by(ProductPrice.name, ProductPrice.start_date.desc()).all()
     
@@ -875,139 +1101,318 @@ def edit_prices():
 def get_current_price(vegetable_name):
     now = datetime.now()
     price = ProductPrice.query.filter(
+        ProductPrice.store_id == current_store_id(),
         ProductPrice.name == vegetable_name,
         ProductPrice.start_date <= now,
         (ProductPrice.end_date == None) | (ProductPrice.end_date > now)
     ).order_by(ProductPrice.start_date.desc()).first()
     return price
 
+def get_inventory_price_dict():
+    """获取所有蔬菜的当前库存和最近一次进货价格"""
+    store_id = current_store_id()
+    stock = repository.stock_by_name(db.session, VEGETABLES, store_id=store_id)
+    price_dict = {}
+    for vegetable in VEGETABLES:
+        latest_purchase = repository.latest_purchase(db.session, vegetable, store_id=store_id)
+        price_dict[vegetable] = type('PriceInfo', (), {
+            'quantity': stock[vegetable],
+            'price': latest_purchase.price_yuan if latest_purchase else 0
+        })
+    return price_dict
+
 @app.route('/batch/inventory_check', methods=['GET', 'POST'])
 @login_required
+@database.writes('POST')
 def inventory_check():
     if request.method == 'POST':
+        idempotency_key, replay = begin_idempotent(current_user.id)
+        if replay is not None:
+            return replay
+        
         date = datetime.strptime(request.form['date'], '%Y-%m-%d')
         notes = request.form.get('notes', '')
+        if not ensure_open([date], current_store_id()):
+            return redirect(url_for('index'))
         
         # 获取所有蔬菜的当前库存和最近进货价格
-        price_dict = {}
-        for vegetable in ['空心菜', '水白菜', '水萝卜', '油麦菜', '菜心', '塔菜', '白萝卜', '快白菜', '小白菜', '大白菜']:
-            # 获取当前库存
-            current_stock = Product.query.filter_by(
-                name=vegetable,
-                type='purchase'
-            ).with_entities(func.sum(Product.quantity)).scalar() or 0
-            
-            # 减去销售数量
-            sold_quantity = Product.query.filter_by(
-                name=vegetable,
-                type='sale'
-            ).with_entities(func.sum(Product.quantity)).scalar() or 0
-            
-            current_stock -= sold_quantity
-            
-            # 获取最近一次进货记录的价格
-            latest_purchase = Product.query.filter_by(
-                name=vegetable,
-                type='purchase'
-            ).order_by(Product.date.desc()).first()
-            
-            price_dict[vegetable] = type('PriceInfo', (), {
-                'quantity': current_stock,
-                'price': latest_purchase.price if latest_purchase else 0
-            })
+        price_dict = get_inventory_price_dict()
         
         # 处理每个蔬菜的盘点数据
-        for vegetable in ['空心菜', '水白菜', '水萝卜', '油麦菜', '菜心', '塔菜', '白萝卜', '快白菜', '小白菜', '大白菜']:
+        for vegetable in VEGETABLES:
             actual_quantity = request.form.get(f'actual_quantity_{vegetable}')
             system_quantity = request.form.get(f'quantity_{vegetable}')
             
             if actual_quantity:  # 只处理有实际数量的商品
-                actual_quantity = float(actual_quantity)
-                system_quantity = float(system_quantity) if system_quantity else 0
+                actual_quantity = parse_decimal(actual_quantity)
+                system_quantity = parse_decimal(system_quantity) if system_quantity else 0
                 loss_quantity = max(0, system_quantity - actual_quantity)
                 
                 # 创建盘点记录
-                product = Product(
-                    name=vegetable,
-                    type='inventory_check',
-                    price=price_dict[vegetable].price,
-                    quantity=system_quantity,
-                    actual_quantity=actual_quantity,
-                    loss_quantity=loss_quantity,
-                    date=date,
-                    notes=notes
-                )
-                db.session.add(product)
+                repository.add_record(db.session, vegetable, 'inventory_check', price_dict[vegetable].price,
+                                      system_quantity, date, notes,
+                                      actual_quantity=actual_quantity, loss_quantity=loss_quantity,
+                                      store_id=current_store_id())
         
-        db.session.commit()
+        publish_live(date.date(), [name for name in VEGETABLES if request.form.get(f'actual_quantity_{name}')])
+        if idempotency_key:
+            idempotency.record(db.session, idempotency_key, current_user.id, request.endpoint, 302,
+                               {'message': '盘点完成！', 'category': 'success', 'location': url_for('index')})
+        try:
+            db.session.commit()
+        except IntegrityError:
+            replay = replay_after_conflict(idempotency_key, current_user.id)
+            if replay is not None:
+                return replay
+            raise
         flash('盘点完成！', 'success')
         return redirect(url_for('index'))
     
     # 获取所有蔬菜的当前库存和最近进货价格
-    price_dict = {}
-    for vegetable in ['空心菜', '水白菜', '水萝卜', '油麦菜', '菜心', '塔菜', '白萝卜', '快白菜', '小白菜', '大白菜']:
-        # 获取当前库存
-        current_stock = Product.query.filter_by(
-            name=vegetable,
-            type='purchase'
-        ).with_entities(func.sum(Product.quantity)).scalar() or 0
-        
-        # 减去销售数量
-        sold_quantity = Product.query.filter_by(
-            name=vegetable,
-            type='sale'
-        ).with_entities(func.sum(Product.quantity)).scalar() or 0
-        
-        current_stock -= sold_quantity
-        
-        # 获取最近一次进货记录的价格
-        latest_purchase = Product.query.filter_by(
-            name=vegetable,
-            type='purchase'
-        ).order_by(Product.date.desc()).first()
-        
-        price_dict[vegetable] = type('PriceInfo', (), {
-            'quantity': current_stock,
-            'price': latest_purchase.price if latest_purchase else 0
-        })
+    price_dict = get_inventory_price_dict()
     
     return render_template('batch_operation.html', type='inventory_check', price_dict=price_dict, now=datetime.now())
 
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+@database.writes('POST')
+def import_records():
+    """从 Excel/CSV 批量导入历史进货和销售记录"""
+    if not current_user.is_admin():
+        flash('您没有权限访问此页面', 'danger')
+        return redirect(url_for('index'))
+    
+    if request.method == 'POST':
+        idempotency_key, replay = begin_idempotent(current_user.id)
+        if replay is not None:
+            return replay
+        
+        upload = request.files.get('file')
+        default_type = request.form.get('type') or None
+        if not upload or not upload.filename:
+            flash('请选择要导入的文件', 'danger')
+            return render_template('import.html')
+        if default_type not in (None, 'purchase', 'sale'):
+            flash('导入类型不正确', 'danger')
+            return render_template('import.html')
+        
+        if os.path.splitext(upload.filename)[1].lower() not in jobs.IMPORT_EXTENSIONS:
+            flash('只支持 .xlsx 和 .csv 文件', 'danger')
+            return render_template('import.html')
+        
+        # 文件保存到任务目录，由后台任务导入
+        try:
+            job = jobs.enqueue(db.session, 'import', None, current_user.id, current_store_id(),
+                               app.config['JOB_MAX_PENDING'])
+        except jobs.TooManyJobs:
+            db.session.rollback()
+            flash('您排队中的任务过多，请等待完成后再提交', 'warning')
+            return render_template('import.html')
+        path = os.path.join(jobs.job_dir(app.config['JOB_DIR'], job.id), 'upload' + os.path.splitext(upload.filename)[1].lower())
+        upload.save(path)
+        job.params = json.dumps({'path': path, 'filename': upload.filename, 'type': default_type}, ensure_ascii=False)
+        
+        message = '导入任务已提交，完成后可在任务列表查看结果'
+        if idempotency_key:
+            idempotency.record(db.session, idempotency_key, current_user.id, request.endpoint, 302,
+                               {'message': message, 'category': 'info', 'location': url_for('job_list')})
+        try:
+            db.session.commit()
+        except IntegrityError:
+            replay = replay_after_conflict(idempotency_key, current_user.id)
+            if replay is not None:
+                return replay
+            raise
+        log_activity(current_user.id, '批量导入', f"{upload.filename}: 任务 {job.id}")
+        flash(message, 'info')
+        return redirect(url_for('job_list'))
+    
+    return render_template('import.html')
+
+@app.route('/events', methods=['GET'])
+@login_required
+def events():
+    """首页和库存页的实时汇总更新 (text/event-stream)"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    return Response(
+        live.stream(db.engine, last_event_id, app.config['LIVE_STREAM_SECONDS'], app.config['LIVE_HEARTBEAT'],
+                    current_store_id(), app.config['LIVE_MAX_STREAMS']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def loss_filters():
+    """解析损耗统计的查询参数，默认最近 12 周"""
+    end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else datetime.now().date()
+    start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else end - timedelta(weeks=12)
+    return start, end, request.args.getlist('name') or None
+
+@app.route('/api/loss', methods=['GET'])
+@login_required
+def api_loss():
+    try:
+        start, end, names = loss_filters()
+    except ValueError:
+        return jsonify({'error': '日期格式应为 YYYY-MM-DD'}), 400
+    
+    # 统计由后台任务 loss_update 定时更新，这里只读取
+    return jsonify(losses.weekly_losses(db.session, start, end, names, current_store_id()))
+
+@app.route('/loss', methods=['GET'])
+@login_required
+def loss_dashboard():
+    try:
+        start, end, names = loss_filters()
+    except ValueError:
+        flash('日期格式不正确', 'danger')
+        return redirect(url_for('loss_dashboard'))
+    
+    rows = losses.weekly_losses(db.session, start, end, names, current_store_id())
+    return render_template('loss.html', rows=rows, start=start, end=end, vegetables=VEGETABLES)
+
+@app.route('/api/analytics/monthly_sales', methods=['GET'])
+@login_required
+def analytics_monthly_sales():
+    if not current_user.is_admin():
+        return jsonify({'error': '没有权限'}), 403
+    
+    # 读取导出分析快照时生成的汇总，不在网页进程中加载 pandas
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m').strftime('%Y-%m') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m').strftime('%Y-%m') if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': '月份格式应为 YYYY-MM'}), 400
+    
+    names = request.args.getlist('name') or None
+    store_id = request.args.get('store_id', type=int)
+    return jsonify(sales_summary.monthly_sales(app.config['ANALYTICS_DIR'], start, end, names, store_id))
+
+@app.route('/api/analytics/year_over_year', methods=['GET'])
+@login_required
+def analytics_year_over_year():
+    if not current_user.is_admin():
+        return jsonify({'error': '没有权限'}), 403
+    
+    year = request.args.get('year', datetime.now().year, type=int)
+    names = request.args.getlist('name') or None
+    return jsonify(sales_summary.year_over_year(app.config['ANALYTICS_DIR'], year, names))
+
+def check_sync_token():
+    token = app.config.get('SYNC_TOKEN')
+    auth = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(auth, f'Bearer {token}'):
+        abort(403)
+
+def is_timestamp(value):
+    """同步记录中的时间应为 ISO 8601 字符串"""
+    if not isinstance(value, str):
+        return False
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+@app.route('/api/sync/push', methods=['POST'])
+@csrf.exempt
+@database.writes()
+def sync_push():
+    check_sync_token()
+    records = (request.get_json(silent=True) or {}).get('records', [])
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        return jsonify({'error': 'records must be a list of objects'}), 400
+    if any(not isinstance(record.get('sync_id'), str) or not 0 < len(record['sync_id']) <= 32 for record in records):
+        return jsonify({'error': 'sync_id is required'}), 400
+    if any(not is_timestamp(record.get(field)) for record in records for field in ('date', 'updated_at')):
+        return jsonify({'error': 'date and updated_at must be ISO 8601 timestamps'}), 400
+    # 删除的记录 (deleted=True) 只带 sync_id、门店、日期和删除时间
+    saved = [record for record in records if not record.get('deleted')]
+    if any(record.get('type') not in ('purchase', 'sale', 'inventory_check') for record in saved):
+        return jsonify({'error': 'invalid record type'}), 400
+    if any(not isinstance(record.get(field), int) for record in saved for field in ('price_fen', 'quantity_g')):
+        return jsonify({'error': 'price_fen and quantity_g are required'}), 400
+    store_ids = {record.get('store_id') or DEFAULT_STORE_ID for record in records}
+    if store_ids and Store.query.filter(Store.id.in_(store_ids)).count() != len(store_ids):
+        return jsonify({'error': 'unknown store_id'}), 400
+    
+    idempotency_key, replay = begin_idempotent(None, json_response=True)
+    if replay is not None:
+        return replay
+    
+    # 已结账日期的记录不能再修改，返回被拒绝的 sync_id 和服务器上的当前版本，由客户端恢复
+    records, rejected = closing.split_sync_records(db.session, records)
+    applied = sync.apply_records(db.session, records, stamp=datetime.now())
+    rejected_ids = [record['sync_id'] for record in rejected]
+    current = Product.query.filter(Product.sync_id.in_(rejected_ids)).all() if rejected_ids else []
+    result = {'received': len(records) + len(rejected), 'applied': applied,
+              'rejected': rejected_ids, 'current': [sync.record_to_dict(product) for product in current]}
+    if idempotency_key:
+        idempotency.record(db.session, idempotency_key, None, request.endpoint, 200, result)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        replay = replay_after_conflict(idempotency_key, None, json_response=True)
+        if replay is not None:
+            return replay
+        raise
+    return jsonify(result)
+
+@app.route('/api/sync/pull', methods=['GET'])
+def sync_pull():
+    check_sync_token()
+    since = request.args.get('since')
+    after_id = request.args.get('after_id', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), 1000)
+    store_id = request.args.get('store_id', type=int)
+    deleted_since = request.args.get('deleted_since')
+    deleted_after_id = request.args.get('deleted_after_id', 0, type=int)
+    
+    try:
+        since = datetime.fromisoformat(since) if since else None
+        deleted_since = datetime.fromisoformat(deleted_since) if deleted_since else None
+    except ValueError:
+        return jsonify({'error': 'invalid since'}), 400
+    
+    # deleted=1 时同时返回删除记录，旧版本客户端不传
+    deleted = (deleted_since, deleted_after_id) if request.args.get('deleted') == '1' else None
+    records, watermark = sync.changes_since(db.session, since=since, after_id=after_id, limit=limit,
+                                            store_id=store_id,
+                                            until=datetime.now() - timedelta(seconds=app.config['SYNC_PULL_LAG']),
+                                            deleted=deleted)
+    return jsonify({'records': records, 'watermark': watermark})
+
+@app.route('/api/changes', methods=['GET'])
+def api_changes():
+    """按序号增量读取 Product/ProductPrice 的变更，供下游缓存和汇总使用"""
+    check_sync_token()
+    entity = request.args.get('entity') or None
+    if entity is not None and entity not in changes.TRACKED.values():
+        return jsonify({'error': 'invalid entity'}), 400
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 1000)
+    
+    batch = changes.read(db.session, after, limit, entity, request.args.get('store_id', type=int),
+                         lag=app.config['CHANGE_READ_LAG'])
+    return jsonify({'changes': batch, 'next': batch[-1]['seq'] if batch else after})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """就绪检查：当前 worker 预热完成后返回 200"""
+    return jsonify(warmup.state), 200 if warmup.is_ready() else 503
+
 if __name__ == '__main__':
+    from migrate_db import migrate_database
+    
+    # 增量迁移数据库结构，保留已有数据
+    migrate_database()
+    
     with app.app_context():
-        # 备份用户数据
-        users = User.query.all()
-        user_data = []
-        for user in users:
-            user_data.append({
-                'username': user.username,
-                'password_hash': user.password_hash,
-                'role': user.role,
-                'last_login': user.last_login,
-                'created_at': user.created_at
-            })
-        
-        # 重新创建数据库
-        db.drop_all()
-        db.create_all()
-        
-        # 恢复用户数据
-        for user in user_data:
-            new_user = User(
-                username=user['username'],
-                password_hash=user['password_hash'],
-                role=user['role'],
-                last_login=user['last_login'],
-                created_at=user['created_at']
-            )
-            db.session.add(new_user)
-        
         # 如果没有用户数据，创建管理员账号
-        if not user_data:
+        if not User.query.first():
             admin = User(username='ADMIN', role='admin')
             admin.set_password('admin123')
             db.session.add(admin)
+            db.session.commit()
             print('Admin account created successfully!')
-        
-        db.session.commit()
+    warmup.warm(app)
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
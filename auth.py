@@ -0,0 +1,191 @@
+"""登录用户缓存与登录保护
+
+Flask-Login 每个请求都会调用 user_loader。这里缓存用户 id 到只读快照
+(id, username, role) 的映射，避免每次页面访问都查询一次 user 表。
+缓存是进程内的，修改用户资料、删除用户、修改密码时需要调用 invalidate()；
+其他 worker 进程中的旧快照最多保留 USER_CACHE_TTL 秒。
+
+登录时的密码校验放到有界线程池中执行（hashlib 计算时会释放 GIL），
+同时按 IP 和用户名做令牌桶限流，避免集中登录或暴力破解占满 worker。
+限流状态同样是进程内的。
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from functools import lru_cache
+
+from flask_login import UserMixin
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from models import db, User
+
+
+@dataclass(frozen=True)
+class UserSnapshot(UserMixin):
+    id: int
+    username: str
+    role: str
+    store_id: int
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(id=user.id, username=user.username, role=user.role, store_id=user.store_id)
+
+    def is_admin(self):
+        return self.role == 'admin'
+
+    def load(self):
+        """需要修改用户或校验密码时加载完整的 User 记录"""
+        return db.session.get(User, self.id)
+
+    def check_password(self, password):
+        user = self.load()
+        return user is not None and user.check_password(password)
+
+
+class UserCache:
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            snapshot, expires_at = item
+            if expires_at < time.monotonic():
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return snapshot
+
+    def put(self, snapshot):
+        with self._lock:
+            self._items[snapshot.id] = (snapshot, time.monotonic() + self.ttl)
+            self._items.move_to_end(snapshot.id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class TokenBucketLimiter:
+    """按 key 限流的令牌桶，每个 key 每秒补充 rate 个令牌，最多 capacity 个"""
+
+    def __init__(self, rate, capacity, maxsize=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens=1):
+        now = time.monotonic()
+        with self._lock:
+            available, updated_at = self._buckets.get(key, (self.capacity, now))
+            available = min(self.capacity, available + (now - updated_at) * self.rate)
+            allowed = available >= tokens
+            if allowed:
+                available -= tokens
+            self._buckets[key] = (available, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+class LoginBusy(Exception):
+    """密码校验线程池已满或超时"""
+
+
+class PasswordVerifier:
+    def __init__(self, workers=2, queue=8, timeout=5):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def verify(self, password_hash, password):
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy()
+        try:
+            future = self._executor.submit(check_password_hash, password_hash, password)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise LoginBusy()
+
+
+user_cache = UserCache()
+ip_limiter = TokenBucketLimiter(rate=10 / 60, capacity=10)
+username_limiter = TokenBucketLimiter(rate=5 / 60, capacity=5)
+password_verifier = None
+
+
+def init_app(app):
+    global password_verifier
+    user_cache.maxsize = app.config.get('USER_CACHE_SIZE', user_cache.maxsize)
+    user_cache.ttl = app.config.get('USER_CACHE_TTL', user_cache.ttl)
+
+    ip_limiter.rate = app.config['LOGIN_RATE_PER_IP'] / 60
+    ip_limiter.capacity = app.config['LOGIN_RATE_PER_IP']
+    username_limiter.rate = app.config['LOGIN_RATE_PER_USERNAME'] / 60
+    username_limiter.capacity = app.config['LOGIN_RATE_PER_USERNAME']
+    password_verifier = PasswordVerifier(
+        workers=app.config['LOGIN_HASH_WORKERS'],
+        queue=app.config['LOGIN_HASH_QUEUE'],
+        timeout=app.config['LOGIN_HASH_TIMEOUT']
+    )
+
+
+def allow_login_attempt(ip, username):
+    """IP 和用户名都有剩余令牌时才允许尝试登录"""
+    ip_allowed = ip_limiter.consume(ip)
+    username_allowed = username_limiter.consume(username)
+    return ip_allowed and username_allowed
+
+
+def verify_password(password_hash, password):
+    return password_verifier.verify(password_hash, password)
+
+
+def hash_password(password, method):
+    return generate_password_hash(password, method)
+
+
+@lru_cache(maxsize=8)
+def _hash_prefix(method):
+    # werkzeug 会补全默认参数，例如 'scrypt' -> 'scrypt:32768:8:1'
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(password_hash, method):
+    """密码哈希的算法或参数与当前配置不一致时返回 True"""
+    return password_hash.split('$', 1)[0] != _hash_prefix(method)
+
+
+def load_user_snapshot(user_id):
+    user_id = int(user_id)
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        user_cache.put(snapshot)
+    return snapshot
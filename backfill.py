@@ -0,0 +1,104 @@
+"""分批数据回填
+
+对大表按主键分批处理，每批在独立事务中执行并记录进度到 backfill_progress 表。
+中途失败或被中断后，用同一个 name 重新运行会从上次完成的位置继续。
+
+    from backfill import run_backfill
+
+    def fill(conn, rows):
+        conn.execute(update_stmt, [{'pk': row.id, ...} for row in rows])
+
+    run_backfill(db.engine, 'product_sync_id', product_table, fill, columns=['id'])
+"""
+import logging
+from contextlib import nullcontext
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+progress_metadata = sa.MetaData()
+
+backfill_progress = sa.Table(
+    'backfill_progress', progress_metadata,
+    sa.Column('name', sa.String(100), primary_key=True),
+    sa.Column('last_key', sa.Integer, nullable=False, default=0),
+    sa.Column('processed', sa.Integer, nullable=False, default=0),
+    sa.Column('finished_at', sa.DateTime),
+    sa.Column('updated_at', sa.DateTime, default=datetime.now, onupdate=datetime.now),
+)
+
+
+def log_progress(name, processed, total):
+    percent = processed * 100 / total if total else 100
+    logger.info("Backfill %s: %s/%s (%.1f%%)", name, processed, total, percent)
+
+
+def _load_progress(conn, name):
+    progress_metadata.create_all(conn, checkfirst=True)
+    row = conn.execute(sa.select(backfill_progress).where(backfill_progress.c.name == name)).first()
+    if row is None:
+        conn.execute(sa.insert(backfill_progress).values(name=name, last_key=0, processed=0))
+        return 0, 0, None
+    return row.last_key, row.processed, row.finished_at
+
+
+def _save_progress(conn, name, last_key, processed, finished=False):
+    values = {'last_key': last_key, 'processed': processed, 'updated_at': datetime.now()}
+    if finished:
+        values['finished_at'] = datetime.now()
+    conn.execute(sa.update(backfill_progress).where(backfill_progress.c.name == name).values(**values))
+
+
+def _transaction(bind):
+    if isinstance(bind, Engine):
+        return bind.begin()
+    return nullcontext(bind)
+
+
+def run_backfill(bind, name, table, process, columns=None, where=None, batch_size=1000, progress=log_progress):
+    """按主键升序分批读取 table 并调用 process(conn, rows)
+
+    bind 为 Engine 时每批单独提交，可以断点续跑；为 Connection 时（例如在 alembic
+    迁移脚本中）所有批次跟随外层事务，进度和数据一起提交或回滚。
+    columns 为要读取的列名，默认全部；where 为附加的过滤条件。
+    返回本次运行处理的行数。
+    """
+    pk = list(table.primary_key.columns)[0]
+    selected = [table.c[column] for column in columns] if columns else list(table.c)
+    if pk not in selected:
+        selected.insert(0, pk)
+
+    with _transaction(bind) as conn:
+        last_key, processed, finished_at = _load_progress(conn, name)
+        if finished_at is not None:
+            logger.info("Backfill %s already finished at %s", name, finished_at)
+            return 0
+
+        count_stmt = sa.select(sa.func.count()).select_from(table)
+        if where is not None:
+            count_stmt = count_stmt.where(where)
+        total = conn.execute(count_stmt).scalar()
+
+    done_this_run = 0
+    while True:
+        with _transaction(bind) as conn:
+            stmt = sa.select(*selected).where(pk > last_key).order_by(pk).limit(batch_size)
+            if where is not None:
+                stmt = stmt.where(where)
+            rows = conn.execute(stmt).all()
+            if not rows:
+                _save_progress(conn, name, last_key, processed, finished=True)
+                break
+
+            process(conn, rows)
+            last_key = rows[-1]._mapping[pk]
+            processed += len(rows)
+            done_this_run += len(rows)
+            _save_progress(conn, name, last_key, processed)
+
+        if progress:
+            progress(name, processed, total)
+    return done_this_run
@@ -0,0 +1,418 @@
+"""数据库备份与恢复
+
+营业时间内也可以备份，不会让柜台操作变慢：
+
+SQLite
+    用 sqlite3 的 backup API 每次复制 BACKUP_PAGES 页，两步之间暂停 BACKUP_PAUSE 秒，
+    每一步只短暂持有读锁，线上请求在步与步之间照常读写。复制期间其他连接写入时
+    SQLite 会从头重新复制；重来超过 BACKUP_MAX_RESTARTS 次（写入很频繁）时改为一次
+    复制完，WAL 模式下这只是一个读事务，不阻塞写入。
+
+PostgreSQL
+    在一个 REPEATABLE READ 只读事务中把每个表 COPY 成 gzip 压缩的 CSV，所有表来自
+    同一个快照，不加任何阻塞写入的锁。增量备份只导出 INCREMENTAL 中的大表在上次
+    备份之后变化的行（按 updated_at/created_at 水位，向前多取 BACKUP_OVERLAP 秒，
+    覆盖跨越备份时刻的长事务和多台服务器的时钟误差），另存这些表当前的全部主键，
+    恢复时据此删除已删除的行；其他小表每次全量导出。
+
+每次备份保存在 BACKUP_DIR/<时间>-<sqlite|full|incr>/ 下，manifest.json 记录文件的
+sha256 和行数，增量备份记录上一次备份 (parent)。
+
+    python backup.py run                    备份（PostgreSQL 为全量）
+    python backup.py run --incremental      PostgreSQL 增量备份，没有之前的备份时做全量
+    python backup.py list
+    python backup.py verify <名称>          校验该备份及其依赖的备份
+    python backup.py restore <名称> --target <数据库 URL>
+
+恢复会覆盖目标数据库：SQLite 直接替换整个数据库，需先停止应用；PostgreSQL 需先
+用 `alembic upgrade head` 建好表结构，再依次应用全量和之后的增量备份，目标中多出
+的行会被删除，结果与备份时的数据一致。
+"""
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+# 增量备份中只导出变化行的表 -> 水位列；其他表每次全量导出
+INCREMENTAL = {
+    'product': 'updated_at',
+    'product_price': 'updated_at',
+    'activity_log': 'created_at',
+    'change_record': 'created_at',
+}
+
+
+class BackupError(Exception):
+    """备份不完整或校验失败"""
+
+
+class _Restarted(Exception):
+    """分步复制期间数据库被反复修改"""
+
+
+def sqlite_path(url):
+    return make_url(url).database
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _csv_rows(path):
+    """gzip CSV 的数据行数（不含表头）；字段中可能有换行，所以按 CSV 解析计数"""
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        return max(sum(1 for _ in csv.reader(f)) - 1, 0)
+
+
+def _table_counts(connection):
+    names = [row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    )]
+    return {name: connection.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0] for name in names}
+
+
+def _quote(engine, name):
+    return engine.dialect.identifier_preparer.quote(name)
+
+
+def _columns(engine, table, names=None):
+    return ', '.join(_quote(engine, column.name) for column in table.columns
+                     if names is None or column.name in names)
+
+
+def _primary_key(table):
+    return [column.name for column in table.primary_key.columns]
+
+
+def backup_sqlite(source_path, target_path, pages=1024, pause=0.02, max_restarts=5):
+    """分步复制 SQLite 数据库到 target_path，返回复制统计
+
+    复制期间不能写这个数据库（包括任务进度），否则会使复制重来。
+    """
+    stats = {'steps': 0, 'restarts': 0, 'single_step': False}
+    last = [None]
+
+    def step(status, remaining, total):
+        stats['steps'] += 1
+        if last[0] is not None and remaining > last[0]:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise _Restarted()
+        last[0] = remaining
+
+    source = sqlite3.connect(source_path)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=pages, progress=step, sleep=pause)
+        except _Restarted:
+            logger.warning("SQLite backup restarted %d times, copying in a single step", stats['restarts'])
+            stats['single_step'] = True
+            source.backup(target)
+        # 备份文件不依赖 -wal/-shm 文件，可以直接复制、打开
+        target.execute('PRAGMA journal_mode = DELETE')
+        target.close()
+    finally:
+        source.close()
+    return stats
+
+
+def _copy_out(cursor, query, path):
+    with gzip.open(path, 'wb', compresslevel=6) as f:
+        cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)', f)
+    return {'file': os.path.basename(path), 'rows': _csv_rows(path), 'sha256': _sha256(path)}
+
+
+def dump_postgres(engine, set_dir, since=None, progress=None):
+    """在同一个只读快照中导出所有表，since 不为 None 时 INCREMENTAL 中的表只导出变化的行"""
+    files = {}
+    tables = db.metadata.sorted_tables
+    connection = engine.raw_connection()
+    try:
+        # 连接池检查连接时可能已经开始了事务，SET TRANSACTION 必须是事务的第一条语句
+        connection.rollback()
+        cursor = connection.cursor()
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        for i, table in enumerate(tables):
+            name = _quote(engine, table.name)
+            query = f'SELECT {_columns(engine, table)} FROM {name}'
+            column = INCREMENTAL.get(table.name) if since is not None else None
+            if column:
+                query = cursor.mogrify(f'{query} WHERE {_quote(engine, column)} >= %s', (since,)).decode()
+            info = _copy_out(cursor, query, os.path.join(set_dir, f'{table.name}.csv.gz'))
+            info.update(table=table.name, since=column)
+            files[table.name] = info
+            if column:
+                # 当前的全部主键，恢复时删除不在其中的行
+                key = _columns(engine, table, _primary_key(table))
+                ids = _copy_out(cursor, f'SELECT {key} FROM {name}', os.path.join(set_dir, f'{table.name}.ids.csv.gz'))
+                ids.update(table=table.name, ids=True)
+                files[f'{table.name}.ids'] = ids
+            if progress is not None:
+                progress(int((i + 1) * 100 / len(tables)), f'已导出 {table.name}')
+    finally:
+        connection.rollback()
+        connection.close()
+    return files
+
+
+def list_sets(base_dir):
+    """已完成的备份名称，按时间排序"""
+    if not os.path.isdir(base_dir):
+        return []
+    return sorted(name for name in os.listdir(base_dir) if os.path.exists(os.path.join(base_dir, name, MANIFEST)))
+
+
+def load_manifest(base_dir, name):
+    path = os.path.join(base_dir, name, MANIFEST)
+    if not os.path.exists(path):
+        raise BackupError(f'备份 {name} 不存在或不完整')
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _latest(base_dir, dialect):
+    for name in reversed(list_sets(base_dir)):
+        if load_manifest(base_dir, name)['dialect'] == dialect:
+            return name
+    return None
+
+
+def _new_set(base_dir, kind):
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    name, n = f'{stamp}-{kind}', 1
+    while os.path.exists(os.path.join(base_dir, name)) or os.path.exists(os.path.join(base_dir, name + '.tmp')):
+        n += 1
+        name = f'{stamp}-{kind}-{n}'
+    return name
+
+
+def create_backup(engine, base_dir, incremental=False, pages=1024, pause=0.02, max_restarts=5, overlap=600,
+                  progress=None):
+    """备份 engine 指向的数据库，返回 manifest；progress 只用于 PostgreSQL"""
+    dialect = engine.dialect.name
+    started = datetime.now()
+    manifest = {'dialect': dialect, 'created_at': started.isoformat(), 'parent': None}
+
+    if dialect == 'sqlite':
+        kind = 'sqlite'
+    elif dialect == 'postgresql':
+        parent = _latest(base_dir, dialect) if incremental else None
+        kind = 'incr' if parent else 'full'
+        since = datetime.fromisoformat(load_manifest(base_dir, parent)['watermark']) if parent else None
+        # 下一次增量从这里开始，向前多取 overlap 秒
+        manifest.update(parent=parent, since=since.isoformat() if since else None,
+                        watermark=(started - timedelta(seconds=overlap)).isoformat())
+    else:
+        raise BackupError(f'不支持备份 {dialect} 数据库')
+    manifest['kind'] = kind
+
+    name = _new_set(base_dir, kind)
+    tmp_dir = os.path.join(base_dir, name + '.tmp')
+    os.makedirs(tmp_dir)
+    try:
+        if kind == 'sqlite':
+            path = os.path.join(tmp_dir, 'database.db')
+            manifest['stats'] = backup_sqlite(sqlite_path(str(engine.url)), path, pages, pause, max_restarts)
+            connection = sqlite3.connect(path)
+            try:
+                manifest['tables'] = _table_counts(connection)
+            finally:
+                connection.close()
+            manifest['files'] = {'database': {'file': 'database.db', 'sha256': _sha256(path)}}
+        else:
+            manifest['files'] = dump_postgres(engine, tmp_dir, since, progress)
+        manifest['finished_at'] = datetime.now().isoformat()
+        with open(os.path.join(tmp_dir, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        # 全部写完才改成正式名称，中断的备份不会被当作上一次备份
+        os.replace(tmp_dir, os.path.join(base_dir, name))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    manifest['name'] = name
+    return manifest
+
+
+def chain(base_dir, name):
+    """恢复 name 需要依次应用的备份：全量备份在前"""
+    names = []
+    while name:
+        names.append(name)
+        name = load_manifest(base_dir, name).get('parent')
+    return list(reversed(names))
+
+
+def verify(base_dir, name):
+    """校验备份及其依赖的备份，返回问题列表，为空表示完好"""
+    problems = []
+    for set_name in chain(base_dir, name):
+        manifest = load_manifest(base_dir, set_name)
+        set_dir = os.path.join(base_dir, set_name)
+        for key, info in manifest['files'].items():
+            path = os.path.join(set_dir, info['file'])
+            if not os.path.exists(path):
+                problems.append(f'{set_name}: 缺少 {info["file"]}')
+                continue
+            if _sha256(path) != info['sha256']:
+                problems.append(f'{set_name}: {info["file"]} 校验和不一致')
+                continue
+            if 'rows' in info and _csv_rows(path) != info['rows']:
+                problems.append(f'{set_name}: {info["file"]} 行数不一致')
+        if manifest['kind'] == 'sqlite' and not problems:
+            connection = sqlite3.connect(os.path.join(set_dir, 'database.db'))
+            try:
+                result = connection.execute('PRAGMA integrity_check').fetchone()[0]
+                if result != 'ok':
+                    problems.append(f'{set_name}: integrity_check {result}')
+                elif _table_counts(connection) != manifest['tables']:
+                    problems.append(f'{set_name}: 表行数不一致')
+            finally:
+                connection.close()
+    return problems
+
+
+def _copy_in(cursor, table_name, columns, path):
+    with gzip.open(path, 'rb') as f:
+        cursor.copy_expert(f'COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, HEADER true)', f)
+
+
+def _apply_postgres(engine, set_dir, manifest):
+    """把一个备份应用到目标库：删除备份中没有的行，插入或更新备份中的行"""
+    files = manifest['files']
+    tables = [table for table in db.metadata.sorted_tables if table.name in files]
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for table in tables:
+            columns = _columns(engine, table)
+            staging = _quote(engine, f'_restore_{table.name}')
+            cursor.execute(f'CREATE TEMP TABLE {staging} (LIKE {_quote(engine, table.name)}) ON COMMIT DROP')
+            _copy_in(cursor, staging, columns, os.path.join(set_dir, files[table.name]['file']))
+            if f'{table.name}.ids' in files:
+                keys = _columns(engine, table, _primary_key(table))
+                ids = _quote(engine, f'_restore_{table.name}_ids')
+                cursor.execute(f'CREATE TEMP TABLE {ids} ON COMMIT DROP AS '
+                               f'SELECT {keys} FROM {_quote(engine, table.name)} WITH NO DATA')
+                _copy_in(cursor, ids, keys, os.path.join(set_dir, files[f'{table.name}.ids']['file']))
+
+        # 先从子表开始删除，再从父表开始写入，不违反外键
+        for table in reversed(tables):
+            name = _quote(engine, table.name)
+            keep = f'_restore_{table.name}_ids' if f'{table.name}.ids' in files else f'_restore_{table.name}'
+            match = ' AND '.join(f'k.{_quote(engine, key)} = t.{_quote(engine, key)}' for key in _primary_key(table))
+            cursor.execute(f'DELETE FROM {name} t WHERE NOT EXISTS (SELECT 1 FROM {_quote(engine, keep)} k WHERE {match})')
+        for table in tables:
+            columns = _columns(engine, table)
+            keys = _primary_key(table)
+            updates = ', '.join(f'{_quote(engine, column.name)} = EXCLUDED.{_quote(engine, column.name)}'
+                                for column in table.columns if column.name not in keys)
+            conflict = f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'
+            cursor.execute(
+                f'INSERT INTO {_quote(engine, table.name)} ({columns}) '
+                f'SELECT {columns} FROM {_quote(engine, f"_restore_{table.name}")} '
+                f'ON CONFLICT ({_columns(engine, table, keys)}) {conflict}'
+            )
+            if keys == ['id']:
+                # 自增序列接着恢复后的最大 id
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) "
+                    f"FROM {_quote(engine, table.name)}", (_quote(engine, table.name),)
+                )
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def restore(base_dir, name, target_url):
+    """校验后把备份 name 恢复到 target_url，返回应用的备份名称"""
+    problems = verify(base_dir, name)
+    if problems:
+        raise BackupError('; '.join(problems))
+    names = chain(base_dir, name)
+    manifest = load_manifest(base_dir, name)
+
+    if manifest['kind'] == 'sqlite':
+        if not target_url.startswith('sqlite'):
+            raise BackupError('SQLite 备份只能恢复到 SQLite 数据库')
+        source = sqlite3.connect(os.path.join(base_dir, name, 'database.db'))
+        target = sqlite3.connect(sqlite_path(target_url))
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        return names
+
+    engine = create_engine(target_url)
+    if engine.dialect.name != 'postgresql':
+        raise BackupError('PostgreSQL 备份只能恢复到 PostgreSQL 数据库')
+    try:
+        for set_name in names:
+            _apply_postgres(engine, os.path.join(base_dir, set_name), load_manifest(base_dir, set_name))
+            logger.info("Applied backup %s", set_name)
+    finally:
+        engine.dispose()
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库备份与恢复')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help='备份当前数据库')
+    run.add_argument('--incremental', action='store_true', help='PostgreSQL 增量备份')
+    subparsers.add_parser('list', help='列出备份')
+    check = subparsers.add_parser('verify', help='校验备份')
+    check.add_argument('name')
+    back = subparsers.add_parser('restore', help='恢复备份到目标数据库')
+    back.add_argument('name')
+    back.add_argument('--target', required=True, help='目标数据库 URL，会被覆盖')
+    args = parser.parse_args()
+
+    from app import app
+
+    base_dir = app.config['BACKUP_DIR']
+    if args.command == 'run':
+        with app.app_context():
+            manifest = create_backup(
+                db.engine, base_dir, args.incremental, app.config['BACKUP_PAGES'], app.config['BACKUP_PAUSE'],
+                app.config['BACKUP_MAX_RESTARTS'], app.config['BACKUP_OVERLAP'],
+            )
+        print(f"{manifest['name']}: {len(manifest['files'])} 个文件")
+    elif args.command == 'list':
+        for name in list_sets(base_dir):
+            manifest = load_manifest(base_dir, name)
+            print(f"{name}  {manifest['kind']:6} {manifest['created_at']}  parent={manifest.get('parent') or '-'}")
+    elif args.command == 'verify':
+        problems = verify(base_dir, args.name)
+        print('\n'.join(problems) if problems else f'{args.name}: 完好')
+        raise SystemExit(1 if problems else 0)
+    else:
+        names = restore(base_dir, args.name, args.target)
+        print(f"已恢复: {', '.join(names)}")
+
+
+if __name__ == '__main__':
+    main()
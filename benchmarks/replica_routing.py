@@ -0,0 +1,129 @@
+"""只读副本路由验证
+
+用两个 SQLite 文件模拟主库和副本，统计每个请求在两个库上执行的语句：
+
+    写入（批量进货）        只访问主库
+    只读接口（记录、报表）  查询走副本
+    导出                  只在主库插入后台任务和操作日志
+
+副本由脚本用 SQLite backup API 从主库复制，复制之前只读接口看不到新写入的
+记录，复制之后可以看到，以此确认查询确实来自副本文件。
+
+    python benchmarks/replica_routing.py
+"""
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+workdir = tempfile.mkdtemp(prefix='replica-')
+PRIMARY = os.path.join(workdir, 'primary.db')
+REPLICA = os.path.join(workdir, 'replica.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{PRIMARY}'
+os.environ['DATABASE_REPLICA_URL'] = f'sqlite:///{REPLICA}'
+
+from sqlalchemy import event
+
+from app import app, db
+from migrate_db import migrate_database
+from models import User
+
+statements = Counter()
+
+
+def copy_to_replica():
+    """模拟副本追上主库"""
+    with app.app_context():
+        db.engines['replica'].dispose()
+    source = sqlite3.connect(PRIMARY)
+    target = sqlite3.connect(REPLICA)
+    with target:
+        source.backup(target)
+    source.close()
+    target.close()
+
+
+TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)', re.IGNORECASE)
+
+
+def track(engine, label):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        table = TABLE.search(statement)
+        statements[(label, statement.split(None, 1)[0].upper(), table.group(1) if table else '')] += 1
+
+
+def request(client, method, path, **kwargs):
+    statements.clear()
+    response = client.open(path, method=method, **kwargs)
+    summary = ', '.join(
+        f'{label} {verb} {table} x{count}' for (label, verb, table), count in sorted(statements.items())
+    )
+    print(f'{method:4} {path}  {response.status_code}\n     {summary}')
+    return response, dict(statements)
+
+
+def used(counts, label, verbs=None, tables=None):
+    """counts 中是否有 label 库上的 verbs 语句，tables 限定访问的表"""
+    return any(
+        key[0] == label and (verbs is None or key[1] in verbs) and (tables is None or key[2] in tables)
+        for key in counts
+    )
+
+
+def main():
+    app.config['WTF_CSRF_ENABLED'] = False
+    migrate_database()
+    with app.app_context():
+        if not User.query.filter_by(username='replica-admin').first():
+            user = User(username='replica-admin', role='admin')
+            user.set_password('replica')
+            db.session.add(user)
+            db.session.commit()
+        copy_to_replica()
+        track(db.engines[None], 'primary')
+        track(db.engines['replica'], 'replica')
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    client = app.test_client()
+    client.post('/login', data={'username': 'replica-admin', 'password': 'replica'})
+
+    failures = []
+    _, counts = request(client, 'POST', '/batch/purchase',
+                        data={'date': today, 'quantity_菜心': '10', 'price_菜心': '2'})
+    if used(counts, 'replica'):
+        failures.append('写入请求访问了副本')
+
+    response, counts = request(client, 'GET', f'/api/records?date={today}')
+    # 登录用户在只读标记生效之前从主库加载，这里只看业务表
+    if used(counts, 'primary', {'SELECT'}, {'product'}) or response.get_json()['records']:
+        failures.append('复制之前只读接口应从副本读取且看不到新记录')
+
+    copy_to_replica()
+    response, counts = request(client, 'GET', f'/api/records?date={today}')
+    if len(response.get_json()['records']) != 1:
+        failures.append('复制之后只读接口应看到新记录')
+
+    _, counts = request(client, 'GET', f'/api/reports/stores?start={today}&end={today}')
+    if used(counts, 'primary', {'SELECT'}, {'product'}) or not used(counts, 'replica', {'SELECT'}, {'product'}):
+        failures.append('报表应从副本读取')
+
+    _, counts = request(client, 'GET', '/export')
+    if used(counts, 'replica') or not used(counts, 'primary', {'INSERT'}, {'job'}):
+        failures.append('导出任务应写入主库')
+
+    print()
+    if failures:
+        for failure in failures:
+            print('失败:', failure)
+        sys.exit(1)
+    print(f'路由正确 ({workdir})')
+
+
+if __name__ == '__main__':
+    main()
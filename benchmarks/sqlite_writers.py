@@ -0,0 +1,189 @@
+"""SQLite 多进程写入测试
+
+模拟多个 gunicorn worker 同时录入：--processes 个进程各自加载应用，每个进程
+--threads 个线程用测试客户端不停提交 /batch/purchase（一次业务提交加一次操作日志
+提交），另有 --readers 个线程不停读取 /api/records 和 /api/reports/stores，
+持续 --seconds 秒。回滚日志模式下提交要等所有读完成，读多时写入容易等锁超时。统计实际写入的记录数、每秒写入数，以及数据库返回
+"database is locked" 的次数（批量录入捕获异常后只提示“操作失败”，所以在引擎的
+handle_error 事件中计数）。
+
+    baseline   原来的设置：回滚日志模式，pysqlite 默认的 5 秒等锁，读后再升级写锁
+    wal        只打开 WAL
+    immediate  WAL + 进程内写锁 + 写请求 BEGIN IMMEDIATE（默认配置）
+    coalesce   再加上操作日志合并提交 (SQLITE_WRITE_COALESCE=1)
+
+    python benchmarks/sqlite_writers.py --processes 4 --threads 4 --readers 2 --seconds 10
+    python benchmarks/sqlite_writers.py --mode baseline --mode coalesce --busy-timeout 1000
+
+默认的 5 秒等锁在测试时间内很少超时，调小 --busy-timeout 可以更快看出各模式的锁错误差别。
+
+每种模式使用一个新的临时 SQLite 文件。
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'baseline': {'SQLITE_WAL': '0', 'SQLITE_IMMEDIATE_WRITES': '0', 'SQLITE_WRITE_COALESCE': '0'},
+    'wal': {'SQLITE_WAL': '1', 'SQLITE_IMMEDIATE_WRITES': '0', 'SQLITE_WRITE_COALESCE': '0'},
+    'immediate': {'SQLITE_WAL': '1', 'SQLITE_IMMEDIATE_WRITES': '1', 'SQLITE_WRITE_COALESCE': '0'},
+    'coalesce': {'SQLITE_WAL': '1', 'SQLITE_IMMEDIATE_WRITES': '1', 'SQLITE_WRITE_COALESCE': '1'},
+}
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+
+def load_app(url, mode, busy_timeout):
+    os.environ.update(MODES[mode], DATABASE_URL=url, JOB_WORKER_EMBEDDED='0', SQLITE_BUSY_TIMEOUT=str(busy_timeout))
+    sys.path.insert(0, ROOT)
+    from app import app
+    logging.disable(logging.INFO)
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def setup(url, mode, busy_timeout):
+    app = load_app(url, mode, busy_timeout)
+    from migrate_db import migrate_database
+    from models import db, User
+
+    with app.app_context():
+        migrate_database()
+        user = User(username=USERNAME, role='admin')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+
+
+def writer(args):
+    import threading
+    from sqlalchemy import event
+
+    url, mode, busy_timeout, threads, readers, seconds, ready, start_event = args
+    app = load_app(url, mode, busy_timeout)
+    from models import db
+
+    counts = {'requests': 0, 'failed': 0, 'reads': 0, 'locked': 0}
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'handle_error')
+        def handle_error(context):
+            if 'database is locked' in str(context.original_exception):
+                count('locked')
+
+    def login():
+        client = app.test_client()
+        while True:
+            try:
+                # 多个进程同时登录时可能返回“系统繁忙”(模板不存在时抛出异常)，重试
+                if client.post('/login', data={'username': USERNAME, 'password': PASSWORD}).status_code == 302:
+                    return client
+            except Exception:
+                pass
+            time.sleep(0.1)
+
+    clients = [login() for _ in range(threads + readers)]
+
+    day = time.strftime('%Y-%m-%d')
+    ready.put(os.getpid())
+    start_event.wait()
+    started = time.time()
+    deadline = started + seconds
+
+    def run(client):
+        while time.time() < deadline:
+            try:
+                response = client.post('/batch/purchase', data={'date': day, 'quantity_菜心': '1', 'price_菜心': '1'})
+                count('requests' if response.status_code == 302 else 'failed')
+            except Exception:
+                # 500 错误页的模板不存在时测试客户端直接抛出异常
+                count('failed')
+
+    def read(client):
+        paths = ['/api/records?page=1', '/api/reports/stores']
+        while time.time() < deadline:
+            try:
+                response = client.get(paths[counts['reads'] % len(paths)])
+                count('reads' if response.status_code == 200 else 'failed')
+            except Exception:
+                count('failed')
+
+    workers = [threading.Thread(target=run, args=(client,)) for client in clients[:threads]]
+    workers += [threading.Thread(target=read, args=(client,)) for client in clients[threads:]]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return counts, started, time.time()
+
+
+def run(mode, busy_timeout, processes, threads, readers, seconds):
+    workdir = tempfile.mkdtemp(prefix='sqlite-writers-')
+    url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    context = multiprocessing.get_context('spawn')
+    # 建表在单独的进程中完成，避免本进程加载应用后固定了环境变量
+    with context.Pool(1) as pool:
+        pool.apply(setup, (url, mode, busy_timeout))
+
+    manager = context.Manager()
+    ready = manager.Queue()
+    start_event = manager.Event()
+    with context.Pool(processes) as pool:
+        result = pool.map_async(writer, [(url, mode, busy_timeout, threads, readers, seconds, ready, start_event)] * processes)
+        # 等所有进程加载应用并登录后同时开始
+        for _ in range(processes):
+            ready.get()
+        start_event.set()
+        results = result.get()
+    counts = [r[0] for r in results]
+    # 截止时间之后仍在等锁的请求也计入耗时
+    elapsed = max(r[2] for r in results) - min(r[1] for r in results)
+
+    import sqlite3
+    connection = sqlite3.connect(os.path.join(workdir, 'bench.db'))
+    products = connection.execute('SELECT COUNT(*) FROM product').fetchone()[0]
+    logs = connection.execute("SELECT COUNT(*) FROM activity_log WHERE action LIKE '批量%'").fetchone()[0]
+    connection.close()
+
+    total = {key: sum(c[key] for c in counts) for key in counts[0]}
+    return {
+        'products': products,
+        'logs': logs,
+        'writes_per_sec': products / elapsed,
+        'elapsed': elapsed,
+        **total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 多进程写入测试')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--busy-timeout', type=int, default=5000, help='等锁毫秒数，默认与 pysqlite 相同')
+    parser.add_argument('--mode', action='append', choices=list(MODES))
+    args = parser.parse_args()
+
+    print(f'{args.processes} 个进程 x ({args.threads} 个写线程 + {args.readers} 个读线程)，{args.seconds:g} 秒')
+    for mode in args.mode or list(MODES):
+        r = run(mode, args.busy_timeout, args.processes, args.threads, args.readers, args.seconds)
+        print(f"{mode:10} 写入 {r['products']:6d} 条  {r['writes_per_sec']:7.1f} 条/秒  "
+              f"耗时 {r['elapsed']:5.1f} 秒  日志 {r['logs']:6d}  读 {r['reads']:6d}  锁错误 {r['locked']:5d}  失败请求 {r['failed']:4d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""gunicorn worker 内存测量
+
+用 gunicorn_config.py 启动 gunicorn，等所有 worker 预热完成并处理一些请求后，
+读取每个 worker 的 /proc/<pid>/smaps_rollup：
+
+    RSS   进程映射的全部物理内存，包括与主进程共享的页
+    PSS   共享页按共享进程数平摊后的内存
+    USS   只属于该 worker 的内存（Private_Clean + Private_Dirty），即每多一个 worker 增加的内存
+
+主进程和所有 worker 的 PSS 之和是这组进程实际占用的内存。每 GB 可运行的
+worker 数按 1024 / 平均 PSS 估算（包含 worker 分摊的主进程共享页），USS 是下限。
+--compare 时分别关闭和打开 GUNICORN_GC_FREEZE 各测一次。
+
+请求中包括以管理员身份调用的 /api/analytics/* 报表。这些报表和导入、导出一样
+只应在任务进程中用到 pandas，任何 worker 映射了 pandas 时以非零状态退出。
+
+GC 冻结的效果要等 worker 做过完整的第 2 代回收才会体现，请求数少时看不出差别。
+
+    python benchmarks/worker_memory.py --workers 4 --requests 200
+    python benchmarks/worker_memory.py --compare
+
+只支持 Linux；默认使用临时 SQLite 文件，不启动后台任务进程。
+"""
+import argparse
+import http.cookiejar
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = 'worker-memory'
+ADMIN = ('worker-memory', 'worker-memory-password')
+
+# 每个 worker 都应处理到的请求：同步拉取、变更记录、就绪检查、分析报表
+PATHS = ('/api/sync/pull?limit=500', '/api/changes?after=0', '/ready',
+         '/api/analytics/monthly_sales', '/api/analytics/year_over_year')
+
+SETUP = """
+from app import app
+from migrate_db import migrate_database
+from models import db, User
+
+migrate_database()
+with app.app_context():
+    user = User(username={username!r}, role='admin')
+    user.set_password({password!r})
+    db.session.add(user)
+    db.session.commit()
+"""
+
+
+def smaps(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': values['Rss'] / 1024,
+        'pss': values['Pss'] / 1024,
+        'uss': (values['Private_Clean'] + values['Private_Dirty']) / 1024,
+    }
+
+
+def loaded(pid, module):
+    with open(f'/proc/{pid}/maps') as f:
+        return any(f'/{module}/' in line for line in f)
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def get(port, path, opener=None):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}{path}', headers={'Authorization': f'Bearer {TOKEN}'})
+    try:
+        with (opener or urllib.request.build_opener()).open(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def login(port):
+    """以管理员身份登录，返回带会话 cookie 的 opener"""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    with opener.open(f'http://127.0.0.1:{port}/login', timeout=10) as response:
+        match = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', response.read().decode('utf-8'))
+    data = {'username': ADMIN[0], 'password': ADMIN[1], 'csrf_token': match.group(1) if match else ''}
+    with opener.open(f'http://127.0.0.1:{port}/login', urllib.parse.urlencode(data).encode(), timeout=10) as response:
+        # 登录成功后跳转到首页，失败时停留在登录页
+        if urllib.parse.urlsplit(response.geturl()).path == '/login':
+            raise RuntimeError('admin login failed')
+    return opener
+
+
+def measure(workers, requests, gc_freeze, port):
+    workdir = tempfile.mkdtemp(prefix='worker-memory-')
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_GC_FREEZE='1' if gc_freeze else '0',
+        JOB_WORKER_EMBEDDED='0',
+        SYNC_TOKEN=TOKEN,
+        PORT=str(port),
+    )
+    subprocess.run([sys.executable, '-c', SETUP.format(username=ADMIN[0], password=ADMIN[1])],
+                   cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '--pid', os.path.join(workdir, 'gunicorn.pid'),
+         'wsgi:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.time() + 60
+        while len(children(server.pid)) < workers or get(port, '/ready') != 200:
+            if time.time() > deadline or server.poll() is not None:
+                raise RuntimeError('gunicorn did not become ready')
+            time.sleep(0.5)
+        # 请求分散到各个 worker
+        opener = login(port)
+        for i in range(requests):
+            get(port, PATHS[i % len(PATHS)], opener)
+        time.sleep(1)
+
+        rows = []
+        for pid in children(server.pid):
+            row = smaps(pid)
+            row.update(pid=pid, pandas=loaded(pid, 'pandas'))
+            rows.append(row)
+        master = smaps(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return master, rows
+
+
+def report(label, master, rows):
+    print(f'\n{label}')
+    print(f"  master  RSS {master['rss']:7.1f} MB")
+    for row in rows:
+        print(f"  {row['pid']:>6}  RSS {row['rss']:7.1f}  PSS {row['pss']:7.1f}  USS {row['uss']:7.1f} MB"
+              f"{'  (pandas loaded)' if row['pandas'] else ''}")
+    pss = sum(row['pss'] for row in rows) / len(rows)
+    uss = sum(row['uss'] for row in rows) / len(rows)
+    total = master['pss'] + sum(row['pss'] for row in rows)
+    print(f'  合计 PSS {total:.1f} MB，平均 PSS {pss:.1f} MB / USS {uss:.1f} MB，'
+          f'约 {1024 / pss:.1f} 个 worker/GB（按 USS {1024 / uss:.1f}）')
+    return pss
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gunicorn worker 内存测量')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--compare', action='store_true', help='分别关闭和打开 GC 冻结各测一次')
+    parser.add_argument('--no-gc-freeze', action='store_true')
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = [('GUNICORN_GC_FREEZE=0', measure(args.workers, args.requests, False, args.port)),
+                ('GUNICORN_GC_FREEZE=1', measure(args.workers, args.requests, True, args.port + 1))]
+    else:
+        gc_freeze = not args.no_gc_freeze
+        runs = [(f'GUNICORN_GC_FREEZE={int(gc_freeze)}', measure(args.workers, args.requests, gc_freeze, args.port))]
+    pss = [report(label, *result) for label, result in runs]
+    if args.compare:
+        before, after = pss
+        print(f'\n每个 worker PSS 减少 {before - after:.1f} MB，worker/GB {1024 / before:.1f} -> {1024 / after:.1f}')
+
+    loaded_pandas = [row['pid'] for label, (master, rows) in runs for row in rows if row['pandas']]
+    if loaded_pandas:
+        sys.exit(f'pandas 被加载到了网页 worker 中: {loaded_pandas}')
+
+
+if __name__ == '__main__':
+    main()
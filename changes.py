@@ -0,0 +1,242 @@
+"""Product/ProductPrice 变更记录（事务性 outbox）
+
+网页端 session 每次 flush 时，把本次新增、修改、删除的 Product 和
+ProductPrice 行写入 change_record，与业务数据在同一个事务中提交或回滚。
+每条变更带有变更前后的整行内容(JSON)，id 为单调递增的序号。批量导入
+绕过了 ORM，由 importer 调用 record() 显式登记。
+
+下游（缓存、汇总、导出）按序号增量读取，不再全表扫描：
+
+    changes.read(session, after=序号)              读取一批变更
+    changes.consume(session, '消费者名', handler)   处理并提交消费进度
+
+Postgres 上序号在插入时分配、提交顺序可能不同：读到的序号中间有空缺时，
+空缺可能是还没提交的事务。read() 遇到最近 lag 秒内出现的空缺就停在空缺之前，
+等下一次再读；更早的空缺视为已回滚的事务，直接跳过。因此写入变更的事务
+不应超过 lag 秒（批量导入按块提交）。SQLite 的写事务本身是串行的，不做检查。
+
+    python changes.py tail --after 0     打印变更
+    python changes.py purge              清理所有消费者都已处理且超过保留天数的变更
+"""
+import argparse
+import json
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+
+from sqlalchemy import event, func, insert, inspect, select, update as sql_update
+
+from database import RoutingSession
+from models import DEFAULT_STORE_ID, ChangeConsumer, ChangeRecord, Product, ProductPrice
+
+# 记录变更的模型 -> entity 名称
+TRACKED = {Product: 'product', ProductPrice: 'product_price'}
+
+# 读取时等待序号空缺补齐的秒数（见模块说明）
+READ_LAG = 30
+
+
+def _jsonable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _json_default(value):
+    converted = _jsonable(value)
+    if converted is value:
+        raise TypeError(f'{type(value).__name__} is not JSON serializable')
+    return converted
+
+
+def _row(state):
+    """实例当前已加载的列值，不会触发额外查询"""
+    return {
+        attr.key: _jsonable(state.dict[attr.key])
+        for attr in state.mapper.column_attrs
+        if attr.key in state.dict
+    }
+
+
+def record(session, entity, op, rows):
+    """登记一批变更；rows 为 [(store_id, entity_id, before, after)]，before/after 为 dict 或 None"""
+    if not rows:
+        return
+    now = datetime.now()
+    session.execute(insert(ChangeRecord.__table__), [
+        {
+            'store_id': store_id or DEFAULT_STORE_ID,
+            'entity': entity,
+            'entity_id': entity_id,
+            'op': op,
+            'before': json.dumps(before, ensure_ascii=False, default=_json_default) if before is not None else None,
+            'after': json.dumps(after, ensure_ascii=False, default=_json_default) if after is not None else None,
+            'created_at': now,
+        }
+        for store_id, entity_id, before, after in rows
+    ])
+
+
+def _capture(session, flush_context):
+    pending = []
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            entity = TRACKED.get(type(obj))
+            if entity is None:
+                continue
+            state = inspect(obj)
+            current = _row(state)
+            if op == 'insert':
+                before, after = None, current
+            elif op == 'delete':
+                before, after = current, None
+            else:
+                before = dict(current)
+                for key in current:
+                    deleted = state.attrs[key].history.deleted
+                    if deleted:
+                        before[key] = _jsonable(deleted[0])
+                after = current
+                if before == after:
+                    continue
+            pending.append((entity, op, (obj.store_id, current['id'], before, after)))
+
+    # 同一次 flush 内按 entity、op 分组批量写入
+    for entity in TRACKED.values():
+        for op in ('insert', 'update', 'delete'):
+            record(session, entity, op, [row for e, o, row in pending if e == entity and o == op])
+
+
+event.listen(RoutingSession, 'after_flush', _capture)
+
+
+def _to_dict(change):
+    return {
+        'seq': change.id,
+        'store_id': change.store_id,
+        'entity': change.entity,
+        'entity_id': change.entity_id,
+        'op': change.op,
+        'before': json.loads(change.before) if change.before else None,
+        'after': json.loads(change.after) if change.after else None,
+        'created_at': change.created_at.isoformat(),
+    }
+
+
+def visible_until(session, id_column, time_column, after, lag=READ_LAG):
+    """按自增 id 增量读取时可以安全读取到的最大 id；没有需要等待的空缺时返回 None
+
+    Postgres 上 id 在插入时分配，id 大于 after 的行中，最近 lag 秒内写入的行之间
+    (或之前)有空缺时，空缺可能是还没提交的事务，返回空缺之前的 id。
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        return None
+    recent = session.scalars(
+        select(id_column)
+        .where(id_column > after, time_column >= datetime.now() - timedelta(seconds=lag))
+        .order_by(id_column)
+    ).all()
+    if not recent:
+        return None
+    previous = session.execute(
+        select(func.max(id_column)).where(id_column > after, id_column < recent[0])
+    ).scalar()
+    expected = (previous if previous is not None else after) + 1
+    for seq in recent:
+        if seq != expected:
+            return expected - 1
+        expected += 1
+    return None
+
+
+def read(session, after=0, limit=500, entity=None, store_id=None, lag=READ_LAG):
+    """返回序号大于 after 的一批变更(dict)，按序号排序；停在可能未提交的空缺之前"""
+    stmt = select(ChangeRecord).where(ChangeRecord.id > after).order_by(ChangeRecord.id).limit(limit)
+    until = visible_until(session, ChangeRecord.id, ChangeRecord.created_at, after, lag)
+    if until is not None:
+        stmt = stmt.where(ChangeRecord.id <= until)
+    if entity is not None:
+        stmt = stmt.where(ChangeRecord.entity == entity)
+    if store_id is not None:
+        stmt = stmt.where(ChangeRecord.store_id == store_id)
+    return [_to_dict(change) for change in session.scalars(stmt)]
+
+
+def position(session, consumer):
+    """消费者已处理到的序号"""
+    row = session.get(ChangeConsumer, consumer)
+    return row.last_seq if row is not None else 0
+
+
+def ack(session, consumer, seq, expected):
+    """把消费进度从 expected 推进到 seq；进度已被其他进程推进时返回 False。调用方负责 commit"""
+    if session.get(ChangeConsumer, consumer) is None:
+        session.add(ChangeConsumer(name=consumer, last_seq=0))
+        session.flush()
+    result = session.execute(
+        sql_update(ChangeConsumer)
+        .where(ChangeConsumer.name == consumer, ChangeConsumer.last_seq == expected)
+        .values(last_seq=seq, updated_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def consume(session, consumer, handler, batch_size=500, entity=None, lag=READ_LAG):
+    """按批处理新的变更，返回处理条数
+
+    handler(session, changes) 在同一个事务里更新下游数据，和消费进度一起提交；
+    进度被其他进程抢先推进时回滚本批，由那个进程负责。
+    """
+    total = 0
+    while True:
+        start = position(session, consumer)
+        batch = read(session, start, batch_size, entity, lag=lag)
+        if not batch:
+            return total
+        handler(session, batch)
+        if not ack(session, consumer, batch[-1]['seq'], start):
+            session.rollback()
+            return total
+        session.commit()
+        total += len(batch)
+        if len(batch) < batch_size:
+            return total
+
+
+def purge(session, keep_days=30):
+    """删除超过 keep_days 天、且所有消费者都已处理过的变更，返回删除条数；调用方负责 commit"""
+    stmt = ChangeRecord.__table__.delete().where(
+        ChangeRecord.created_at < datetime.now() - timedelta(days=keep_days)
+    )
+    slowest = session.execute(select(func.min(ChangeConsumer.last_seq))).scalar()
+    if slowest is not None:
+        stmt = stmt.where(ChangeRecord.id <= slowest)
+    return session.execute(stmt).rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Product/ProductPrice 变更记录')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    tail = subparsers.add_parser('tail', help='打印变更')
+    tail.add_argument('--after', type=int, default=0, help='从该序号之后开始')
+    tail.add_argument('--limit', type=int, default=100)
+    tail.add_argument('--entity', choices=sorted(TRACKED.values()))
+    subparsers.add_parser('purge', help='清理已处理的旧变更')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    with app.app_context():
+        if args.command == 'tail':
+            for change in read(db.session, args.after, args.limit, args.entity, lag=app.config['CHANGE_READ_LAG']):
+                print(json.dumps(change, ensure_ascii=False))
+        else:
+            count = purge(db.session, app.config['CHANGE_RETENTION_DAYS'])
+            db.session.commit()
+            print(f'删除了 {count} 条变更记录')
+
+
+if __name__ == '__main__':
+    main()
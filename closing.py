@@ -0,0 +1,170 @@
+"""日结
+
+结账某一天时，把当天每个商品的最终汇总（进货、销售、盘点、损耗、利润、
+库存）写入 daily_summary，并记录 day_close。库存是累计值，之前任何一天的
+改动都会改变结账日的库存，所以结账日期及之前的所有日期都不能再修改：
+新增、修改、删除、导入和同步推送都会被拒绝，需要管理员重新开账。
+
+已结账日期的数据不会再变化，首页和库存页直接读取保存的汇总，并允许
+浏览器长期缓存；同一日期范围的导出文件也可以复用。
+"""
+from datetime import date, datetime
+
+from sqlalchemy import select, func, delete
+
+import reports
+from models import VEGETABLES, DEFAULT_STORE_ID, DayClose, DailySummary, Product, Store
+
+SUMMARY_FIELDS = ['purchase_g', 'purchase_fen', 'sale_g', 'sale_fen', 'actual_g', 'loss_g', 'profit_fen', 'stock_g']
+
+
+class DayClosed(Exception):
+    """要修改的日期已结账"""
+
+    def __init__(self, day):
+        super().__init__(f'{day:%Y-%m-%d} 已结账')
+        self.day = day
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _lock_store(session, store_id, exclusive=False):
+    """结账和写入记录互斥，避免结账时汇总漏掉同时提交的记录
+
+    写入记录取共享锁 (FOR KEY SHARE)，同一门店的写入之间不互相等待；结账和重新开账
+    取排他锁 (FOR UPDATE)，等进行中的写入提交后再汇总。SQLite 忽略这些锁，写事务本身串行。
+    """
+    stmt = select(Store.id).where(Store.id == store_id)
+    if exclusive:
+        stmt = stmt.with_for_update()
+    else:
+        stmt = stmt.with_for_update(read=True, key_share=True)
+    session.execute(stmt)
+
+
+def closed_through(session, store_id=DEFAULT_STORE_ID):
+    """最近的结账日期，该日期及之前都不能修改；没有结账时返回 None"""
+    return session.execute(select(func.max(DayClose.day)).where(DayClose.store_id == store_id)).scalar()
+
+
+def is_frozen(session, day, store_id=DEFAULT_STORE_ID):
+    until = closed_through(session, store_id)
+    return until is not None and _as_date(day) <= until
+
+
+def writable_after(session, store_id=DEFAULT_STORE_ID):
+    """取写入用的门店共享锁，返回结账日期（该日期及之前不能写入，没有结账时为 None）；在写入记录的事务中调用"""
+    _lock_store(session, store_id)
+    return closed_through(session, store_id)
+
+
+def check_open(session, days, store_id=DEFAULT_STORE_ID):
+    """days 中有已结账的日期时抛出 DayClosed；在写入记录的事务中调用"""
+    until = writable_after(session, store_id)
+    if until is None:
+        return
+    for day in days:
+        if _as_date(day) <= until:
+            raise DayClosed(_as_date(day))
+
+
+def covering_close(session, day, store_id=DEFAULT_STORE_ID):
+    """使 day 不能修改的那次结账（day 当天或之后最早的一次），没有时返回 None
+
+    重新开账会删除该日期及之后的所有结账，再次结账时 closed_at 一定更新，
+    所以 closed_at 之前生成的内容在 day 仍然冻结期间都不会过期。
+    """
+    return session.scalars(
+        select(DayClose).where(DayClose.store_id == store_id, DayClose.day >= _as_date(day))
+        .order_by(DayClose.day).limit(1)
+    ).first()
+
+
+def close_day(session, day, user_id=None, store_id=DEFAULT_STORE_ID, names=VEGETABLES):
+    """结账并保存当天汇总，返回 DayClose；已经结账时直接返回原记录。调用方负责 commit"""
+    day = _as_date(day)
+    if day > date.today():
+        raise ValueError('不能结账未来的日期')
+    _lock_store(session, store_id, exclusive=True)
+    existing = session.scalars(
+        select(DayClose).where(DayClose.store_id == store_id, DayClose.day == day)
+    ).first()
+    if existing is not None:
+        return existing
+
+    summary = reports.daily_summary(session, day, names, store_id)
+    session.add_all(
+        DailySummary(store_id=store_id, day=day, name=name, **{field: row[field] for field in SUMMARY_FIELDS})
+        for name, row in summary.items()
+    )
+    close = DayClose(store_id=store_id, day=day, closed_by=user_id, closed_at=datetime.now())
+    session.add(close)
+    session.flush()
+    return close
+
+
+def reopen(session, day, store_id=DEFAULT_STORE_ID):
+    """重新开账：day 及之后的结账和汇总全部删除，返回被取消结账的日期。调用方负责 commit"""
+    day = _as_date(day)
+    _lock_store(session, store_id, exclusive=True)
+    days = session.scalars(
+        select(DayClose.day).where(DayClose.store_id == store_id, DayClose.day >= day).order_by(DayClose.day)
+    ).all()
+    session.execute(delete(DailySummary).where(DailySummary.store_id == store_id, DailySummary.day >= day))
+    session.execute(delete(DayClose).where(DayClose.store_id == store_id, DayClose.day >= day))
+    return days
+
+
+def snapshot(session, day, store_id=DEFAULT_STORE_ID, names=VEGETABLES):
+    """结账时保存的汇总，格式和商品顺序同 reports.daily_summary；该日期没有结账时返回 None
+
+    不在 names 中的商品（结账后从商品列表移除的）按名称排在最后。
+    """
+    rows = session.scalars(
+        select(DailySummary).where(DailySummary.store_id == store_id, DailySummary.day == _as_date(day))
+        .order_by(DailySummary.name)
+    ).all()
+    if not rows:
+        return None
+    saved = {row.name: {field: getattr(row, field) for field in SUMMARY_FIELDS} for row in rows}
+    ordered = {name: saved.pop(name) for name in names if name in saved}
+    ordered.update(saved)
+    return ordered
+
+
+def daily_summary(session, day, store_id=DEFAULT_STORE_ID):
+    """结账日期读取保存的汇总，其他日期实时计算"""
+    saved = snapshot(session, day, store_id)
+    return saved if saved is not None else reports.daily_summary(session, day, store_id=store_id)
+
+
+def split_sync_records(session, records):
+    """同步推送的记录中，新日期或服务器上的原日期已结账的不能写入，返回 (可写入, 被拒绝)"""
+    until = {
+        store_id: day for store_id, day in session.execute(
+            select(DayClose.store_id, func.max(DayClose.day)).group_by(DayClose.store_id)
+        )
+    }
+    if not until:
+        return records, []
+    existing = {
+        sync_id: (store_id, day) for sync_id, store_id, day in session.execute(
+            select(Product.sync_id, Product.store_id, Product.date)
+            .where(Product.sync_id.in_([record['sync_id'] for record in records]))
+        )
+    }
+
+    def frozen(store_id, value):
+        return store_id in until and _as_date(value) <= until[store_id]
+
+    allowed, rejected = [], []
+    for record in records:
+        store_id = record.get('store_id') or DEFAULT_STORE_ID
+        old = existing.get(record['sync_id'])
+        if frozen(store_id, datetime.fromisoformat(record['date'])) or (old is not None and frozen(*old)):
+            rejected.append(record)
+        else:
+            allowed.append(record)
+    return allowed, rejected
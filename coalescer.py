@@ -0,0 +1,105 @@
+"""写入合并
+
+SQLite 同一时间只允许一个写事务，每次提交都要取得写锁并同步磁盘。很多请求
+在业务数据提交之后还要单独提交一次操作日志，这类小写入互不相关，可以合并：
+请求线程把写入函数交给进程内唯一的写入线程，写入线程把同时到达的写入放进
+同一个事务，每个写入各用一个 SAVEPOINT（一个失败不影响其他），最后只提交一次。
+
+    coalescer.execute(engine, lambda connection: connection.execute(insert(...)))
+
+execute() 等到所在的事务提交后才返回，出错时在调用方抛出异常，语义与直接提交
+相同；超过 timeout 秒没有结果时抛出 TimeoutError（写入可能稍后仍会提交）。
+写入线程在第一次使用时启动（gunicorn fork 之后，每个 worker 各有一个）。
+调用方不能在持有写事务时调用，否则写入线程要等调用方释放写锁。
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class WriteCoalescer:
+    def __init__(self, max_batch=100):
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # fork 出的子进程没有父进程的线程，按进程号判断是否需要重新启动
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # 从父进程复制来的队列属于父进程，子进程不能再执行这些写入
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                # 同一进程内写入线程意外退出时沿用原队列，已排队的写入不会丢失
+                self._thread = threading.Thread(target=self._run, name='write-coalescer', daemon=True)
+                self._thread.start()
+
+    def submit(self, engine, func):
+        """提交写入函数 func(connection)，返回 Future，结果为 func 的返回值"""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((engine, func, future))
+        return future
+
+    def execute(self, engine, func, timeout=30):
+        return self.submit(engine, func).result(timeout)
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        # 写入线程忙于上一批时到达的写入都在队列中，一次取出
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            by_engine = {}
+            for engine, func, future in batch:
+                by_engine.setdefault(engine, []).append((func, future))
+            for engine, items in by_engine.items():
+                try:
+                    self._commit(engine, items)
+                finally:
+                    # 正常情况下都已有结果；写入线程意外退出时调用方也不会一直等待
+                    self._fail(items, RuntimeError('write coalescer stopped'))
+
+    def _commit(self, engine, items):
+        results = []
+        try:
+            with engine.begin() as connection:
+                for func, future in items:
+                    try:
+                        with connection.begin_nested():
+                            results.append((future, func(connection)))
+                    except Exception as e:
+                        future.set_exception(e)
+        except Exception as e:
+            # 连接失败时一条都没有执行；提交失败时已执行的也一起回滚
+            logger.exception("Coalesced commit of %d writes failed", len(items))
+            self._fail(items, e)
+            return
+        for future, result in results:
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(items, error):
+        for _, future in items:
+            if not future.done():
+                future.set_exception(error)
+
+
+coalescer = WriteCoalescer()
@@ -3,4 +3,118 @@ import os
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///inventory.db'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False 
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # 数据库连接池：每个进程的连接数、额外连接数、等待秒数、连接回收秒数、
+    # 使用前是否检测连接（SQLite 内存库只使用后两项）
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    # 只读副本地址，设置后首页、库存页、操作日志、报表和导出从副本读取
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+
+    # 桌面端同步接口的访问令牌，未设置时同步接口不可用
+    SYNC_TOKEN = os.environ.get('SYNC_TOKEN')
+    # 同步拉取只返回这么多秒之前更新的记录，等提交较晚的事务写完，避免水位线越过它们
+    SYNC_PULL_LAG = int(os.environ.get('SYNC_PULL_LAG', '10'))
+
+    # 登录用户缓存：每个进程最多缓存的用户数和过期秒数
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '256'))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '60'))
+
+    # 密码哈希算法及参数，例如 'scrypt:32768:8:1' 或 'pbkdf2:sha256:600000'；
+    # 修改后用户下次登录时会自动按新参数重新计算
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # 密码校验线程池：并发数、排队数、等待秒数
+    LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', '2'))
+    LOGIN_HASH_QUEUE = int(os.environ.get('LOGIN_HASH_QUEUE', '8'))
+    LOGIN_HASH_TIMEOUT = float(os.environ.get('LOGIN_HASH_TIMEOUT', '5'))
+    # 每分钟允许的登录尝试次数
+    LOGIN_RATE_PER_IP = int(os.environ.get('LOGIN_RATE_PER_IP', '10'))
+    LOGIN_RATE_PER_USERNAME = int(os.environ.get('LOGIN_RATE_PER_USERNAME', '5'))
+    # 应用前面的反向代理层数（Render 为 1），按 X-Forwarded-For 取客户端 IP，登录按 IP 限流时使用；
+    # 0 表示直接对外服务，不信任该请求头
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', '0'))
+
+    # 首页详细记录及 /api/records 每页条数
+    RECORDS_PAGE_SIZE = int(os.environ.get('RECORDS_PAGE_SIZE', '50'))
+
+    # 按月导出的 Parquet 分析快照目录，由 `python analytics.py export` 生成
+    ANALYTICS_DIR = os.environ.get('ANALYTICS_DIR', 'analytics')
+
+    # 进货建议使用的历史销量天数
+    FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', '56'))
+    # job worker 每天几点（打烊后）计算第二天的进货建议，-1 不自动计算
+    FORECAST_HOUR = int(os.environ.get('FORECAST_HOUR', '21'))
+
+    # 重复提交保护：幂等键保留的小时数
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '24'))
+
+    # 实时更新 (/events)：轮询间隔、单个连接时长、心跳间隔(秒)，事件保留秒数
+    LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', '1'))
+    LIVE_STREAM_SECONDS = int(os.environ.get('LIVE_STREAM_SECONDS', '300'))
+    LIVE_HEARTBEAT = int(os.environ.get('LIVE_HEARTBEAT', '15'))
+    # 每个进程同时保持的实时更新连接数上限，0 不限制。每个连接在 LIVE_STREAM_SECONDS 内一直占用一个线程，
+    # 默认取每个进程线程数（GUNICORN_THREADS；waitress 同为 4）的一半，其余线程留给普通请求
+    LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', str(max(1, int(os.environ.get('GUNICORN_THREADS', '4')) // 2))))
+    LIVE_EVENT_RETENTION = int(os.environ.get('LIVE_EVENT_RETENTION', '3600'))
+
+    # 上传文件大小上限（批量导入），单位：MB
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_MB', '50')) * 1024 * 1024
+
+    # 变更记录 (change_record) 保留天数，所有消费者处理过之后才会清理
+    CHANGE_RETENTION_DAYS = int(os.environ.get('CHANGE_RETENTION_DAYS', '30'))
+    # 按自增 id 增量读取（变更记录、盘点损耗统计）时，最近多少秒内的 id 空缺视为未提交的事务并等待（Postgres）
+    CHANGE_READ_LAG = int(os.environ.get('CHANGE_READ_LAG', '30'))
+
+    # 后台任务 (jobs.py)：文件目录、同时执行的任务数、每个用户排队上限、心跳超时（秒）、保留天数
+    JOB_DIR = os.environ.get('JOB_DIR', 'job_files')
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+    JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', '5'))
+    JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', '300'))
+    JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+    # gunicorn/run_prod.py 启动时是否同时启动 worker 进程
+    JOB_WORKER_EMBEDDED = os.environ.get('JOB_WORKER_EMBEDDED', '1') == '1'
+    # job worker 自动更新盘点损耗统计 (losses.py) 的间隔（秒），0 不自动更新
+    LOSS_UPDATE_INTERVAL = int(os.environ.get('LOSS_UPDATE_INTERVAL', '300'))
+
+    # 已结账日期的页面允许浏览器缓存的秒数；重新开账后缓存过期前可能看到旧页面
+    CLOSED_DAY_MAX_AGE = int(os.environ.get('CLOSED_DAY_MAX_AGE', str(7 * 24 * 3600)))
+
+    # worker 预热 (warmup.py) 时预先建立的数据库连接数，默认与 gunicorn 每个 worker 的线程数相同
+    WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', os.environ.get('GUNICORN_THREADS', '4')))
+
+    # SQLite 部署 (database.setup_sqlite)：WAL、等锁毫秒数、写请求使用 BEGIN IMMEDIATE
+    SQLITE_WAL = os.environ.get('SQLITE_WAL', '1') == '1'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))
+    SQLITE_IMMEDIATE_WRITES = os.environ.get('SQLITE_IMMEDIATE_WRITES', '1') == '1'
+    # 操作日志等独立的小写入交给进程内的写入线程合并提交 (coalescer.py)
+    SQLITE_WRITE_COALESCE = os.environ.get('SQLITE_WRITE_COALESCE', '0') == '1'
+    SQLITE_COALESCE_BATCH = int(os.environ.get('SQLITE_COALESCE_BATCH', '100'))
+
+    # 备份 (backup.py)：备份目录、SQLite 每步复制的页数和步间暂停秒数、重来多少次后改为一次复制完、
+    # PostgreSQL 增量备份向前多取的秒数
+    BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+    BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', '1024'))
+    BACKUP_PAUSE = float(os.environ.get('BACKUP_PAUSE', '0.02'))
+    BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', '5'))
+    BACKUP_OVERLAP = int(os.environ.get('BACKUP_OVERLAP', '600'))
+
+    # 请求性能分析 (profiling.py)：报告目录、随机采样分析的请求比例（0 关闭）、采样间隔秒数、保留份数
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.005'))
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '200'))
+
+    # 日志 (logging_setup.py)：根级别；单独的 logger 级别如 "sqlalchemy.engine=INFO,live=WARNING"；
+    # 输出格式 json 或 text；INFO 及以下高频日志的采样比例如 "gunicorn.access=0.1"；队列长度（满时丢弃）
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_SAMPLE = os.environ.get('LOG_SAMPLE', '')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+    # 同时写入的日志文件，留空只输出到 stdout
+    LOG_FILE = os.environ.get('LOG_FILE', '')
@@ -0,0 +1,189 @@
+"""数据库连接池和只读副本
+
+连接池参数全部来自环境变量（见 config.py 中的 DB_* 配置），通过
+SQLALCHEMY_ENGINE_OPTIONS 传给 Flask-SQLAlchemy，对主库和副本都生效。
+
+设置 DATABASE_REPLICA_URL 后注册名为 replica 的 bind。用 @read_replica 标记的
+只读页面在请求内的查询走副本；flush 以及 INSERT/UPDATE/DELETE 语句始终走主库，
+所以这些页面里顺带写入的操作日志等仍然落在主库上。没有配置副本时所有查询
+走主库，行为与原来一致。
+
+SQLite 文件库由 setup_sqlite() 设置（见 config.py 中的 SQLITE_* 配置）：
+
+    journal_mode=WAL     读不阻塞写、写不阻塞读，提交时只追加 WAL 文件
+    busy_timeout         遇到写锁时等待而不是立即报 "database is locked"
+    BEGIN IMMEDIATE      用 @writes 标记的视图和 with writing(): 块中开始的事务一开始就取得写锁。
+                         默认的 BEGIN 先读后写，两个事务都读过之后同时升级为写锁时，SQLite 会让
+                         其中一个立即失败，busy_timeout 对这种情况不起作用。是否写入按视图标记
+                         而不是按请求方法判断：登录等 POST 请求只读（校验密码期间不能占着写锁），
+                         而 /delete 等 GET 请求会写入
+    进程内写锁           同一进程的写事务先排队取得 write_lock 再 BEGIN IMMEDIATE，每个进程
+                         只有一个连接在等 SQLite 的写锁。SQLite 等锁是按递增间隔休眠重试，
+                         等待者多时锁经常空闲而有的请求一直抢不到，直到超时
+"""
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA = 'replica'
+
+# 进程内的 SQLite 写锁，见 setup_sqlite
+write_lock = threading.RLock()
+
+
+def is_sqlite_file(url):
+    return url.startswith('sqlite') and ':memory:' not in url and url != 'sqlite://'
+
+
+def engine_options(url, pool_size=10, max_overflow=20, pool_timeout=30, pool_recycle=1800, pre_ping=True):
+    """按数据库类型生成 create_engine 参数"""
+    options = {'pool_pre_ping': pre_ping, 'pool_recycle': pool_recycle}
+    # SQLite 内存库使用单连接池，不接受连接数参数
+    if not url.startswith('sqlite') or is_sqlite_file(url):
+        options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+    return options
+
+
+def configure(app):
+    """根据配置设置主库连接池参数和副本 bind，需在 db.init_app 之前调用"""
+    config = app.config
+    pool = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config['SQLALCHEMY_DATABASE_URI'], **pool)
+    replica_url = config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        config['SQLALCHEMY_BINDS'] = {REPLICA: {'url': replica_url, **engine_options(replica_url, **pool)}}
+
+
+def _write_transaction():
+    return has_app_context() and g.get('write_transaction', False)
+
+
+@contextmanager
+def writing():
+    """块中开始的事务使用 BEGIN IMMEDIATE
+
+    进入时提交当前请求中已经打开的只读事务（如 login_required 加载用户），之后的第一条
+    语句重新开始事务；块内提交之后再开始的事务同样使用 BEGIN IMMEDIATE。
+    """
+    if g.get('write_transaction'):
+        yield
+        return
+    session = current_app.extensions['sqlalchemy'].session
+    if session().in_transaction():
+        session.commit()
+    g.write_transaction = True
+    try:
+        yield
+    finally:
+        g.write_transaction = False
+
+
+def writes(*methods):
+    """标记写数据的视图，请求方法在 methods 中（未指定时为任意方法）时整个视图在 writing() 中执行"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if methods and request.method not in methods:
+                return view(*args, **kwargs)
+            with writing():
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def setup_sqlite(engine, wal=True, busy_timeout=5000, immediate_writes=True):
+    """为 SQLite 引擎的每个新连接设置 WAL 和等锁时间，并由 SQLAlchemy 发出 BEGIN"""
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        if immediate_writes:
+            # 关闭 pysqlite 自动开始事务，改由下面的 begin 事件发出 BEGIN（同时使 SAVEPOINT 正常工作）
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout)}')
+        if wal:
+            cursor.execute('PRAGMA journal_mode = WAL')
+            # WAL 模式下 NORMAL 只在断电时可能丢失最后几个事务，不会损坏数据库
+            cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.close()
+
+    if not immediate_writes:
+        return
+
+    def release(info):
+        if info.pop('write_lock', False):
+            write_lock.release()
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        if not _write_transaction():
+            connection.exec_driver_sql('BEGIN')
+            return
+        # 等不到进程内的写锁时仍然执行 BEGIN IMMEDIATE，由 SQLite 按 busy_timeout 报错
+        if write_lock.acquire(timeout=busy_timeout / 1000):
+            connection.info['write_lock'] = True
+        try:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+        except Exception:
+            release(connection.info)
+            raise
+
+    @event.listens_for(engine, 'commit')
+    @event.listens_for(engine, 'rollback')
+    def end(connection):
+        release(connection.info)
+
+    # 连接未结束事务就归还或失效时，由连接池回滚，同样释放写锁
+    @event.listens_for(engine.pool, 'reset')
+    def reset(dbapi_connection, connection_record, reset_state):
+        release(connection_record.info)
+
+    @event.listens_for(engine.pool, 'invalidate')
+    def invalidate(dbapi_connection, connection_record, exception):
+        release(connection_record.info)
+
+
+def init_engines(app, db):
+    """设置 Flask-SQLAlchemy 创建的引擎，需在 db.init_app 之后调用"""
+    config = app.config
+    with app.app_context():
+        for engine in db.engines.values():
+            if is_sqlite_file(str(engine.url)):
+                setup_sqlite(engine, wal=config['SQLITE_WAL'], busy_timeout=config['SQLITE_BUSY_TIMEOUT'],
+                             immediate_writes=config['SQLITE_IMMEDIATE_WRITES'])
+
+
+def read_replica(view):
+    """标记只读视图：请求内的查询从副本读取"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """只读请求中的查询路由到副本，写入始终使用主库"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and not getattr(clause, 'is_dml', False)
+            and has_request_context()
+            and g.get('read_replica')
+        ):
+            engine = self._db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
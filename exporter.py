@@ -0,0 +1,84 @@
+"""导出进货、销售、盘点记录到 Excel
+
+由后台任务 (jobs.py) 调用，结果写到文件。记录按类型用 yield_per 分批读取，
+用 xlsxwriter 的 constant_memory 模式逐行写入，写完的行立即落盘，不会把整个
+日期范围的记录同时放在内存里。
+"""
+import xlsxwriter
+from sqlalchemy import select
+
+from models import DEFAULT_STORE_ID, Product
+from numeric import fen_to_yuan, grams_to_jin
+
+BATCH_SIZE = 5000
+
+# 表头样式，与 pandas.DataFrame.to_excel 一致
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+# 工作表名 -> (记录类型, [(列名, 取值函数)])
+SHEETS = {
+    '进货记录': ('purchase', [
+        ('商品名称', lambda p: p.name),
+        ('进货价格', lambda p: float(fen_to_yuan(p.price_fen))),
+        ('数量', lambda p: float(grams_to_jin(p.quantity_g))),
+        ('进货日期', lambda p: p.date.strftime('%Y-%m-%d')),
+        ('备注', lambda p: p.notes),
+    ]),
+    '销售记录': ('sale', [
+        ('商品名称', lambda p: p.name),
+        ('销售价格', lambda p: float(fen_to_yuan(p.price_fen))),
+        ('数量', lambda p: float(grams_to_jin(p.quantity_g))),
+        ('销售日期', lambda p: p.date.strftime('%Y-%m-%d')),
+        ('备注', lambda p: p.notes),
+    ]),
+    '盘点记录': ('inventory_check', [
+        ('商品名称', lambda p: p.name),
+        ('进货价格', lambda p: float(fen_to_yuan(p.price_fen))),
+        ('盘点数量', lambda p: float(grams_to_jin(p.quantity_g))),
+        ('实际数量', lambda p: float(grams_to_jin(p.actual_quantity_g))),
+        ('亏损数量', lambda p: float(grams_to_jin(p.loss_quantity_g))),
+        ('盘点日期', lambda p: p.date.strftime('%Y-%m-%d')),
+        ('备注', lambda p: p.notes),
+    ]),
+}
+
+
+def _rows(session, type, start, end, store_id, columns):
+    stmt = select(Product).where(
+        Product.store_id == store_id,
+        Product.type == type,
+        Product.date >= start,
+        Product.date <= end
+    ).order_by(Product.name, Product.date, Product.id).execution_options(yield_per=BATCH_SIZE)
+    for product in session.scalars(stmt):
+        yield [value(product) for _, value in columns]
+
+
+def write_export(session, path, start, end, store_id=DEFAULT_STORE_ID, progress=None):
+    """把 [start, end] 内的记录写入 path，返回写入的记录数"""
+    total = 0
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    header = workbook.add_format(HEADER_FORMAT)
+    try:
+        for index, (sheet, (type, columns)) in enumerate(SHEETS.items()):
+            # 没有记录的类型不建工作表；constant_memory 模式下每个工作表必须按行顺序写完
+            worksheet = None
+            count = 0
+            for row in _rows(session, type, start, end, store_id, columns):
+                if worksheet is None:
+                    worksheet = workbook.add_worksheet(sheet)
+                    worksheet.write_row(0, 0, [title for title, _ in columns], header)
+                count += 1
+                worksheet.write_row(count, 0, row)
+            total += count
+            if progress:
+                progress(int((index + 1) * 90 / len(SHEETS)), f'{sheet}: {count} 条')
+    finally:
+        workbook.close()
+    return total
+
+
+def filename(start, end):
+    if start.date() == end.date():
+        return f'库存记录_{start.strftime("%Y%m%d")}.xlsx'
+    return f'库存记录_{start.strftime("%Y%m%d")}-{end.strftime("%Y%m%d")}.xlsx'
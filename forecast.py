@@ -0,0 +1,197 @@
+"""销量预测与进货建议
+
+按商品统计最近 FORECAST_HISTORY_DAYS 天的每日销量，用带星期季节性的指数平滑
+预测下一天的销量，再按历史盘点损耗率放大，减去当前库存得到建议进货量。
+所有商品放在一个 NumPy 矩阵中一起计算。
+
+结果写入 reorder_suggestion 表，批量进货页面直接读取预填数量。
+job worker 每天 FORECAST_HOUR 点排队一次后台任务 forecast，计算所有门店第二天的
+建议；页面打开时还没有建议（worker 没有运行、新开的门店）才当场计算。也可以手动运行：
+
+    python forecast.py                 计算明天的建议
+    python forecast.py --date 2025-06-01
+    python forecast.py --store 2       只计算某个门店，默认所有门店
+"""
+import argparse
+from datetime import datetime, date, timedelta
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import reports
+from models import DEFAULT_STORE_ID, VEGETABLES, Product, ReorderSuggestion, Store
+from numeric import GRAMS_PER_JIN
+
+# 平滑系数，越大越偏向最近几天的销量
+ALPHA = 0.3
+# 损耗率上限，避免个别异常盘点把建议量放得过大
+MAX_LOSS_RATE = 0.5
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def daily_sales_matrix(session, names, start, end, store_id=DEFAULT_STORE_ID):
+    """返回 [商品 x 天] 的销量矩阵(克)，天数为 start 到 end（含）"""
+    days = (end - start).days + 1
+    matrix = np.zeros((len(names), days), dtype=np.int64)
+    index = {name: i for i, name in enumerate(names)}
+
+    day = func.date(Product.date)
+    stmt = select(Product.name, day, func.sum(Product.quantity_g)).where(
+        Product.store_id == store_id,
+        Product.type == 'sale',
+        Product.name.in_(names),
+        Product.date >= datetime.combine(start, datetime.min.time()),
+        Product.date < datetime.combine(end + timedelta(days=1), datetime.min.time())
+    ).group_by(Product.name, day)
+    for name, sale_day, quantity_g in session.execute(stmt):
+        matrix[index[name], (_as_date(sale_day) - start).days] = quantity_g or 0
+    return matrix
+
+
+def forecast_next_day(matrix, start, target):
+    """带星期季节性的指数平滑，返回每个商品在 target 当天的预测销量(克)"""
+    n_products, days = matrix.shape
+    if days == 0:
+        return np.zeros(n_products)
+    sales = matrix.astype(np.float64)
+    weekdays = (np.arange(days) + start.weekday()) % 7
+
+    # 星期系数 = 该星期几的平均销量 / 总平均销量
+    overall = sales.mean(axis=1, keepdims=True)
+    seasonal = np.ones((n_products, 7))
+    for weekday in range(7):
+        mask = weekdays == weekday
+        if mask.any():
+            seasonal[:, weekday] = sales[:, mask].mean(axis=1)
+    seasonal = np.divide(seasonal, overall, out=np.ones_like(seasonal), where=overall > 0)
+
+    # 对去季节化后的序列做简单指数平滑，所有商品一起逐天推进
+    deseasonalized = np.divide(sales, seasonal[:, weekdays], out=np.zeros_like(sales),
+                               where=seasonal[:, weekdays] > 0)
+    level = deseasonalized[:, 0]
+    for t in range(1, days):
+        level = ALPHA * deseasonalized[:, t] + (1 - ALPHA) * level
+
+    return np.maximum(level * seasonal[:, target.weekday()], 0)
+
+
+def loss_rates(session, names, since, store_id=DEFAULT_STORE_ID):
+    """按盘点记录计算损耗率 = 损耗数量 / 系统记录数量"""
+    stmt = select(
+        Product.name,
+        func.coalesce(func.sum(Product.loss_quantity_g), 0),
+        func.coalesce(func.sum(Product.quantity_g), 0)
+    ).where(
+        Product.store_id == store_id,
+        Product.type == 'inventory_check',
+        Product.name.in_(names),
+        Product.date >= datetime.combine(since, datetime.min.time())
+    ).group_by(Product.name)
+
+    rates = np.zeros(len(names))
+    index = {name: i for i, name in enumerate(names)}
+    for name, loss_g, quantity_g in session.execute(stmt):
+        if quantity_g:
+            rates[index[name]] = min(loss_g / quantity_g, MAX_LOSS_RATE)
+    return rates
+
+
+def current_stock_grams(session, names, day, store_id=DEFAULT_STORE_ID):
+    """day 结束时的库存(克)，与首页库存的计算方式一致"""
+    summary = reports.daily_summary(session, day, names, store_id)
+    return np.array([summary[name]['stock_g'] for name in names], dtype=np.int64)
+
+
+def compute_suggestions(session, target=None, history_days=56, names=VEGETABLES, store_id=DEFAULT_STORE_ID):
+    """计算 target 当天的进货建议并写入 reorder_suggestion，调用方负责 commit"""
+    target = target or date.today() + timedelta(days=1)
+    end = target - timedelta(days=1)
+    start = end - timedelta(days=history_days - 1)
+
+    matrix = daily_sales_matrix(session, names, start, end, store_id)
+    forecast = forecast_next_day(matrix, start, target)
+    rates = loss_rates(session, names, start, store_id)
+    stock = current_stock_grams(session, names, end, store_id)
+    suggested = np.maximum(np.rint(forecast * (1 + rates)) - np.maximum(stock, 0), 0)
+
+    session.query(ReorderSuggestion).filter(
+        ReorderSuggestion.store_id == store_id,
+        ReorderSuggestion.target_date == target
+    ).delete()
+    computed_at = datetime.now()
+    suggestions = []
+    for i, name in enumerate(names):
+        suggestion = ReorderSuggestion(
+            store_id=store_id,
+            target_date=target,
+            name=name,
+            forecast_g=int(round(forecast[i])),
+            loss_rate=float(rates[i]),
+            stock_g=int(stock[i]),
+            # 取整到 0.5 斤
+            suggested_g=int(np.ceil(suggested[i] / (GRAMS_PER_JIN / 2)) * (GRAMS_PER_JIN / 2)),
+            computed_at=computed_at
+        )
+        session.add(suggestion)
+        suggestions.append(suggestion)
+    return suggestions
+
+
+def get_suggestions(session, target, history_days=56, compute_missing=True, store_id=DEFAULT_STORE_ID):
+    """读取缓存的进货建议，返回 {商品名: ReorderSuggestion}
+
+    定时任务 forecast 没有算过时当场计算一次并缓存，只作为后备。
+    """
+    query = session.query(ReorderSuggestion).filter(
+        ReorderSuggestion.store_id == store_id,
+        ReorderSuggestion.target_date == target
+    )
+    rows = query.all()
+    if not rows and compute_missing:
+        try:
+            rows = compute_suggestions(session, target, history_days, store_id=store_id)
+            session.commit()
+        except (IntegrityError, OperationalError):
+            # 同时打开的另一个页面已经算好并写入（Postgres 上是唯一约束冲突，SQLite 上
+            # 读事务在别的写入提交后不能再升级为写事务），读取它的结果
+            session.rollback()
+            rows = query.all()
+            if not rows:
+                raise
+    return {row.name: row for row in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='计算进货建议')
+    parser.add_argument('--date', help='目标日期 YYYY-MM-DD，默认明天')
+    parser.add_argument('--store', type=int, help='门店ID，默认所有门店')
+    args = parser.parse_args()
+    target = date.fromisoformat(args.date) if args.date else None
+
+    from app import app, db
+
+    with app.app_context():
+        if args.store:
+            store_ids = [args.store]
+        else:
+            store_ids = [store_id for (store_id,) in db.session.query(Store.id).order_by(Store.id)]
+        for store_id in store_ids:
+            suggestions = compute_suggestions(
+                db.session, target, app.config['FORECAST_HISTORY_DAYS'], store_id=store_id
+            )
+            db.session.commit()
+            for suggestion in suggestions:
+                print(f"门店{store_id} {suggestion.target_date} {suggestion.name}: "
+                      f"建议进货 {suggestion.suggested_g / GRAMS_PER_JIN} 斤")
+
+
+if __name__ == '__main__':
+    main()
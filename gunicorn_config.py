@@ -1,11 +1,15 @@
+import gc
 import multiprocessing
 import os
 
 # 工作进程数
-workers = multiprocessing.cpu_count() * 2 + 1
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
 
-# 工作模式
-worker_class = 'sync'
+# 工作模式：/events 实时更新是长连接，使用线程模式避免占满整个 worker
+worker_class = 'gthread'
+
+# 每个 worker 的线程数
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
 
 # 绑定地址
 bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
@@ -13,7 +17,8 @@ bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
 # 超时设置
 timeout = 120
 
-# 访问日志
+# 访问日志：worker 启动后改为经过应用的日志队列输出 (logging_setup.py)，
+# 可以用 LOG_SAMPLE=gunicorn.access=0.1 之类的设置采样
 accesslog = '-'
 
 # 错误日志
@@ -25,6 +30,13 @@ loglevel = 'info'
 # 预加载应用
 preload_app = True
 
+# 省内存模式：主进程加载应用期间关闭 GC，每次 fork 之前冻结所有对象后重新打开 GC
+# （主进程长期运行，之后产生的循环引用仍要回收），worker 继承打开的状态。
+# 冻结的对象不会被 GC 遍历和改写，fork 后与主进程共享的内存页不会因此被复制
+gc_freeze = os.getenv('GUNICORN_GC_FREEZE', '1') == '1'
+if gc_freeze:
+    gc.disable()
+
 # 守护进程
 daemon = False
 
@@ -37,11 +49,48 @@ proc_name = "vegetable_inventory"
 # 进程pid记录文件
 pidfile = "gunicorn.pid"
 
-# 重载
-reload = True
+# 代码修改后自动重载，只在开发时打开
+reload = os.getenv('GUNICORN_RELOAD', '0') == '1'
 
 # 最大请求数
 max_requests = 2000
 
 # 最大请求抖动
-max_requests_jitter = 400 
\ No newline at end of file
+max_requests_jitter = 400 
+
+# 后台任务 worker 进程（jobs.py），随 gunicorn 主进程启动和退出；
+# 单独部署 worker 时设置 JOB_WORKER_EMBEDDED=0
+job_worker = None
+
+
+def when_ready(server):
+    global job_worker
+    # preload_app 时应用已在主进程加载：先编译模板和查询，fork 出的 worker 直接继承
+    import warmup
+    from app import app
+    warmup.prepare(app)
+    if os.getenv('JOB_WORKER_EMBEDDED', '1') == '1':
+        import jobs
+        job_worker = jobs.start_worker_process()
+        server.log.info("Started job worker (pid %s)", job_worker.pid)
+
+
+def on_exit(server):
+    if job_worker is not None and job_worker.poll() is None:
+        job_worker.terminate()
+        job_worker.wait(timeout=10)
+
+
+def pre_fork(server, worker):
+    if gc_freeze:
+        gc.freeze()
+        gc.enable()
+
+
+def post_fork(server, worker):
+    import logging_setup
+    logging_setup.route_logger('gunicorn.access')
+    # 建立连接、读取价格和当天汇总之后 worker 才开始接收请求
+    import warmup
+    from app import app
+    warmup.after_fork(app)
@@ -0,0 +1,77 @@
+"""重复提交保护
+
+客户端为每次提交生成一个幂等键（表单隐藏字段 idempotency_key 或请求头
+Idempotency-Key）。写入数据时把键和返回结果放进同一个事务提交；同一个键
+再次提交时直接返回第一次的结果，不会重复插入记录。键保存 IDEMPOTENCY_TTL
+小时后清理。
+"""
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app, request, flash, redirect, jsonify
+
+from models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 64
+
+
+class KeyConflict(Exception):
+    """幂等键已被其他用户或其他接口使用"""
+
+
+def request_key():
+    """返回本次请求携带的幂等键，没有时返回 None，格式不对时抛出 ValueError"""
+    key = request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+    if not key:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError('invalid idempotency key')
+    return key
+
+
+def _cutoff():
+    return datetime.now() - timedelta(hours=current_app.config['IDEMPOTENCY_TTL'])
+
+
+def lookup(session, key, user_id, endpoint):
+    """返回该键未过期的已保存结果"""
+    record = session.query(IdempotencyKey).filter(
+        IdempotencyKey.key == key,
+        IdempotencyKey.created_at >= _cutoff()
+    ).first()
+    if record is not None and (record.user_id != user_id or record.endpoint != endpoint):
+        raise KeyConflict(key)
+    return record
+
+
+def record(session, key, user_id, endpoint, status_code, body):
+    """保存结果，与本次写入在同一个事务中提交；调用方负责 commit"""
+    # 先清理过期的键，过期键可以被重新使用
+    session.query(IdempotencyKey).filter(
+        IdempotencyKey.created_at < _cutoff()
+    ).delete(synchronize_session=False)
+    session.add(IdempotencyKey(
+        key=key,
+        user_id=user_id,
+        endpoint=endpoint,
+        status_code=status_code,
+        body=json.dumps(body, ensure_ascii=False),
+        created_at=datetime.now()
+    ))
+
+
+def replay_redirect(saved):
+    """表单提交的重放：重新提示第一次的结果并跳转到同一页面"""
+    body = json.loads(saved.body)
+    flash(body['message'], body['category'])
+    return redirect(body['location'])
+
+
+def replay_json(saved):
+    response = jsonify(json.loads(saved.body))
+    response.status_code = saved.status_code
+    response.headers['Idempotent-Replay'] = 'true'
+    return response
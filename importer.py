@@ -0,0 +1,340 @@
+"""Excel/CSV 批量导入进货和销售记录
+
+文件按块读取（CSV 用 pandas chunksize，xlsx 用 openpyxl 只读模式逐行读取），
+不会把整个文件放进内存。每块先用 pandas 整列校验，再按日期批量匹配销售
+价格，最后在一个保存点 (SAVEPOINT) 内用 executemany 插入，某一块插入失败
+只回滚这一块。每块单独提交，不会在整个导入期间占着 SQLite 的写锁，其他请求
+可以在块之间写入。所有不合格的行都带行号返回。插入的记录同时登记到 change_record。
+
+表头与导出的 Excel 一致，支持以下列名：
+    商品名称    必填
+    类型        进货/销售，文件中没有此列时使用页面上选择的类型
+    数量        必填，单位：斤
+    价格        进货必填；销售可不填，按日期取当时的销售价格
+    日期        必填，不能是未来日期
+    备注        可选
+"""
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import insert
+
+import changes
+import closing
+import stock
+from models import DEFAULT_STORE_ID, VEGETABLES, Product, ProductPrice, new_sync_id
+from numeric import to_fen, to_grams, fen_to_yuan, grams_to_jin
+
+CHUNK_SIZE = 5000
+
+# 支持的文件扩展名 -> 读取函数名
+EXTENSIONS = {'csv': 'csv', 'xlsx': 'xlsx', 'xlsm': 'xlsx'}
+
+# 标准列名 -> 可接受的表头
+COLUMNS = {
+    'name': ['商品名称', '商品', 'name'],
+    'type': ['类型', 'type'],
+    'quantity': ['数量', 'quantity'],
+    'price': ['价格', '进货价格', '销售价格', '单价', 'price'],
+    'date': ['日期', '进货日期', '销售日期', 'date'],
+    'notes': ['备注', 'notes'],
+}
+REQUIRED = ['name', 'quantity', 'date']
+
+TYPES = {'进货': 'purchase', '销售': 'sale', 'purchase': 'purchase', 'sale': 'sale'}
+
+
+class ImportFormatError(ValueError):
+    """文件格式错误（缺少必填列、无法识别的文件类型等），整份文件不导入"""
+
+
+def _header_map(header):
+    mapping = {}
+    for column, aliases in COLUMNS.items():
+        for index, title in enumerate(header):
+            if str(title).strip() in aliases:
+                mapping[column] = index
+                break
+    missing = [COLUMNS[column][0] for column in REQUIRED if column not in mapping]
+    if missing:
+        raise ImportFormatError(f"缺少必填列: {', '.join(missing)}")
+    return mapping
+
+
+def _normalize(frame, mapping, rows):
+    """只保留映射到的列，加上每行在文件中的行号 (row)，去掉整行为空的行"""
+    text = frame.astype(object).where(frame.notna(), '').astype(str)
+    blank = (text.apply(lambda column: column.str.strip()) == '').all(axis=1).to_numpy()
+    normalized = pd.DataFrame({
+        column: frame.iloc[:, index] for column, index in mapping.items()
+    })
+    normalized['row'] = rows
+    return normalized[~blank]
+
+
+def _detect_encoding(stream):
+    head = stream.read(65536)
+    stream.seek(0)
+    try:
+        head.decode('utf-8')
+        return 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        # 截断在多字节字符中间时仍按 UTF-8 处理
+        return 'utf-8-sig' if e.start >= len(head) - 3 else 'gb18030'
+
+
+def read_csv_chunks(stream, chunk_size=CHUNK_SIZE):
+    encoding = _detect_encoding(stream)
+    # 空行也读进来再去掉，行号才与文件一致；索引从 0 开始，第 1 行是表头
+    reader = pd.read_csv(stream, dtype=str, chunksize=chunk_size, encoding=encoding,
+                         keep_default_na=False, skip_blank_lines=False)
+    mapping = None
+    for chunk in reader:
+        if mapping is None:
+            mapping = _header_map(list(chunk.columns))
+        yield _normalize(chunk, mapping, chunk.index.to_numpy() + 2)
+
+
+def read_xlsx_chunks(stream, chunk_size=CHUNK_SIZE):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        mapping = _header_map(['' if title is None else title for title in header])
+        buffer, numbers = [], []
+        # 只读模式下中间的空行也会返回（值全为 None），按顺序编号即为表格中的行号
+        for number, row in enumerate(rows, start=2):
+            if all(value is None or value == '' for value in row):
+                continue
+            buffer.append(row)
+            numbers.append(number)
+            if len(buffer) >= chunk_size:
+                yield _normalize(pd.DataFrame(buffer, dtype=object), mapping, numbers)
+                buffer, numbers = [], []
+        if buffer:
+            yield _normalize(pd.DataFrame(buffer, dtype=object), mapping, numbers)
+    finally:
+        workbook.close()
+
+
+def read_chunks(stream, filename, chunk_size=CHUNK_SIZE):
+    if not supported(filename):
+        raise ImportFormatError('只支持 .xlsx 和 .csv 文件')
+    if EXTENSIONS[_extension(filename)] == 'csv':
+        return read_csv_chunks(stream, chunk_size)
+    return read_xlsx_chunks(stream, chunk_size)
+
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+def supported(filename):
+    return _extension(filename) in EXTENSIONS
+
+
+def _to_text(series):
+    return series.astype(object).where(series.notna(), '').astype(str).str.strip()
+
+
+def validate_chunk(frame, default_type=None, now=None):
+    """整列校验，返回 (合格的行, 错误列表)；行号取自读取时记录的 row 列，与表格中的行号一致"""
+    now = now or datetime.now()
+    frame = frame.reset_index(drop=True)
+    rows = frame['row'].astype('int64')
+    messages = pd.Series([''] * len(frame), dtype=object)
+
+    def fail(mask, message):
+        mask = mask & (messages == '')
+        messages[mask] = message
+
+    names = _to_text(frame['name'])
+    fail(~names.isin(VEGETABLES), '商品名称不在商品列表中')
+
+    if 'type' in frame:
+        types = _to_text(frame['type']).map(TYPES)
+        if default_type:
+            types = types.where(_to_text(frame['type']) != '', default_type)
+    else:
+        types = pd.Series([default_type] * len(frame), dtype=object)
+    fail(types.isna(), '类型应为 进货 或 销售')
+
+    quantity_text = _to_text(frame['quantity'])
+    quantities = pd.to_numeric(quantity_text, errors='coerce')
+    fail(quantities.isna(), '数量格式不正确')
+    fail(quantities <= 0, '数量必须大于0')
+
+    price_text = _to_text(frame['price']) if 'price' in frame else pd.Series([''] * len(frame), dtype=object)
+    prices = pd.to_numeric(price_text, errors='coerce')
+    fail((price_text != '') & prices.isna(), '价格格式不正确')
+    fail((price_text != '') & (prices <= 0), '价格必须大于0')
+    fail((types == 'purchase') & (price_text == ''), '进货记录必须填写价格')
+
+    dates = pd.to_datetime(frame['date'], errors='coerce').astype('datetime64[ns]')
+    fail(dates.isna(), '日期格式不正确')
+    fail(dates > pd.Timestamp(now), '不能导入未来日期的记录')
+
+    ok = messages == ''
+    valid = pd.DataFrame({
+        'row': rows[ok],
+        'name': names[ok],
+        'type': types[ok],
+        'quantity': quantity_text[ok],
+        'price': price_text[ok],
+        'date': dates[ok],
+        'notes': _to_text(frame['notes'])[ok] if 'notes' in frame else '',
+    })
+    errors = [{'row': int(row), 'error': message} for row, message in zip(rows[~ok], messages[~ok])]
+    return valid, errors
+
+
+def load_price_table(session, store_id=DEFAULT_STORE_ID):
+    """门店的所有销售价格，按商品和开始日期排序，供 merge_asof 使用"""
+    prices = session.query(
+        ProductPrice.name, ProductPrice.start_date, ProductPrice.end_date, ProductPrice.sale_price_fen
+    ).filter(ProductPrice.store_id == store_id).all()
+    table = pd.DataFrame(prices, columns=['name', 'start_date', 'end_date', 'sale_price_fen'])
+    table['start_date'] = pd.to_datetime(table['start_date']).astype('datetime64[ns]')
+    table['end_date'] = pd.to_datetime(table['end_date']).astype('datetime64[ns]')
+    return table.sort_values('start_date')
+
+
+def resolve_sale_prices(valid, price_table):
+    """没有填价格的销售记录按日期批量匹配当时有效的销售价格，返回 (valid, errors)"""
+    missing = (valid['type'] == 'sale') & (valid['price'] == '')
+    if not missing.any():
+        return valid, []
+
+    sales = valid[missing].sort_values('date')
+    matched = pd.merge_asof(
+        sales[['row', 'name', 'date']], price_table,
+        left_on='date', right_on='start_date', by='name', direction='backward'
+    ).set_index('row')
+    effective = matched['sale_price_fen'].notna() & (
+        matched['end_date'].isna() | (matched['end_date'] > matched['date'])
+    )
+
+    rows_without_price = set(matched.index[~effective])
+    price_by_row = matched.loc[effective, 'sale_price_fen'].astype('int64')
+    valid = valid.copy()
+    fill = valid['row'].isin(price_by_row.index)
+    valid.loc[fill, 'price'] = [str(fen_to_yuan(fen)) for fen in price_by_row.loc[valid.loc[fill, 'row']]]
+    errors = [{'row': int(row), 'error': '该日期没有有效的销售价格'} for row in sorted(rows_without_price)]
+    return valid[~valid['row'].isin(rows_without_price)], errors
+
+
+def _convert_unique(series, convert):
+    """同一份文件里的价格和数量重复很多，只对不同的取值做 Decimal 换算"""
+    unique = series.unique()
+    return series.map(dict(zip(unique, map(convert, unique)))).tolist()
+
+
+def build_rows(valid, now=None, store_id=DEFAULT_STORE_ID):
+    now = now or datetime.now()
+    price_fen = _convert_unique(valid['price'], to_fen)
+    quantity_g = _convert_unique(valid['quantity'], to_grams)
+    prices = _convert_unique(valid['price'], lambda price: float(fen_to_yuan(to_fen(price))))
+    quantities = _convert_unique(valid['quantity'], lambda quantity: float(grams_to_jin(to_grams(quantity))))
+    return [
+        {
+            'sync_id': new_sync_id(),
+            'store_id': store_id,
+            'name': name,
+            'type': type,
+            'price': price,
+            'quantity': quantity,
+            'actual_quantity': 0,
+            'loss_quantity': 0,
+            'price_fen': fen,
+            'quantity_g': grams,
+            'actual_quantity_g': 0,
+            'loss_quantity_g': 0,
+            'date': date,
+            'notes': notes,
+            'created_at': now,
+            'updated_at': now,
+        }
+        for name, type, fen, grams, price, quantity, date, notes in zip(
+            valid['name'], valid['type'], price_fen, quantity_g, prices, quantities,
+            valid['date'].dt.to_pydatetime(), valid['notes']
+        )
+    ]
+
+
+def import_file(session, stream, filename, default_type=None, chunk_size=CHUNK_SIZE, store_id=DEFAULT_STORE_ID,
+                progress=None):
+    """导入整个文件，返回 {'imported': 条数, 'errors': [{'row', 'error'}], 'names': 涉及的商品}
+
+    stream 需要支持 seek（上传文件的 FileStorage.stream 即可）。
+    progress(percent, message) 在每个分块处理完后调用，百分比未知时为 None。
+    每块写入后提交，最后重算库存并提交；中途出错时已提交的块保留，同样重算库存。
+    文件格式错误时抛出 ImportFormatError。
+    """
+    price_table = load_price_table(session, store_id)
+    errors = []
+    names = set()
+    try:
+        imported = _import_chunks(session, stream, filename, default_type, chunk_size, store_id,
+                                  progress, price_table, errors, names)
+    except BaseException:
+        session.rollback()
+        if names:
+            stock.rebuild(session, names, store_id)
+            session.commit()
+        raise
+
+    errors.sort(key=lambda error: error['row'])
+    if names:
+        # 批量插入绕过了逐条的库存更新，导入后按记录重算
+        stock.rebuild(session, names, store_id)
+        session.commit()
+    return {'imported': imported, 'errors': errors, 'names': sorted(names)}
+
+
+def _import_chunks(session, stream, filename, default_type, chunk_size, store_id, progress, price_table, errors, names):
+    """逐块校验、写入并提交，不合格的行加入 errors，写入的商品加入 names，返回成功条数"""
+    imported = 0
+    processed = 0
+    now = datetime.now()
+    for chunk in read_chunks(stream, filename, chunk_size):
+        valid, chunk_errors = validate_chunk(chunk, default_type, now)
+        valid, price_errors = resolve_sale_prices(valid, price_table)
+        errors.extend(chunk_errors)
+        errors.extend(price_errors)
+        # 每块在自己的事务中取门店共享锁，与结账互斥
+        closed_until = closing.writable_after(session, store_id)
+        if closed_until is not None and not valid.empty:
+            # 已结账的日期不能再写入
+            frozen = valid['date'] < pd.Timestamp(closed_until) + pd.Timedelta(days=1)
+            errors.extend({'row': int(row), 'error': '该日期已结账'} for row in valid.loc[frozen, 'row'])
+            valid = valid[~frozen]
+        processed += len(chunk)
+
+        if valid.empty:
+            session.commit()
+            continue
+        rows = build_rows(valid, now, store_id)
+        try:
+            with session.begin_nested():
+                ids = session.execute(
+                    insert(Product.__table__).returning(Product.__table__.c.id, sort_by_parameter_order=True),
+                    rows
+                ).scalars().all()
+                # 批量插入绕过了 ORM 的 flush 事件，显式登记变更
+                changes.record(session, 'product', 'insert', [
+                    (store_id, id, None, {'id': id, **row}) for id, row in zip(ids, rows)
+                ])
+        except Exception as e:
+            errors.extend({'row': int(row), 'error': f'写入失败: {e.__class__.__name__}'} for row in valid['row'])
+            session.commit()
+            continue
+        session.commit()
+        imported += len(rows)
+        names.update(valid['name'].unique())
+        if progress:
+            progress(None, f'已处理 {processed} 行，成功 {imported} 条')
+    return imported
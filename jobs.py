@@ -0,0 +1,474 @@
+"""后台任务
+
+导出 Excel、批量导入、分析快照、损耗重算、备份等耗时操作不再在请求里执行：
+网页端只在 job 表中插入一条排队的任务，由单独的 worker 进程用进程池执行，
+页面通过 /api/jobs/<id> 查看进度，完成后从 /jobs/<id>/download 下载结果。
+
+worker 同时最多执行 JOB_WORKERS 个任务，不会占用 gunicorn 处理柜台操作的
+worker。定时任务也由 worker 自动排队：SCHEDULE 中的任务按间隔（如更新损耗统计），
+DAILY 中的任务每天到点一次（如打烊后计算第二天的进货建议）。gunicorn 启动时会自动拉起一个 worker 进程（JOB_WORKER_EMBEDDED=0
+可关闭），也可以单独运行：
+
+    python jobs.py worker                 执行任务
+    python jobs.py worker --processes 4
+    python jobs.py purge                  删除超过 JOB_RETENTION_DAYS 天的任务及其文件
+
+任务文件保存在 JOB_DIR/<任务id>/ 下，网页端和 worker 需要能访问同一个目录。
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, date, time as day_time, timedelta
+
+from sqlalchemy import select, update as sql_update, func
+from sqlalchemy.exc import OperationalError
+
+from models import DEFAULT_STORE_ID, Job
+
+logger = logging.getLogger(__name__)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 批量导入支持的文件类型，与 importer.EXTENSIONS 一致；网页端据此提前拒绝上传，
+# 不必为此加载 importer 和 pandas（只在任务进程中使用）
+IMPORT_EXTENSIONS = ('.csv', '.xlsx', '.xlsm')
+
+KIND_NAMES = {
+    'export': '导出Excel',
+    'import': '批量导入',
+    'analytics': '导出分析快照',
+    'loss_update': '更新损耗统计',
+    'loss_rebuild': '重新计算损耗',
+    'backup': '备份数据库',
+    'forecast': '计算进货建议',
+}
+
+
+# 定时任务种类 -> 间隔秒数的配置项；间隔为 0 时不自动排队
+SCHEDULE = {
+    'loss_update': 'LOSS_UPDATE_INTERVAL',
+}
+
+# 每天定时的任务种类 -> 几点的配置项；小于 0 时不自动排队
+DAILY = {
+    'forecast': 'FORECAST_HOUR',
+}
+
+# worker 检查定时任务是否到期的间隔（秒）
+SCHEDULE_CHECK_SECONDS = 30
+
+
+class TooManyJobs(Exception):
+    """用户排队中的任务过多"""
+
+
+def job_dir(base_dir, job_id):
+    path = os.path.join(base_dir, str(job_id))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def enqueue(session, kind, params=None, user_id=None, store_id=DEFAULT_STORE_ID, max_pending=None):
+    """插入一条排队任务并 flush 得到 id；调用方负责 commit"""
+    if kind not in KIND_NAMES:
+        raise ValueError(f'unknown job kind: {kind}')
+    if max_pending is not None and user_id is not None:
+        pending = session.execute(
+            select(func.count()).select_from(Job).where(
+                Job.user_id == user_id,
+                Job.status.in_(['queued', 'running'])
+            )
+        ).scalar()
+        if pending >= max_pending:
+            raise TooManyJobs()
+    job = Job(kind=kind, params=json.dumps(params or {}, ensure_ascii=False), status='queued', progress=0,
+              user_id=user_id, store_id=store_id)
+    session.add(job)
+    session.flush()
+    return job
+
+
+def to_json(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'kind_name': KIND_NAMES.get(job.kind, job.kind),
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'downloadable': job.status == 'done' and bool(job.result_path),
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def claim(session, worker):
+    """领取最早排队的任务，返回任务 id；没有任务时返回 None
+
+    用带条件的 UPDATE 领取，多个 worker 同时领取同一个任务时只有一个成功。
+    """
+    while True:
+        job_id = session.execute(
+            select(Job.id).where(Job.status == 'queued').order_by(Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            session.rollback()
+            return None
+        now = datetime.now()
+        result = session.execute(
+            sql_update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', worker=worker, started_at=now, heartbeat_at=now, progress=0)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        if result.rowcount == 1:
+            return job_id
+
+
+def _update(engine, job_id, **values):
+    with engine.begin() as conn:
+        conn.execute(sql_update(Job).where(Job.id == job_id).values(**values))
+
+
+def set_progress(engine, job_id, percent=None, message=None):
+    """单独提交进度，任务本身的事务还没结束时页面也能看到"""
+    values = {'heartbeat_at': datetime.now()}
+    if percent is not None:
+        values['progress'] = max(0, min(int(percent), 100))
+    if message is not None:
+        values['message'] = message[:500]
+    try:
+        _update(engine, job_id, **values)
+    except OperationalError:
+        # SQLite 上任务自己的写事务未提交时进度写不进去，跳过即可
+        logger.debug("Skip progress update for job %s", job_id)
+
+
+def finish(engine, job_id, status, message=None, result=None, result_path=None, result_name=None):
+    _update(
+        engine, job_id,
+        status=status,
+        progress=100 if status == 'done' else Job.progress,
+        message=message[:500] if message else message,
+        result=json.dumps(result, ensure_ascii=False) if result is not None else None,
+        result_path=result_path,
+        result_name=result_name,
+        finished_at=datetime.now()
+    )
+
+
+# 任务处理函数：handler(app, session, job, params, progress) -> 结果 dict
+# 结果中可以有 message、result（摘要）、path 和 name（生成的文件）
+
+def _previous_export(session, job, end):
+    """结束日期已结账时，结账之后生成的同一范围的导出文件仍然有效"""
+    import closing
+
+    close = closing.covering_close(session, end, job.store_id)
+    if close is None:
+        return None
+    for previous in session.scalars(
+        select(Job).where(
+            Job.kind == 'export', Job.status == 'done', Job.store_id == job.store_id,
+            Job.params == job.params, Job.created_at >= close.closed_at, Job.id != job.id
+        ).order_by(Job.id.desc())
+    ):
+        if previous.result_path and os.path.exists(previous.result_path):
+            return previous
+    return None
+
+
+def run_export(app, session, job, params, progress):
+    import exporter
+
+    start = datetime.fromisoformat(params['start'])
+    end = datetime.fromisoformat(params['end'])
+    name = exporter.filename(start, end)
+    path = os.path.join(job_dir(app.config['JOB_DIR'], job.id), name)
+    previous = _previous_export(session, job, end)
+    if previous is not None:
+        shutil.copyfile(previous.result_path, path)
+        count = json.loads(previous.result)['records']
+    else:
+        count = exporter.write_export(session, path, start, end, job.store_id, progress)
+    return {'message': f'导出 {count} 条记录', 'result': {'records': count}, 'path': path, 'name': name}
+
+
+def run_import(app, session, job, params, progress):
+    import importer
+
+    with open(params['path'], 'rb') as stream:
+        result = importer.import_file(session, stream, params['filename'], params.get('type'),
+                                      store_id=job.store_id, progress=progress)
+    message = f"成功 {result['imported']} 条，失败 {len(result['errors'])} 条"
+    outcome = {'message': message, 'result': {'imported': result['imported'], 'failed': len(result['errors']),
+                                              'errors': result['errors'][:500]}}
+    if result['errors']:
+        name = f"导入错误_{job.id}.csv"
+        path = os.path.join(job_dir(app.config['JOB_DIR'], job.id), name)
+        with open(path, 'w', encoding='utf-8-sig') as f:
+            f.write('行号,错误\n')
+            f.writelines(f"{error['row']},{error['error']}\n" for error in result['errors'])
+        outcome.update(path=path, name=name)
+    return outcome
+
+
+def run_analytics(app, session, job, params, progress):
+    import analytics
+
+    written = analytics.export_snapshot(session.get_bind(), app.config['ANALYTICS_DIR'], full=params.get('full', False))
+    months = sum(len(months) for months in written.values())
+    return {'message': f'重写了 {months} 个月份分区', 'result': written}
+
+
+def run_loss_update(app, session, job, params, progress):
+    import losses
+
+    count = losses.update(session, lag=app.config['CHANGE_READ_LAG'])
+    return {'message': f'处理了 {count} 条新盘点记录', 'result': {'checks': count}}
+
+
+def run_loss_rebuild(app, session, job, params, progress):
+    import losses
+
+    count = losses.rebuild(session, lag=app.config['CHANGE_READ_LAG'])
+    return {'message': f'处理了 {count} 条盘点记录', 'result': {'checks': count}}
+
+
+def run_backup(app, session, job, params, progress):
+    import backup
+
+    config = app.config
+    manifest = backup.create_backup(
+        session.get_bind(), config['BACKUP_DIR'], params.get('incremental', False), config['BACKUP_PAGES'],
+        config['BACKUP_PAUSE'], config['BACKUP_MAX_RESTARTS'], config['BACKUP_OVERLAP'],
+        # SQLite 复制期间写任务进度会使复制重来
+        progress=progress if session.get_bind().dialect.name != 'sqlite' else None,
+    )
+    return {'message': f"备份 {manifest['name']}", 'result': {'name': manifest['name'], 'kind': manifest['kind']}}
+
+
+def run_forecast(app, session, job, params, progress):
+    import forecast
+    from models import Store
+
+    if params.get('scheduled_at'):
+        # 定时任务计算排队那天的下一天；worker 停过时补算的也是这一天
+        target = datetime.fromisoformat(params['scheduled_at']).date() + timedelta(days=1)
+    else:
+        target = date.fromisoformat(params['date']) if params.get('date') else date.today() + timedelta(days=1)
+    store_ids = session.scalars(select(Store.id).order_by(Store.id)).all()
+    for i, store_id in enumerate(store_ids):
+        forecast.compute_suggestions(session, target, app.config['FORECAST_HISTORY_DAYS'], store_id=store_id)
+        session.commit()
+        progress((i + 1) * 100 / len(store_ids), f'已计算 {i + 1}/{len(store_ids)} 个门店')
+    return {'message': f'{target} 的进货建议（{len(store_ids)} 个门店）',
+            'result': {'date': target.isoformat(), 'stores': len(store_ids)}}
+
+
+HANDLERS = {
+    'export': run_export,
+    'import': run_import,
+    'analytics': run_analytics,
+    'loss_update': run_loss_update,
+    'loss_rebuild': run_loss_rebuild,
+    'backup': run_backup,
+    'forecast': run_forecast,
+}
+
+
+def execute(job_id):
+    """在进程池的子进程中执行一个已领取的任务"""
+    from app import app, db
+
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        engine = db.engine
+
+        def progress(percent=None, message=None):
+            set_progress(engine, job_id, percent, message)
+
+        try:
+            params = json.loads(job.params or '{}')
+            outcome = HANDLERS[job.kind](app, db.session, job, params, progress) or {}
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Job %s (%s) failed", job_id, job.kind)
+            finish(engine, job_id, 'failed', message=f'{e.__class__.__name__}: {e}')
+            return 'failed'
+        finally:
+            db.session.remove()
+        finish(engine, job_id, 'done', outcome.get('message'), outcome.get('result'),
+               outcome.get('path'), outcome.get('name'))
+        return 'done'
+
+
+def fail_stale(session, stale_seconds):
+    """心跳超时的任务（worker 进程被杀等）标记为失败，返回条数"""
+    result = session.execute(
+        sql_update(Job)
+        .where(Job.status == 'running', Job.heartbeat_at < datetime.now() - timedelta(seconds=stale_seconds))
+        .values(status='failed', message='任务中断，请重新提交', finished_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount
+
+
+def schedule(session, intervals=None, daily=None, now=None):
+    """到期的定时任务插入一条排队任务，返回插入的任务种类
+
+    intervals 为 {种类: 间隔秒数}，daily 为 {种类: 每天几点}。按 job 表中该种类最近一次
+    任务的创建时间判断是否到期，已有排队或执行中的同类任务时不再插入，多个 worker 或
+    重启后不会重复排队。每天定时的任务参数中带有 scheduled_at（当天的定时时间），
+    worker 错过了定时时间时，之后第一次检查会补排一次。
+    """
+    now = now or datetime.now()
+    due = {}
+    for kind, interval in (intervals or {}).items():
+        if interval:
+            due[kind] = (now - timedelta(seconds=interval), {})
+    for kind, hour in (daily or {}).items():
+        if hour is not None and hour >= 0:
+            at = datetime.combine(now.date(), day_time(hour))
+            if at > now:
+                at -= timedelta(days=1)
+            due[kind] = (at, {'scheduled_at': at.isoformat()})
+
+    queued = []
+    for kind, (since, params) in due.items():
+        last, pending = session.execute(
+            select(func.max(Job.created_at), func.count().filter(Job.status.in_(['queued', 'running'])))
+            .where(Job.kind == kind)
+        ).one()
+        if pending or (last is not None and last >= since):
+            continue
+        enqueue(session, kind, params)
+        queued.append(kind)
+    session.commit()
+    return queued
+
+
+def purge(session, base_dir, keep_days):
+    """删除 keep_days 天前结束的任务及其文件，返回删除条数；调用方负责 commit"""
+    jobs = session.query(Job).filter(
+        Job.status.in_(['done', 'failed']),
+        Job.finished_at < datetime.now() - timedelta(days=keep_days)
+    ).all()
+    for job in jobs:
+        shutil.rmtree(os.path.join(base_dir, str(job.id)), ignore_errors=True)
+        session.delete(job)
+    return len(jobs)
+
+
+def run_worker(app, db, processes, poll_interval=1.0):
+    """领取任务交给进程池执行，直到进程被终止"""
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    stale_seconds = app.config['JOB_STALE_SECONDS']
+    # 子进程用 spawn 启动，不继承父进程的数据库连接
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+    running = {}
+    intervals = {kind: app.config[key] for kind, key in SCHEDULE.items()}
+    daily = {kind: app.config[key] for kind, key in DAILY.items()}
+    next_schedule = 0
+    logger.info("Job worker %s started with %s processes", worker, processes)
+
+    with app.app_context():
+        try:
+            while True:
+                for future in [future for future in running if future.done()]:
+                    job_id = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        # 子进程崩溃等 execute 本身没能记录的失败
+                        logger.error("Job %s crashed: %r", job_id, error)
+                        _abandon(db.engine, [job_id], f'任务进程异常退出: {error.__class__.__name__}')
+                        if isinstance(error, BrokenProcessPool):
+                            pool.shutdown(wait=False)
+                            pool = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+
+                if running:
+                    _heartbeat(db.engine, list(running.values()))
+                fail_stale(db.session, stale_seconds)
+                if time.monotonic() >= next_schedule:
+                    for kind in schedule(db.session, intervals, daily):
+                        logger.info("Scheduled %s job", kind)
+                    next_schedule = time.monotonic() + SCHEDULE_CHECK_SECONDS
+
+                while len(running) < processes:
+                    job_id = claim(db.session, worker)
+                    if job_id is None:
+                        break
+                    running[pool.submit(execute, job_id)] = job_id
+                db.session.remove()
+                time.sleep(poll_interval)
+        finally:
+            # 被终止时结束执行中的任务进程，任务标记为失败，不必等心跳超时
+            pool.shutdown(wait=False, cancel_futures=True)
+            for process in multiprocessing.active_children():
+                process.terminate()
+            if running:
+                _abandon(db.engine, list(running.values()), 'worker 已停止，请重新提交')
+
+
+def _heartbeat(engine, job_ids):
+    with engine.begin() as conn:
+        conn.execute(
+            sql_update(Job).where(Job.id.in_(job_ids), Job.status == 'running').values(heartbeat_at=datetime.now())
+        )
+
+
+def _abandon(engine, job_ids, message):
+    """子进程没来得及记录结果的任务标记为失败；已经结束的任务不受影响"""
+    with engine.begin() as conn:
+        conn.execute(
+            sql_update(Job).where(Job.id.in_(job_ids), Job.status == 'running')
+            .values(status='failed', message=message, finished_at=datetime.now())
+        )
+
+
+def start_worker_process(processes=None):
+    """在子进程中启动 worker（gunicorn 的 when_ready 钩子和 run_prod.py 使用）"""
+    command = [sys.executable, os.path.join(current_dir, 'jobs.py'), 'worker']
+    if processes:
+        command += ['--processes', str(processes)]
+    return subprocess.Popen(command, cwd=current_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='后台任务')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    worker = subparsers.add_parser('worker', help='执行排队的任务')
+    worker.add_argument('--processes', type=int, help='同时执行的任务数，默认 JOB_WORKERS')
+    subparsers.add_parser('purge', help='删除过期的任务及其文件')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    if args.command == 'worker':
+        # gunicorn/run_prod.py 退出时用 SIGTERM 停止 worker，转成 SystemExit 以便清理
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        run_worker(app, db, args.processes or app.config['JOB_WORKERS'], app.config['JOB_POLL_INTERVAL'])
+    else:
+        with app.app_context():
+            count = purge(db.session, app.config['JOB_DIR'], app.config['JOB_RETENTION_DAYS'])
+            db.session.commit()
+        print(f'删除了 {count} 个任务')
+
+
+if __name__ == '__main__':
+    main()
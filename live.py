@@ -0,0 +1,195 @@
+"""首页/库存页的实时更新 (Server-Sent Events)
+
+写操作提交时在同一个事务里插入一条 live_event，内容是受影响商品在该日期
+的汇总行。每个 worker 进程有一个后台线程每隔 LIVE_POLL_INTERVAL 秒读取
+新事件，再分发给本进程内所有打开的 /events 连接。这样无论写请求落在
+哪个 gunicorn worker 上，所有页面都能收到更新，而每个进程每秒只多一次
+按主键的小查询。
+
+浏览器断线重连时带上 Last-Event-ID，从数据库补发错过的事件。每个连接
+最长保持 LIVE_STREAM_SECONDS 秒，之后由 EventSource 自动重连，避免长
+连接一直占用 worker 线程。
+
+每个进程同时保持的连接数不超过 LIVE_MAX_STREAMS（默认为每个进程线程数的一半），
+超出时只返回 retry 让浏览器过一段时间再连，留出线程处理普通请求。
+
+事件带有门店ID，每个连接只收到自己门店的事件。
+"""
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+import reports
+from models import DEFAULT_STORE_ID, LiveEvent
+
+logger = logging.getLogger(__name__)
+
+# 单个连接最多积压的事件数，超过说明客户端太慢，断开后让它重连补发
+QUEUE_SIZE = 100
+# 连接数已满时让浏览器等待的毫秒数范围，随机错开重连时间
+BUSY_RETRY_MS = (10000, 30000)
+
+
+def publish(session, day, names, retention=3600, store_id=DEFAULT_STORE_ID):
+    """记录 names 在 day 当天的最新汇总，与本次写入一起提交；调用方负责 commit"""
+    names = sorted(set(names))
+    if not names:
+        return
+    session.flush()
+    rows = reports.to_display(reports.daily_summary(session, day, names, store_id))
+    payload = {
+        'date': day.isoformat(),
+        'products': {
+            name: {field: str(value) for field, value in row.items()}
+            for name, row in rows.items()
+        }
+    }
+    now = datetime.now()
+    session.query(LiveEvent).filter(
+        LiveEvent.created_at < now - timedelta(seconds=retention)
+    ).delete(synchronize_session=False)
+    session.add(LiveEvent(store_id=store_id, created_at=now, payload=json.dumps(payload, ensure_ascii=False)))
+
+
+def events_after(engine, last_id, limit=200):
+    with engine.connect() as conn:
+        return conn.execute(
+            select(LiveEvent.id, LiveEvent.store_id, LiveEvent.payload)
+            .where(LiveEvent.id > last_id)
+            .order_by(LiveEvent.id)
+            .limit(limit)
+        ).all()
+
+
+class LiveBroker:
+    """进程内的事件分发：一个轮询线程，多个订阅队列"""
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+        self.engine = None
+        self.last_id = None
+        self.streams = 0
+
+    def acquire(self, limit):
+        """占用一个连接名额，已满时返回 False"""
+        with self.lock:
+            if limit and self.streams >= limit:
+                return False
+            self.streams += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.streams -= 1
+
+    def _start(self, engine):
+        # gunicorn preload_app 时应用在 fork 之前加载，线程要在 worker 里第一次订阅时才启动
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.engine = engine
+        with engine.connect() as conn:
+            self.last_id = conn.execute(select(LiveEvent.id).order_by(LiveEvent.id.desc()).limit(1)).scalar() or 0
+        self.thread = threading.Thread(target=self._run, name='live-broker', daemon=True)
+        self.thread.start()
+
+    def subscribe(self, engine):
+        with self.lock:
+            self._start(engine)
+            subscriber = queue.Queue(QUEUE_SIZE)
+            self.subscribers.add(subscriber)
+            return subscriber, self.last_id
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                if not self.subscribers:
+                    continue
+            try:
+                events = events_after(self.engine, self.last_id)
+            except Exception:
+                logger.exception("Polling live events failed")
+                continue
+            if not events:
+                continue
+            self.last_id = events[-1].id
+            with self.lock:
+                for subscriber in list(self.subscribers):
+                    for event in events:
+                        try:
+                            subscriber.put_nowait((event.id, event.store_id, event.payload))
+                        except queue.Full:
+                            # 通知该连接结束，浏览器重连后按 Last-Event-ID 补发
+                            self.subscribers.discard(subscriber)
+                            break
+
+
+broker = LiveBroker()
+
+
+def _format(event_id, payload):
+    return f'id: {event_id}\nevent: summary\ndata: {payload}\n\n'
+
+
+def stream(engine, last_event_id=None, duration=300, heartbeat=15, store_id=DEFAULT_STORE_ID, max_streams=0):
+    """生成 SSE 响应内容，只包含 store_id 门店的事件；max_streams 为本进程的连接数上限，0 不限制"""
+    # 在生成器内占用名额：响应没有开始输出就被关闭时不会执行 finally
+    if not broker.acquire(max_streams):
+        # EventSource 遇到非 200 的响应不再重连，这里返回 200 并只给出重连间隔
+        yield f'retry: {random.randint(*BUSY_RETRY_MS)}\n\n'
+        return
+    try:
+        yield from _stream(engine, last_event_id, duration, heartbeat, store_id)
+    finally:
+        broker.release()
+
+
+def _stream(engine, last_event_id, duration, heartbeat, store_id):
+    subscriber, broker_position = broker.subscribe(engine)
+    try:
+        yield 'retry: 3000\n\n'
+        last_seen = broker_position
+        if last_event_id is not None:
+            # 补发断线期间错过的事件
+            last_seen = last_event_id
+            while last_seen < broker_position:
+                events = [event for event in events_after(engine, last_seen) if event.id <= broker_position]
+                if not events:
+                    break
+                for event in events:
+                    if event.store_id == store_id:
+                        yield _format(event.id, event.payload)
+                last_seen = events[-1].id
+
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            with broker.lock:
+                dropped = subscriber not in broker.subscribers
+            try:
+                event_id, event_store_id, payload = subscriber.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0.1)))
+            except queue.Empty:
+                if dropped:
+                    return
+                yield ': keep-alive\n\n'
+                continue
+            if event_id <= last_seen:
+                continue
+            last_seen = event_id
+            if event_store_id != store_id:
+                continue
+            yield _format(event_id, payload)
+    finally:
+        broker.unsubscribe(subscriber)
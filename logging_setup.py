@@ -0,0 +1,188 @@
+"""日志配置
+
+请求线程只把日志记录放进内存队列，格式化和写 stdout 由后台线程 (QueueListener)
+完成，stdout 慢（管道阻塞、日志采集跟不上）时不会拖慢请求。队列满时丢弃新的
+记录而不是等待，之后补一条 WARNING 说明丢了多少条。
+
+环境变量（见 config.py）：
+
+    LOG_LEVEL    根 logger 级别，默认 INFO
+    LOG_LEVELS   单独设置的 logger 级别，例如 "sqlalchemy.engine=INFO,live=WARNING"
+    LOG_FORMAT   json（默认，每行一个 JSON 对象）或 text
+    LOG_SAMPLE   高频日志的采样比例，例如 "gunicorn.access=0.1"；只对 INFO 及以下
+                 级别生效，WARNING 及以上总是输出
+    LOG_QUEUE_SIZE  队列长度
+    LOG_FILE     除 stdout 外同时写入的日志文件，默认不写文件（run_prod.py 默认写
+                 logs/production.log）
+
+gunicorn 预加载应用时在主进程中调用 configure()，fork 出的 worker 没有后台线程，
+第一次写日志时按进程号重新启动。
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import traceback
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import has_request_context, request
+
+# LogRecord 自带的属性，其余的属性来自 extra=，原样写入 JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def parse_pairs(value, convert):
+    """解析 "a=1,b=2" 形式的配置"""
+    pairs = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, raw = item.split('=', 1)
+            pairs[name.strip()] = convert(raw.strip())
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in _RECORD_ATTRS and not key.startswith('_'))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """按 logger 名称（含子 logger）对 INFO 及以下的记录抽样"""
+
+    def __init__(self, rates):
+        super().__init__()
+        # 名称长的先匹配，子 logger 的设置优先
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for name, rate in self.rates:
+            if record.name == name or record.name.startswith(name + '.'):
+                return random.random() < rate
+        return True
+
+
+class RequestFilter(logging.Filter):
+    """在请求线程中给记录加上请求方法和路径"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class ProcessQueueHandler(QueueHandler):
+    """每个进程有自己的队列和后台线程；队列满时丢弃记录"""
+
+    def __init__(self, outputs, size):
+        super().__init__(queue.Queue(size))
+        self.outputs = outputs
+        self.size = size
+        self.dropped = 0
+        self.listener = None
+        self.pid = None
+
+    def start(self):
+        self.queue = queue.Queue(self.size)
+        self.listener = QueueListener(self.queue, *self.outputs, respect_handler_level=True)
+        self.listener.start()
+        self.pid = os.getpid()
+
+    def stop(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+
+    def prepare(self, record):
+        # 在请求线程里合并参数并保存异常文本（traceback 引用的栈帧不能留给后台线程），
+        # 其余格式化在后台线程中进行
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+        prepared = logging.makeLogRecord(vars(record))
+        prepared.msg, prepared.args, prepared.exc_info, prepared.exc_text = message, None, None, exc_text
+        return prepared
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f'日志队列已满，丢弃了 {self.dropped} 条记录',
+                }))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+handler = None
+
+
+def configure(config):
+    """配置根 logger；config 为 Config 类或 app.config 这样的映射，可重复调用"""
+    global handler
+    get = config.get if hasattr(config, 'get') else lambda key, default=None: getattr(config, key, default)
+
+    outputs = [logging.StreamHandler(sys.stdout)]
+    if get('LOG_FILE'):
+        os.makedirs(os.path.dirname(os.path.abspath(get('LOG_FILE'))), exist_ok=True)
+        outputs.append(logging.FileHandler(get('LOG_FILE'), encoding='utf-8'))
+    for output in outputs:
+        if get('LOG_FORMAT', 'json') == 'json':
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    if handler is not None:
+        handler.stop()
+    handler = ProcessQueueHandler(outputs, get('LOG_QUEUE_SIZE', 10000))
+    handler.addFilter(SamplingFilter(parse_pairs(get('LOG_SAMPLE'), float)))
+    handler.addFilter(RequestFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(get('LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_pairs(get('LOG_LEVELS'), str.upper).items():
+        logging.getLogger(name).setLevel(level)
+    return handler
+
+
+def route_logger(name):
+    """把另一个组件自己输出的 logger（如 gunicorn.access）改为经过队列输出"""
+    logger = logging.getLogger(name)
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.propagate = True
+
+
+@atexit.register
+def _flush():
+    # 退出前把队列中剩余的记录写完
+    if handler is not None:
+        handler.stop()
@@ -0,0 +1,253 @@
+"""盘点损耗分析
+
+按门店、商品、周累计盘点损耗：
+    损耗率 = 损耗数量 / 上次盘点以来的进货数量
+    损耗金额 = 损耗数量 × 盘点时最近一次进货单价
+
+结果保存在 loss_weekly 表中，loss_progress 记录已处理到的最大盘点记录 id，
+每次只处理新增的盘点记录，计算量与历史长度无关。Postgres 上 id 在提交前分配，
+按 changes.visible_until() 停在最近出现的 id 空缺之前，不会越过还没提交的盘点。
+两次盘点之间的进货与 stock.stock_as_of() 一样按 (日期, id) 划分。
+
+修改、删除过去的盘点记录或补录以前日期的进货，会改变之后的盘点的进货数量和
+成本单价：消费者 losses 读取 Product 变更记录 (changes.consume)，找出每个商品
+受影响的最早日期，从那一周起按当前数据重新计算已统计过的盘点。
+
+统计由后台任务 loss_update 更新，job worker 每隔 LOSS_UPDATE_INTERVAL 秒自动
+排队一次，网页端只读取 loss_weekly。也可以手动运行：
+
+    python losses.py              处理新增的盘点和变更
+    python losses.py --rebuild    清空后全部重新计算
+"""
+import argparse
+from datetime import datetime, timedelta
+
+import logging
+
+from sqlalchemy import select, func, update as sql_update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import changes
+from models import DEFAULT_STORE_ID, Product, LossWeekly, LossProgress
+from numeric import amount_fen, fen_to_yuan, grams_to_jin
+
+logger = logging.getLogger(__name__)
+
+# 变更记录消费者名称
+CONSUMER = 'losses'
+
+# 影响损耗统计的记录类型
+AFFECTING_TYPES = ('inventory_check', 'purchase')
+
+
+def week_start(value):
+    day = value.date() if isinstance(value, datetime) else value
+    return day - timedelta(days=day.weekday())
+
+
+def _progress(session):
+    progress = session.get(LossProgress, 1)
+    if progress is None:
+        progress = LossProgress(id=1, last_check_id=0)
+        session.add(progress)
+    return progress
+
+
+def _before(date, record_id):
+    """按 (日期, id) 排在 (date, record_id) 之前"""
+    return (Product.date < date) | ((Product.date == date) & (Product.id < record_id))
+
+
+def _previous_check(session, check):
+    """同一商品上一次盘点的 (日期, id)，没有时返回 None"""
+    return session.execute(
+        select(Product.date, Product.id).where(
+            Product.store_id == check.store_id,
+            Product.type == 'inventory_check',
+            Product.name == check.name,
+            _before(check.date, check.id)
+        ).order_by(Product.date.desc(), Product.id.desc()).limit(1)
+    ).first()
+
+
+def _purchased_since(session, check, previous):
+    """上一次盘点之后、本次盘点之前录入的进货数量（同一天盘点之前的进货已包含在盘点数量中）"""
+    stmt = select(func.coalesce(func.sum(Product.quantity_g), 0)).where(
+        Product.store_id == check.store_id,
+        Product.type == 'purchase',
+        Product.name == check.name,
+        _before(check.date, check.id)
+    )
+    if previous is not None:
+        date, record_id = previous
+        stmt = stmt.where((Product.date > date) | ((Product.date == date) & (Product.id > record_id)))
+    return int(session.execute(stmt).scalar())
+
+
+def _last_cost_fen(session, store_id, name, until):
+    price_fen = session.execute(
+        select(Product.price_fen).where(
+            Product.store_id == store_id,
+            Product.type == 'purchase',
+            Product.name == name,
+            Product.date <= until
+        ).order_by(Product.date.desc(), Product.id.desc()).limit(1)
+    ).scalar()
+    return price_fen or 0
+
+
+def process_new_checks(session, batch_size=500, lag=changes.READ_LAG):
+    """处理一批尚未统计的盘点记录，返回处理条数；调用方负责 commit"""
+    progress = _progress(session)
+    query = session.query(Product).filter(
+        Product.type == 'inventory_check',
+        Product.id > progress.last_check_id
+    )
+    until = changes.visible_until(session, Product.id, Product.created_at, progress.last_check_id, lag)
+    if until is not None:
+        query = query.filter(Product.id <= until)
+    checks = query.order_by(Product.id).limit(batch_size).all()
+    _accumulate(session, checks)
+
+    if checks:
+        # 只在水位没被其他进程推进时提交，避免同一批盘点被重复累计
+        result = session.execute(
+            sql_update(LossProgress)
+            .where(LossProgress.id == 1, LossProgress.last_check_id == progress.last_check_id)
+            .values(last_check_id=checks[-1].id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            session.rollback()
+            return 0
+    return len(checks)
+
+
+def _accumulate(session, checks):
+    """把 checks 累加到对应的周统计中"""
+    weeks = {}
+    for check in checks:
+        key = (check.store_id, week_start(check.date), check.name)
+        row = weeks.get(key)
+        if row is None:
+            row = session.query(LossWeekly).filter_by(
+                store_id=check.store_id, week_start=key[1], name=check.name
+            ).first()
+            if row is None:
+                row = LossWeekly(store_id=check.store_id, week_start=key[1], name=check.name, checks=0,
+                                 loss_g=0, purchased_g=0, loss_value_fen=0)
+                session.add(row)
+            weeks[key] = row
+
+        loss_g = check.loss_quantity_g or 0
+        row.checks += 1
+        row.loss_g += loss_g
+        row.purchased_g += _purchased_since(session, check, _previous_check(session, check))
+        row.loss_value_fen += amount_fen(_last_cost_fen(session, check.store_id, check.name, check.date), loss_g)
+        row.updated_at = datetime.now()
+    session.flush()
+
+
+def affected_since(batch):
+    """变更记录中每个 (门店, 商品) 受影响的最早日期"""
+    since = {}
+    for change in batch:
+        for row in (change['before'], change['after']):
+            if not row or row.get('type') not in AFFECTING_TYPES or not row.get('name') or not row.get('date'):
+                continue
+            key = (row.get('store_id') or DEFAULT_STORE_ID, row.get('name'))
+            day = datetime.fromisoformat(row['date'])
+            if key not in since or day < since[key]:
+                since[key] = day
+    return since
+
+
+def rederive(session, store_id, name, since):
+    """从 since 所在周起重新计算该商品已统计过的盘点，返回重新计算的条数；调用方负责 commit
+
+    尚未统计的盘点 (id 大于 last_check_id) 留给 process_new_checks。
+    """
+    start = week_start(since)
+    session.query(LossWeekly).filter(
+        LossWeekly.store_id == store_id, LossWeekly.name == name, LossWeekly.week_start >= start
+    ).delete(synchronize_session=False)
+    checks = session.query(Product).filter(
+        Product.store_id == store_id,
+        Product.type == 'inventory_check',
+        Product.name == name,
+        Product.id <= _progress(session).last_check_id,
+        Product.date >= datetime.combine(start, datetime.min.time())
+    ).order_by(Product.id).all()
+    _accumulate(session, checks)
+    return len(checks)
+
+
+def apply_changes(session, batch):
+    """changes.consume 的 handler：重新计算变更影响到的周"""
+    for (store_id, name), since in affected_since(batch).items():
+        rederive(session, store_id, name, since)
+
+
+def update(session, batch_size=500, lag=changes.READ_LAG):
+    """处理所有新增的盘点记录，再按变更记录重算受影响的周，每批提交一次，返回处理的盘点条数"""
+    total = 0
+    try:
+        while True:
+            count = process_new_checks(session, batch_size, lag)
+            session.commit()
+            total += count
+            if count < batch_size:
+                break
+        changes.consume(session, CONSUMER, apply_changes, batch_size, entity='product', lag=lag)
+    except (IntegrityError, OperationalError) as e:
+        # 另一个进程同时在更新（或 SQLite 写锁超时），交给它或下一次更新完成
+        session.rollback()
+        logger.warning("Loss update stopped early: %s", e.__class__.__name__)
+    return total
+
+
+def rebuild(session, lag=changes.READ_LAG):
+    session.query(LossWeekly).delete()
+    _progress(session).last_check_id = 0
+    session.commit()
+    return update(session, lag=lag)
+
+
+def weekly_losses(session, start=None, end=None, names=None, store_id=DEFAULT_STORE_ID):
+    """返回按周、按商品的损耗统计，数量单位为斤，金额单位为元"""
+    query = session.query(LossWeekly).filter(LossWeekly.store_id == store_id)
+    if start is not None:
+        query = query.filter(LossWeekly.week_start >= week_start(start))
+    if end is not None:
+        query = query.filter(LossWeekly.week_start <= end)
+    if names:
+        query = query.filter(LossWeekly.name.in_(names))
+
+    return [
+        {
+            'week_start': row.week_start.isoformat(),
+            'name': row.name,
+            'checks': row.checks,
+            'loss_quantity': float(grams_to_jin(row.loss_g)),
+            'purchased_quantity': float(grams_to_jin(row.purchased_g)),
+            'loss_ratio': round(row.loss_g / row.purchased_g, 4) if row.purchased_g else None,
+            'loss_value': float(fen_to_yuan(row.loss_value_fen))
+        }
+        for row in query.order_by(LossWeekly.week_start.desc(), LossWeekly.name)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='更新盘点损耗统计')
+    parser.add_argument('--rebuild', action='store_true', help='清空后全部重新计算')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    with app.app_context():
+        count = rebuild(db.session) if args.rebuild else update(db.session)
+    print(f'处理了 {count} 条盘点记录')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,30 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import sqlite3
+import logging
+import threading
 from datetime import datetime
 from tkcalendar import DateEntry
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
 import os
 
+from models import VEGETABLES
+from numeric import amount_fen, total_amount_fen, fen_to_yuan, grams_to_jin
+import repository
+import stock
+import sync
+
+logger = logging.getLogger(__name__)
+
+# 本地数据库，与网页端使用同一套 Product 模型
+DATABASE_URL = os.environ.get('LOCAL_DATABASE_URL', 'sqlite:///vegetable_inventory.db')
+# 网页端地址和同步令牌，未配置时只在本地离线使用
+SYNC_URL = os.environ.get('SYNC_URL')
+SYNC_TOKEN = os.environ.get('SYNC_TOKEN')
+SYNC_INTERVAL = int(os.environ.get('SYNC_INTERVAL', '60'))
+# 本机所属门店，同步时只拉取该门店的记录
+STORE_ID = int(os.environ.get('STORE_ID', '1'))
+
 class VegetableInventory:
     def __init__(self, root):
         self.root = root
@@ -23,11 +41,18 @@ class VegetableInventory:
         self.style.configure("TLabel", font=("微软雅黑", 9))
         
         # 创建数据库连接
-        self.conn = sqlite3.connect('vegetable_inventory.db')
-        self.cursor = self.conn.cursor()
+        self.Session = repository.open_session(DATABASE_URL)
+        sync.LocalBase.metadata.create_all(self.Session.kw['bind'])
         
-        # 创建数据库表
-        self.create_tables()
+        # 把旧版 purchases/sales 表中的数据迁移到 Product 表
+        self.migrate_legacy_tables()
+        
+        # 同步引擎
+        self.sync_engine = None
+        self.sync_thread = None
+        self.sync_pulled = 0
+        if SYNC_URL and SYNC_TOKEN:
+            self.sync_engine = sync.SyncEngine(self.Session, SYNC_URL, SYNC_TOKEN, store_id=STORE_ID)
         
         # 创建主框架
         self.main_frame = ttk.Frame(self.root, padding="5", style="TFrame")
@@ -45,33 +70,40 @@ class VegetableInventory:
         # 加载数据
         self.load_data()
         
-    def create_tables(self):
-        # 创建进货表
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS purchases (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_name TEXT NOT NULL,
-                purchase_date TEXT NOT NULL,
-                purchase_price REAL NOT NULL,
-                quantity REAL NOT NULL,
-                total_amount REAL NOT NULL
-            )
-        ''')
-        
-        # 创建销售表
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_name TEXT NOT NULL,
-                sale_date TEXT NOT NULL,
-                sale_price REAL NOT NULL,
-                quantity REAL NOT NULL,
-                total_amount REAL NOT NULL,
-                profit REAL NOT NULL
-            )
-        ''')
-        
-        self.conn.commit()
+        # 定时同步
+        if self.sync_engine:
+            self.schedule_sync()
+        
+    def migrate_legacy_tables(self):
+        session = self.Session()
+        try:
+            conn = session.connection()
+            legacy_tables = {row[0] for row in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name IN ('purchases', 'sales')"
+            )}
+            
+            products = []
+            if 'purchases' in legacy_tables:
+                rows = conn.exec_driver_sql('SELECT product_name, purchase_date, purchase_price, quantity FROM purchases')
+                for name, date, price, quantity in rows.fetchall():
+                    products.append(repository.add_record(session, name, 'purchase', price, quantity,
+                                                          datetime.strptime(date, '%Y-%m-%d'),
+                                                          store_id=STORE_ID))
+            if 'sales' in legacy_tables:
+                rows = conn.exec_driver_sql('SELECT product_name, sale_date, sale_price, quantity FROM sales')
+                for name, date, price, quantity in rows.fetchall():
+                    products.append(repository.add_record(session, name, 'sale', price, quantity,
+                                                          datetime.strptime(date, '%Y-%m-%d'),
+                                                          store_id=STORE_ID))
+            if products:
+                sync.mark_dirty(session, products)
+            
+            # 保留旧表数据，只改名，避免重复迁移
+            for table in legacy_tables:
+                conn.exec_driver_sql(f'ALTER TABLE {table} RENAME TO {table}_legacy')
+            session.commit()
+        finally:
+            session.close()
         
     def create_stats_panel(self):
         stats_frame = ttk.LabelFrame(self.main_frame, text="库存概览", padding="5")
@@ -99,10 +131,7 @@ class VegetableInventory:
         
         # 产品名称（下拉选择框）
         ttk.Label(self.input_frame, text="产品名称:").grid(row=0, column=0, sticky=tk.W, padx=2)
-        self.product_names = [
-            "空心菜", "水白菜", "水萝卜", "油麦菜", "菜心",
-            "塔菜", "白萝卜", "快白菜", "小白菜", "大白菜"
-        ]
+        self.product_names = VEGETABLES
         self.product_name = ttk.Combobox(self.input_frame, values=self.product_names, state="readonly", width=13, font=("微软雅黑", 9))
         self.product_name.grid(row=0, column=1, sticky=tk.W, padx=2)
         
@@ -134,6 +163,8 @@ class VegetableInventory:
                   style="TButton", width=10).pack(side=tk.LEFT, padx=2)
         ttk.Button(self.button_frame, text="导出Excel", command=self.export_to_excel,
                   style="TButton", width=10).pack(side=tk.LEFT, padx=2)
+        ttk.Button(self.button_frame, text="删除选中", command=self.delete_selected,
+                  style="TButton", width=10).pack(side=tk.LEFT, padx=2)
         
     def create_data_tables(self):
         # 创建进货记录表格
@@ -207,42 +238,44 @@ class VegetableInventory:
         self.sale_frame.grid_columnconfigure(0, weight=1)
         self.sale_frame.grid_rowconfigure(0, weight=1)
         
-    def update_stats(self):
+    def update_stats(self, purchases, sales):
+        session = self.Session()
+        try:
+            stock = repository.stock_by_name(session, VEGETABLES, store_id=STORE_ID)
+        finally:
+            session.close()
+        
         # 更新产品总数
-        self.cursor.execute('SELECT COUNT(DISTINCT product_name) FROM purchases')
-        total_products = self.cursor.fetchone()[0]
+        total_products = len({purchase.name for purchase in purchases})
         self.total_products_label.config(text=f"产品总数: {total_products}")
         
         # 更新总进货金额
-        self.cursor.execute('SELECT SUM(total_amount) FROM purchases')
-        total_purchase = self.cursor.fetchone()[0] or 0
+        total_purchase = fen_to_yuan(total_amount_fen([p.price_fen for p in purchases],
+                                                      [p.quantity_g for p in purchases]))
         self.total_purchase_label.config(text=f"总进货金额: ¥{total_purchase:.2f}")
         
         # 更新总销售金额和利润
-        self.cursor.execute('SELECT SUM(total_amount), SUM(profit) FROM sales')
-        total_sales, total_profit = self.cursor.fetchone()
-        total_sales = total_sales or 0
-        total_profit = total_profit or 0
+        total_sales = fen_to_yuan(total_amount_fen([s.price_fen for s in sales], [s.quantity_g for s in sales]))
+        total_profit = sum(row[6] for row in self.sale_rows)
         self.total_sales_label.config(text=f"总销售金额: ¥{total_sales:.2f}")
         self.total_profit_label.config(text=f"总利润: ¥{total_profit:.2f}")
         
         # 更新库存预警
-        self.cursor.execute('''
-            SELECT COUNT(*) FROM (
-                SELECT product_name, 
-                       SUM(CASE WHEN type='purchase' THEN quantity ELSE -quantity END) as stock
-                FROM (
-                    SELECT product_name, quantity, 'purchase' as type FROM purchases
-                    UNION ALL
-                    SELECT product_name, quantity, 'sale' as type FROM sales
-                )
-                GROUP BY product_name
-                HAVING stock < 10
-            )
-        ''')
-        low_stock_count = self.cursor.fetchone()[0]
+        low_stock_count = sum(1 for quantity in stock.values() if quantity < 10)
         self.low_stock_label.config(text=f"库存预警: {low_stock_count}个产品")
         
+    def save_record(self, type, product, date, price, quantity):
+        session = self.Session()
+        try:
+            # 销售时在同一个事务里原子扣减库存，库存不足抛出 stock.InsufficientStock
+            record = repository.add_record(session, product, type, price, quantity,
+                                           datetime.strptime(date, '%Y-%m-%d'),
+                                           check_stock=(type == 'sale'), store_id=STORE_ID)
+            sync.mark_dirty(session, [record])
+            session.commit()
+        finally:
+            session.close()
+        
     def add_purchase(self):
         try:
             product = self.product_name.get().strip()
@@ -254,14 +287,7 @@ class VegetableInventory:
                 messagebox.showerror("错误", "请输入产品名称")
                 return
                 
-            total = price * quantity
-            
-            self.cursor.execute('''
-                INSERT INTO purchases (product_name, purchase_date, purchase_price, quantity, total_amount)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (product, date, price, quantity, total))
-            
-            self.conn.commit()
+            self.save_record('purchase', product, date, price, quantity)
             self.load_data()
             self.clear_inputs()
             messagebox.showinfo("成功", "进货记录已添加")
@@ -282,47 +308,21 @@ class VegetableInventory:
                 messagebox.showerror("错误", "请输入产品名称")
                 return
                 
-            # 检查库存
-            self.cursor.execute('''
-                SELECT SUM(quantity) FROM purchases 
-                WHERE product_name = ?
-            ''', (product,))
-            total_purchased = self.cursor.fetchone()[0] or 0
-            
-            self.cursor.execute('''
-                SELECT SUM(quantity) FROM sales 
-                WHERE product_name = ?
-            ''', (product,))
-            total_sold = self.cursor.fetchone()[0] or 0
-            
-            available_stock = total_purchased - total_sold
-            
-            if quantity > available_stock:
-                messagebox.showerror("错误", f"库存不足！当前库存: {available_stock}")
-                return
-                
-            # 获取最近一次进货价格
-            self.cursor.execute('''
-                SELECT purchase_price FROM purchases 
-                WHERE product_name = ? 
-                ORDER BY purchase_date DESC LIMIT 1
-            ''', (product,))
-            purchase_price = self.cursor.fetchone()
+            session = self.Session()
+            try:
+                latest_purchase = repository.latest_purchase(session, product, store_id=STORE_ID)
+            finally:
+                session.close()
             
-            if not purchase_price:
+            if not latest_purchase:
                 messagebox.showerror("错误", "未找到该产品的进货记录")
                 return
-                
-            purchase_price = purchase_price[0]
-            total = price * quantity
-            profit = total - (purchase_price * quantity)
-            
-            self.cursor.execute('''
-                INSERT INTO sales (product_name, sale_date, sale_price, quantity, total_amount, profit)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (product, date, price, quantity, total, profit))
             
-            self.conn.commit()
+            try:
+                self.save_record('sale', product, date, price, quantity)
+            except stock.InsufficientStock as e:
+                messagebox.showerror("错误", f"库存不足！当前库存: {grams_to_jin(e.available_g)}")
+                return
             self.load_data()
             self.clear_inputs()
             messagebox.showinfo("成功", "销售记录已添加")
@@ -332,25 +332,83 @@ class VegetableInventory:
         except Exception as e:
             messagebox.showerror("错误", str(e))
             
+    def delete_selected(self):
+        ids = [self.purchase_tree.item(item)['values'][0] for item in self.purchase_tree.selection()]
+        ids += [self.sale_tree.item(item)['values'][0] for item in self.sale_tree.selection()]
+        if not ids:
+            messagebox.showerror("错误", "请先选择要删除的记录")
+            return
+        if not messagebox.askyesno("确认", f"确定删除选中的 {len(ids)} 条记录吗？"):
+            return
+        
+        session = self.Session()
+        try:
+            # 删除同样登记到同步缓冲，联网时通知网页端删除
+            sync.delete_records(session, repository.get_records(session, ids, store_id=STORE_ID))
+            session.commit()
+        finally:
+            session.close()
+        self.load_data()
+        
     def load_data(self):
         # 清空现有数据
         for item in self.purchase_tree.get_children():
             self.purchase_tree.delete(item)
         for item in self.sale_tree.get_children():
             self.sale_tree.delete(item)
-            
+        
+        session = self.Session()
+        try:
+            purchases = repository.list_records(session, 'purchase', store_id=STORE_ID)
+            sales = repository.list_records(session, 'sale', store_id=STORE_ID)
+        finally:
+            session.close()
+        
         # 加载进货记录
-        self.cursor.execute('SELECT * FROM purchases ORDER BY purchase_date DESC')
-        for row in self.cursor.fetchall():
+        self.purchase_rows = [
+            (p.id, p.name, p.date.strftime('%Y-%m-%d'), fen_to_yuan(p.price_fen), grams_to_jin(p.quantity_g),
+             fen_to_yuan(amount_fen(p.price_fen, p.quantity_g)))
+            for p in purchases
+        ]
+        for row in self.purchase_rows:
             self.purchase_tree.insert('', 'end', values=row)
-            
-        # 加载销售记录
-        self.cursor.execute('SELECT * FROM sales ORDER BY sale_date DESC')
-        for row in self.cursor.fetchall():
+        
+        # 加载销售记录，利润按销售日期之前最近一次的进货价计算
+        self.sale_rows = []
+        for s in sales:
+            purchase_fen = next((p.price_fen for p in purchases if p.name == s.name and p.date <= s.date), None)
+            total_fen = amount_fen(s.price_fen, s.quantity_g)
+            profit_fen = total_fen - amount_fen(purchase_fen, s.quantity_g) if purchase_fen is not None else 0
+            self.sale_rows.append((s.id, s.name, s.date.strftime('%Y-%m-%d'), fen_to_yuan(s.price_fen),
+                                   grams_to_jin(s.quantity_g), fen_to_yuan(total_fen), fen_to_yuan(profit_fen)))
+        for row in self.sale_rows:
             self.sale_tree.insert('', 'end', values=row)
             
         # 更新统计信息
-        self.update_stats()
+        self.update_stats(purchases, sales)
+        
+    def schedule_sync(self):
+        if self.sync_thread is None or not self.sync_thread.is_alive():
+            # 上一轮拉取到了服务器的新数据，刷新界面
+            if self.sync_pulled:
+                self.sync_pulled = 0
+                self.load_data()
+            # 服务器上已结账日期的修改被拒绝，已恢复为服务器上的版本
+            if self.sync_engine.reverted:
+                count = len(self.sync_engine.reverted)
+                self.sync_engine.reverted = []
+                self.load_data()
+                messagebox.showwarning("同步", f"{count} 条记录所在日期在服务器上已结账，本地修改未被接受，已恢复为服务器上的数据")
+            self.sync_thread = threading.Thread(target=self.run_sync, daemon=True)
+            self.sync_thread.start()
+        self.root.after(SYNC_INTERVAL * 1000, self.schedule_sync)
+        
+    def run_sync(self):
+        try:
+            pushed, self.sync_pulled = self.sync_engine.run_once()
+        except Exception as e:
+            # 离线时保留本地缓冲，下一轮再试
+            logger.warning("Sync failed: %s", e)
             
     def clear_inputs(self):
         self.product_name.set("")
@@ -377,8 +435,7 @@ class VegetableInventory:
                 cell.alignment = Alignment(horizontal="center")
             
             # 写入进货数据
-            self.cursor.execute('SELECT * FROM purchases ORDER BY purchase_date DESC')
-            for row_idx, row in enumerate(self.cursor.fetchall(), 2):
+            for row_idx, row in enumerate(self.purchase_rows, 2):
                 for col_idx, value in enumerate(row, 1):
                     cell = ws_purchase.cell(row=row_idx, column=col_idx)
                     cell.value = value
@@ -397,8 +454,7 @@ class VegetableInventory:
                 cell.alignment = Alignment(horizontal="center")
             
             # 写入销售数据
-            self.cursor.execute('SELECT * FROM sales ORDER BY sale_date DESC')
-            for row_idx, row in enumerate(self.cursor.fetchall(), 2):
+            for row_idx, row in enumerate(self.sale_rows, 2):
                 for col_idx, value in enumerate(row, 1):
                     cell = ws_sale.cell(row=row_idx, column=col_idx)
                     cell.value = value
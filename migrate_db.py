@@ -1,42 +1,30 @@
-from app import app, db, ProductPrice
-from datetime import datetime
-
-def migrate_database():
-    with app.app_context():
-        # 1. 备份现有价格数据
-        old_prices = ProductPrice.query.all()
-        price_data = []
-        for price in old_prices:
-            price_data.append({
-                'name': price.name,
-                'purchase_price': price.purchase_price,
-                'sale_price': price.sale_price,
-                'created_at': price.created_at,
-                'updated_at': price.updated_at
-            })
-        
-        # 2. 删除旧表
-        db.drop_all()
-        
-        # 3. 创建新表
-        db.create_all()
-        
-        # 4. 恢复价格数据，添加开始日期
-        for price in price_data:
-            new_price = ProductPrice(
-                name=price['name'],
-                purchase_price=price['purchase_price'],
-                sale_price=price['sale_price'],
-                start_date=datetime.now(),  # 设置当前时间为开始日期
-                end_date=None,  # 设置为永久有效
-                created_at=price['created_at'],
-                updated_at=price['updated_at']
-            )
-            db.session.add(new_price)
-        
-        # 5. 提交更改
-        db.session.commit()
-        print("数据库迁移完成！")
+import logging
+import os
+import sys
+
+from alembic import command
+from alembic.config import Config as AlembicConfig
+
+# 配置日志
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def alembic_config():
+    config = AlembicConfig(os.path.join(current_dir, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(current_dir, 'migrations'))
+    config.attributes['configure_logger'] = False
+    return config
+
+
+def migrate_database(revision='head'):
+    """执行 alembic 迁移，只增量修改表结构，不删除已有数据"""
+    command.upgrade(alembic_config(), revision)
+    logger.info("Database migrated to %s", revision)
+
 
 if __name__ == '__main__':
-    migrate_database() 
\ No newline at end of file
+    migrate_database(sys.argv[1] if len(sys.argv) > 1 else 'head')
+    print("数据库迁移完成！")
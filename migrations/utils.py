@@ -0,0 +1,19 @@
+"""迁移脚本共用的辅助函数
+
+旧数据库是用 db.create_all() 建出来的，表和列可能已经存在，
+迁移脚本在创建前先检查，保证对新库和旧库都可以安全执行。
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+def has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def has_column(table, column):
+    return any(c['name'] == column for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def has_index(table, index):
+    return any(i['name'] == index for i in sa.inspect(op.get_bind()).get_indexes(table))
@@ -0,0 +1,81 @@
+"""baseline schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 09:00:00
+
+用 db.create_all() 建出来的旧数据库已经有这些表，只创建缺失的表。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('user'):
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('username', sa.String(80), nullable=False, unique=True),
+            sa.Column('password_hash', sa.String(120), nullable=False),
+            sa.Column('role', sa.String(20)),
+            sa.Column('last_login', sa.DateTime),
+            sa.Column('created_at', sa.DateTime),
+        )
+
+    if not has_table('product_price'):
+        op.create_table(
+            'product_price',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('sale_price', sa.Float, nullable=False),
+            sa.Column('start_date', sa.DateTime, nullable=False),
+            sa.Column('end_date', sa.DateTime),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('updated_at', sa.DateTime),
+            sa.UniqueConstraint('name', 'start_date', name='unique_price_period'),
+        )
+
+    if not has_table('activity_log'):
+        op.create_table(
+            'activity_log',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey('user.id'), nullable=False),
+            sa.Column('action', sa.String(100), nullable=False),
+            sa.Column('details', sa.Text),
+            sa.Column('created_at', sa.DateTime),
+        )
+        op.create_index('ix_activity_log_user_id', 'activity_log', ['user_id'])
+        op.create_index('ix_activity_log_created_at', 'activity_log', ['created_at'])
+
+    if not has_table('product'):
+        op.create_table(
+            'product',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('type', sa.String(20), nullable=False),
+            sa.Column('price', sa.Float, nullable=False),
+            sa.Column('quantity', sa.Integer, nullable=False),
+            sa.Column('actual_quantity', sa.Integer),
+            sa.Column('loss_quantity', sa.Integer),
+            sa.Column('date', sa.DateTime, nullable=False),
+            sa.Column('notes', sa.Text),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('updated_at', sa.DateTime),
+        )
+        op.create_index('ix_product_name', 'product', ['name'])
+        op.create_index('ix_product_type', 'product', ['type'])
+        op.create_index('ix_product_date', 'product', ['date'])
+
+
+def downgrade():
+    op.drop_table('product')
+    op.drop_table('activity_log')
+    op.drop_table('product_price')
+    op.drop_table('user')
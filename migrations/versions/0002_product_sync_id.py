@@ -0,0 +1,52 @@
+"""product.sync_id for desktop sync
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:10:00
+"""
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+from backfill import run_backfill
+from migrations.utils import has_column, has_index
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+product = sa.Table(
+    'product', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('sync_id', sa.String(32)),
+)
+
+
+def fill_sync_id(conn, rows):
+    conn.execute(
+        sa.update(product).where(product.c.id == sa.bindparam('pk')).values(sync_id=sa.bindparam('sid')),
+        [{'pk': row.id, 'sid': uuid.uuid4().hex} for row in rows]
+    )
+
+
+def upgrade():
+    if not has_column('product', 'sync_id'):
+        with op.batch_alter_table('product') as batch_op:
+            batch_op.add_column(sa.Column('sync_id', sa.String(32)))
+
+    run_backfill(op.get_bind(), '0002_product_sync_id', product, fill_sync_id,
+                 columns=['id'], where=product.c.sync_id.is_(None))
+
+    if not has_index('product', 'ix_product_sync_id'):
+        op.create_index('ix_product_sync_id', 'product', ['sync_id'], unique=True)
+    if not has_index('product', 'ix_product_updated_at'):
+        op.create_index('ix_product_updated_at', 'product', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_product_updated_at', 'product')
+    op.drop_index('ix_product_sync_id', 'product')
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.drop_column('sync_id')
@@ -0,0 +1,27 @@
+"""widen user.password_hash for scrypt hashes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 09:20:00
+
+werkzeug 的 scrypt 哈希长度约 160 个字符，超过原来的 VARCHAR(120)。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password_hash', type_=sa.String(255), existing_type=sa.String(120),
+                              existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password_hash', type_=sa.String(120), existing_type=sa.String(255),
+                              existing_nullable=False)
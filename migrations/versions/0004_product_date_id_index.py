@@ -0,0 +1,23 @@
+"""composite (date, id) index for record pagination
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 09:30:00
+"""
+from alembic import op
+
+from migrations.utils import has_index
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_index('product', 'ix_product_date_id'):
+        op.create_index('ix_product_date_id', 'product', ['date', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_product_date_id', 'product')
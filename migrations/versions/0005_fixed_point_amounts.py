@@ -0,0 +1,90 @@
+"""fixed-point money (fen) and quantity (gram) columns
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 09:40:00
+
+新增整数列并从原来的 price/quantity 浮点列分批回填。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from backfill import run_backfill
+from migrations.utils import has_column
+from numeric import to_fen, to_grams
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+product = sa.Table(
+    'product', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('price', sa.Float),
+    sa.Column('quantity', sa.Float),
+    sa.Column('actual_quantity', sa.Float),
+    sa.Column('loss_quantity', sa.Float),
+    sa.Column('price_fen', sa.BigInteger),
+    sa.Column('quantity_g', sa.BigInteger),
+    sa.Column('actual_quantity_g', sa.BigInteger),
+    sa.Column('loss_quantity_g', sa.BigInteger),
+)
+
+product_price = sa.Table(
+    'product_price', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('sale_price', sa.Float),
+    sa.Column('sale_price_fen', sa.BigInteger),
+)
+
+
+def fill_product(conn, rows):
+    conn.execute(
+        sa.update(product).where(product.c.id == sa.bindparam('pk')).values(
+            price_fen=sa.bindparam('p_fen'),
+            quantity_g=sa.bindparam('q_g'),
+            actual_quantity_g=sa.bindparam('a_g'),
+            loss_quantity_g=sa.bindparam('l_g'),
+        ),
+        [{
+            'pk': row.id,
+            'p_fen': to_fen(row.price),
+            'q_g': to_grams(row.quantity),
+            'a_g': to_grams(row.actual_quantity or 0),
+            'l_g': to_grams(row.loss_quantity or 0),
+        } for row in rows]
+    )
+
+
+def fill_product_price(conn, rows):
+    conn.execute(
+        sa.update(product_price).where(product_price.c.id == sa.bindparam('pk')).values(
+            sale_price_fen=sa.bindparam('p_fen')
+        ),
+        [{'pk': row.id, 'p_fen': to_fen(row.sale_price)} for row in rows]
+    )
+
+
+def upgrade():
+    with op.batch_alter_table('product') as batch_op:
+        for column in ['price_fen', 'quantity_g', 'actual_quantity_g', 'loss_quantity_g']:
+            if not has_column('product', column):
+                batch_op.add_column(sa.Column(column, sa.BigInteger))
+    if not has_column('product_price', 'sale_price_fen'):
+        with op.batch_alter_table('product_price') as batch_op:
+            batch_op.add_column(sa.Column('sale_price_fen', sa.BigInteger))
+
+    run_backfill(op.get_bind(), '0005_product_fixed_point', product, fill_product,
+                 columns=['price', 'quantity', 'actual_quantity', 'loss_quantity'],
+                 where=product.c.price_fen.is_(None))
+    run_backfill(op.get_bind(), '0005_product_price_fixed_point', product_price, fill_product_price,
+                 columns=['sale_price'], where=product_price.c.sale_price_fen.is_(None))
+
+
+def downgrade():
+    with op.batch_alter_table('product_price') as batch_op:
+        batch_op.drop_column('sale_price_fen')
+    with op.batch_alter_table('product') as batch_op:
+        for column in ['loss_quantity_g', 'actual_quantity_g', 'quantity_g', 'price_fen']:
+            batch_op.drop_column(column)
@@ -0,0 +1,35 @@
+"""reorder suggestion cache table
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 12:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('reorder_suggestion'):
+        op.create_table(
+            'reorder_suggestion',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('target_date', sa.Date, nullable=False),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('forecast_g', sa.BigInteger),
+            sa.Column('loss_rate', sa.Float),
+            sa.Column('stock_g', sa.BigInteger),
+            sa.Column('suggested_g', sa.BigInteger),
+            sa.Column('computed_at', sa.DateTime),
+            sa.UniqueConstraint('target_date', 'name', name='unique_suggestion_day'),
+        )
+
+
+def downgrade():
+    op.drop_table('reorder_suggestion')
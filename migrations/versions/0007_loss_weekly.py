@@ -0,0 +1,43 @@
+"""incremental loss analytics tables
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 12:30:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('loss_weekly'):
+        op.create_table(
+            'loss_weekly',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('week_start', sa.Date, nullable=False),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('checks', sa.Integer),
+            sa.Column('loss_g', sa.BigInteger),
+            sa.Column('purchased_g', sa.BigInteger),
+            sa.Column('loss_value_fen', sa.BigInteger),
+            sa.Column('updated_at', sa.DateTime),
+            sa.UniqueConstraint('week_start', 'name', name='unique_loss_week'),
+        )
+
+    if not has_table('loss_progress'):
+        op.create_table(
+            'loss_progress',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('last_check_id', sa.Integer, nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table('loss_progress')
+    op.drop_table('loss_weekly')
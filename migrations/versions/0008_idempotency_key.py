@@ -0,0 +1,34 @@
+"""idempotency keys for duplicate submission protection
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 13:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('idempotency_key'):
+        op.create_table(
+            'idempotency_key',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('key', sa.String(64), nullable=False, unique=True),
+            sa.Column('user_id', sa.Integer),
+            sa.Column('endpoint', sa.String(100), nullable=False),
+            sa.Column('status_code', sa.Integer, nullable=False),
+            sa.Column('body', sa.Text),
+            sa.Column('created_at', sa.DateTime),
+        )
+        op.create_index('ix_idempotency_key_created_at', 'idempotency_key', ['created_at'])
+
+
+def downgrade():
+    op.drop_table('idempotency_key')
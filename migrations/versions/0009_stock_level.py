@@ -0,0 +1,32 @@
+"""current stock level per product
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 13:30:00
+
+库存行在第一次用到某个商品时由 stock.ensure_level() 按记录初始化，这里只建表。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('stock_level'):
+        op.create_table(
+            'stock_level',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(100), nullable=False, unique=True),
+            sa.Column('quantity_g', sa.BigInteger, nullable=False),
+            sa.Column('updated_at', sa.DateTime),
+        )
+
+
+def downgrade():
+    op.drop_table('stock_level')
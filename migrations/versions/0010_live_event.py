@@ -0,0 +1,30 @@
+"""live update events for the SSE endpoint
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 14:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('live_event'):
+        op.create_table(
+            'live_event',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('payload', sa.Text, nullable=False),
+            sa.Column('created_at', sa.DateTime),
+        )
+        op.create_index('ix_live_event_created_at', 'live_event', ['created_at'])
+
+
+def downgrade():
+    op.drop_table('live_event')
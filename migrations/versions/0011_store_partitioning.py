@@ -0,0 +1,160 @@
+"""store dimension on products, prices, users and derived tables
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19 14:30:00
+
+已有数据全部归到默认门店 (id=1)。stock_level、reorder_suggestion、
+loss_weekly 都是可以从记录重新算出的缓存表，直接按新结构重建，
+loss_progress 清零后由 losses.update() 重新统计。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table, has_column, has_index
+
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+DEFAULT_STORE_ID = 1
+
+
+def store_id_column():
+    return sa.Column('store_id', sa.Integer, nullable=False, server_default=str(DEFAULT_STORE_ID))
+
+
+def upgrade():
+    if not has_table('store'):
+        op.create_table(
+            'store',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(100), nullable=False, unique=True),
+            sa.Column('created_at', sa.DateTime),
+        )
+    store = sa.table('store', sa.column('id', sa.Integer), sa.column('name', sa.String))
+    bind = op.get_bind()
+    if bind.execute(sa.select(store.c.id).where(store.c.id == DEFAULT_STORE_ID)).first() is None:
+        op.bulk_insert(store, [{'id': DEFAULT_STORE_ID, 'name': '总店'}])
+    if bind.dialect.name == 'postgresql':
+        # 显式插入 id 不会推进 SERIAL 序列，否则新建的第一个门店也会分到 id=1
+        op.execute("SELECT setval(pg_get_serial_sequence('store', 'id'), (SELECT MAX(id) FROM store))")
+
+    if not has_column('user', 'store_id'):
+        with op.batch_alter_table('user') as batch_op:
+            batch_op.add_column(store_id_column())
+            batch_op.create_foreign_key('fk_user_store_id', 'store', ['store_id'], ['id'])
+
+    if not has_column('product_price', 'store_id'):
+        with op.batch_alter_table('product_price') as batch_op:
+            batch_op.add_column(store_id_column())
+            batch_op.create_foreign_key('fk_product_price_store_id', 'store', ['store_id'], ['id'])
+            batch_op.drop_constraint('unique_price_period', type_='unique')
+            batch_op.create_unique_constraint('unique_price_period', ['store_id', 'name', 'start_date'])
+
+    if not has_column('product', 'store_id'):
+        with op.batch_alter_table('product') as batch_op:
+            batch_op.add_column(store_id_column())
+            batch_op.create_foreign_key('fk_product_store_id', 'store', ['store_id'], ['id'])
+    if has_index('product', 'ix_product_date_id'):
+        op.drop_index('ix_product_date_id', 'product')
+    if not has_index('product', 'ix_product_store_date_id'):
+        op.create_index('ix_product_store_date_id', 'product', ['store_id', 'date', 'id'])
+    if not has_index('product', 'ix_product_store_name_type_date'):
+        op.create_index('ix_product_store_name_type_date', 'product', ['store_id', 'name', 'type', 'date'])
+
+    if not has_column('live_event', 'store_id'):
+        with op.batch_alter_table('live_event') as batch_op:
+            batch_op.add_column(store_id_column())
+
+    if not has_column('stock_level', 'store_id'):
+        op.drop_table('stock_level')
+        op.create_table(
+            'stock_level',
+            sa.Column('id', sa.Integer, primary_key=True),
+            store_id_column(),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('quantity_g', sa.BigInteger, nullable=False),
+            sa.Column('updated_at', sa.DateTime),
+            sa.UniqueConstraint('store_id', 'name', name='unique_stock_level'),
+        )
+
+    if not has_column('reorder_suggestion', 'store_id'):
+        op.drop_table('reorder_suggestion')
+        op.create_table(
+            'reorder_suggestion',
+            sa.Column('id', sa.Integer, primary_key=True),
+            store_id_column(),
+            sa.Column('target_date', sa.Date, nullable=False),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('forecast_g', sa.BigInteger),
+            sa.Column('loss_rate', sa.Float),
+            sa.Column('stock_g', sa.BigInteger),
+            sa.Column('suggested_g', sa.BigInteger),
+            sa.Column('computed_at', sa.DateTime),
+            sa.UniqueConstraint('store_id', 'target_date', 'name', name='unique_suggestion_day'),
+        )
+
+    if not has_column('loss_weekly', 'store_id'):
+        op.drop_table('loss_weekly')
+        op.create_table(
+            'loss_weekly',
+            sa.Column('id', sa.Integer, primary_key=True),
+            store_id_column(),
+            sa.Column('week_start', sa.Date, nullable=False),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('checks', sa.Integer),
+            sa.Column('loss_g', sa.BigInteger),
+            sa.Column('purchased_g', sa.BigInteger),
+            sa.Column('loss_value_fen', sa.BigInteger),
+            sa.Column('updated_at', sa.DateTime),
+            sa.UniqueConstraint('store_id', 'week_start', 'name', name='unique_loss_week'),
+        )
+        op.execute(sa.text('DELETE FROM loss_progress'))
+
+
+def downgrade():
+    with op.batch_alter_table('loss_weekly') as batch_op:
+        batch_op.drop_constraint('unique_loss_week', type_='unique')
+        batch_op.drop_column('store_id')
+        batch_op.create_unique_constraint('unique_loss_week', ['week_start', 'name'])
+    op.execute(sa.text('DELETE FROM loss_weekly'))
+    op.execute(sa.text('DELETE FROM loss_progress'))
+
+    with op.batch_alter_table('reorder_suggestion') as batch_op:
+        batch_op.drop_constraint('unique_suggestion_day', type_='unique')
+        batch_op.drop_column('store_id')
+        batch_op.create_unique_constraint('unique_suggestion_day', ['target_date', 'name'])
+    op.execute(sa.text('DELETE FROM reorder_suggestion'))
+
+    op.drop_table('stock_level')
+    op.create_table(
+        'stock_level',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.String(100), nullable=False, unique=True),
+        sa.Column('quantity_g', sa.BigInteger, nullable=False),
+        sa.Column('updated_at', sa.DateTime),
+    )
+
+    with op.batch_alter_table('live_event') as batch_op:
+        batch_op.drop_column('store_id')
+
+    op.drop_index('ix_product_store_name_type_date', 'product')
+    op.drop_index('ix_product_store_date_id', 'product')
+    op.create_index('ix_product_date_id', 'product', ['date', 'id'])
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.drop_constraint('fk_product_store_id', type_='foreignkey')
+        batch_op.drop_column('store_id')
+
+    with op.batch_alter_table('product_price') as batch_op:
+        batch_op.drop_constraint('unique_price_period', type_='unique')
+        batch_op.drop_constraint('fk_product_price_store_id', type_='foreignkey')
+        batch_op.drop_column('store_id')
+        batch_op.create_unique_constraint('unique_price_period', ['name', 'start_date'])
+
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_constraint('fk_user_store_id', type_='foreignkey')
+        batch_op.drop_column('store_id')
+
+    op.drop_table('store')
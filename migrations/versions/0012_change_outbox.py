@@ -0,0 +1,45 @@
+"""change data capture outbox for product and product_price
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19 16:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('change_record'):
+        op.create_table(
+            'change_record',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('store_id', sa.Integer, nullable=False, server_default='1'),
+            sa.Column('entity', sa.String(30), nullable=False),
+            sa.Column('entity_id', sa.Integer, nullable=False),
+            sa.Column('op', sa.String(10), nullable=False),
+            sa.Column('before', sa.Text),
+            sa.Column('after', sa.Text),
+            sa.Column('created_at', sa.DateTime),
+        )
+        op.create_index('ix_change_record_created_at', 'change_record', ['created_at'])
+        op.create_index('ix_change_record_entity_id', 'change_record', ['entity', 'id'])
+
+    if not has_table('change_consumer'):
+        op.create_table(
+            'change_consumer',
+            sa.Column('name', sa.String(50), primary_key=True),
+            sa.Column('last_seq', sa.Integer, nullable=False),
+            sa.Column('updated_at', sa.DateTime),
+        )
+
+
+def downgrade():
+    op.drop_table('change_consumer')
+    op.drop_table('change_record')
@@ -0,0 +1,44 @@
+"""background job table
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19 17:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0013'
+down_revision = '0012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('job'):
+        op.create_table(
+            'job',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('kind', sa.String(30), nullable=False),
+            sa.Column('params', sa.Text),
+            sa.Column('status', sa.String(20), nullable=False),
+            sa.Column('progress', sa.Integer, nullable=False),
+            sa.Column('message', sa.String(500)),
+            sa.Column('result', sa.Text),
+            sa.Column('result_path', sa.String(500)),
+            sa.Column('result_name', sa.String(200)),
+            sa.Column('user_id', sa.Integer),
+            sa.Column('store_id', sa.Integer, nullable=False, server_default='1'),
+            sa.Column('worker', sa.String(100)),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('started_at', sa.DateTime),
+            sa.Column('heartbeat_at', sa.DateTime),
+            sa.Column('finished_at', sa.DateTime),
+        )
+        op.create_index('ix_job_status_id', 'job', ['status', 'id'])
+        op.create_index('ix_job_user_id', 'job', ['user_id', 'id'])
+
+
+def downgrade():
+    op.drop_table('job')
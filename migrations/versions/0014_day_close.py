@@ -0,0 +1,52 @@
+"""day close and frozen daily summary
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-19 19:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0014'
+down_revision = '0013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('day_close'):
+        op.create_table(
+            'day_close',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('store_id', sa.Integer, nullable=False, server_default='1'),
+            sa.Column('day', sa.Date, nullable=False),
+            sa.Column('closed_by', sa.Integer),
+            sa.Column('closed_at', sa.DateTime),
+            sa.UniqueConstraint('store_id', 'day', name='unique_day_close'),
+        )
+
+    if not has_table('daily_summary'):
+        amount = lambda name: sa.Column(name, sa.BigInteger, nullable=False)
+        op.create_table(
+            'daily_summary',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('store_id', sa.Integer, nullable=False, server_default='1'),
+            sa.Column('day', sa.Date, nullable=False),
+            sa.Column('name', sa.String(100), nullable=False),
+            amount('purchase_g'),
+            amount('purchase_fen'),
+            amount('sale_g'),
+            amount('sale_fen'),
+            amount('actual_g'),
+            amount('loss_g'),
+            amount('profit_fen'),
+            amount('stock_g'),
+            sa.UniqueConstraint('store_id', 'day', 'name', name='unique_daily_summary'),
+        )
+
+
+def downgrade():
+    op.drop_table('daily_summary')
+    op.drop_table('day_close')
@@ -0,0 +1,24 @@
+"""advance the store id sequence past the default store
+
+Revision ID: 0015
+Revises: 0014
+Create Date: 2026-10-20 10:00:00
+
+0011 插入默认门店时显式指定了 id=1，Postgres 上 SERIAL 序列没有推进，
+新建门店会分到重复的 id。已经升级过 0011 的数据库在这里补上。
+"""
+from alembic import op
+
+revision = '0015'
+down_revision = '0014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("SELECT setval(pg_get_serial_sequence('store', 'id'), (SELECT MAX(id) FROM store))")
+
+
+def downgrade():
+    pass
@@ -0,0 +1,32 @@
+"""tombstones for deleted products so deletes sync between web and desktop
+
+Revision ID: 0016
+Revises: 0015
+Create Date: 2026-10-20 11:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.utils import has_table
+
+revision = '0016'
+down_revision = '0015'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('product_tombstone'):
+        op.create_table(
+            'product_tombstone',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('sync_id', sa.String(32), nullable=False, unique=True),
+            sa.Column('store_id', sa.Integer, nullable=False, server_default='1'),
+            sa.Column('date', sa.DateTime, nullable=False),
+            sa.Column('deleted_at', sa.DateTime, nullable=False),
+        )
+        op.create_index('ix_product_tombstone_deleted_at_id', 'product_tombstone', ['deleted_at', 'id'])
+
+
+def downgrade():
+    op.drop_table('product_tombstone')
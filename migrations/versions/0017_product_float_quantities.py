@@ -0,0 +1,59 @@
+"""legacy quantity columns hold jin with decimals: Integer -> Float
+
+Revision ID: 0017
+Revises: 0016
+Create Date: 2026-10-21 09:00:00
+
+set_amounts 写入的斤数带小数，Postgres 的整数列会把它四舍五入；改成和 price 一样
+的 Float，再按定点列 (克) 分批重新计算，修正已经丢掉小数的记录。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from backfill import run_backfill
+from numeric import GRAMS_PER_JIN
+
+revision = '0017'
+down_revision = '0016'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['quantity', 'actual_quantity', 'loss_quantity']
+
+product = sa.Table(
+    'product', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    *(sa.Column(column, sa.Float) for column in COLUMNS),
+    *(sa.Column(f'{column}_g', sa.BigInteger) for column in COLUMNS),
+)
+
+
+def fill_product(conn, rows):
+    conn.execute(
+        sa.update(product).where(product.c.id.between(rows[0].id, rows[-1].id)).values({
+            column: sa.cast(sa.func.coalesce(product.c[f'{column}_g'], 0), sa.Float) / GRAMS_PER_JIN
+            for column in COLUMNS
+        })
+    )
+
+
+def _integer_columns():
+    return [
+        column['name'] for column in sa.inspect(op.get_bind()).get_columns('product')
+        if column['name'] in COLUMNS and isinstance(column['type'], sa.Integer)
+    ]
+
+
+def upgrade():
+    integer_columns = _integer_columns()
+    if integer_columns:
+        with op.batch_alter_table('product') as batch_op:
+            for column in integer_columns:
+                batch_op.alter_column(column, type_=sa.Float, existing_type=sa.Integer)
+    run_backfill(op.get_bind(), '0017_product_float_quantities', product, fill_product, columns=['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('product') as batch_op:
+        for column in COLUMNS:
+            batch_op.alter_column(column, type_=sa.Integer, existing_type=sa.Float)
@@ -0,0 +1,314 @@
+import uuid
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import UserMixin
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from database import RoutingSession
+from numeric import to_fen, to_grams, fen_to_yuan, grams_to_jin
+
+# 网页端和桌面端共用的数据模型；网页端的 session 支持把只读请求路由到副本
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# 所有商品名称
+VEGETABLES = ['空心菜', '水白菜', '水萝卜', '油麦菜', '菜心', '塔菜', '白萝卜', '快白菜', '小白菜', '大白菜']
+
+
+# 迁移时创建的默认门店，单门店部署和桌面端默认使用它
+DEFAULT_STORE_ID = 1
+
+
+def new_sync_id():
+    return uuid.uuid4().hex
+
+
+def store_column(foreign_key=True):
+    """门店列：所有按门店区分的数据都带这一列，相关索引以它开头"""
+    args = [db.ForeignKey('store.id')] if foreign_key else []
+    return db.Column(db.Integer, *args, nullable=False, default=DEFAULT_STORE_ID,
+                     server_default=str(DEFAULT_STORE_ID))
+
+
+class Store(db.Model):
+    """门店/仓库"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+    role = db.Column(db.String(20), default='user')  # 'admin' or 'user'
+    store_id = store_column()  # 所属门店，管理员可以切换查看其他门店
+    last_login = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def set_password(self, password):
+        method = 'scrypt'
+        if has_app_context():
+            method = current_app.config.get('PASSWORD_HASH_METHOD', method)
+        self.password_hash = generate_password_hash(password, method)
+
+    def check_password(self, password):
+        return check_password_hash(self.password_hash, password)
+
+    def is_admin(self):
+        return self.role == 'admin'
+
+
+class ProductPrice(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = store_column()
+    name = db.Column(db.String(100), nullable=False)
+    sale_price = db.Column(db.Float, nullable=False)
+    sale_price_fen = db.Column(db.BigInteger, default=0)  # 销售价，单位：分/斤
+    start_date = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    end_date = db.Column(db.DateTime, nullable=True)  # 如果为null表示价格一直有效
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'name', 'start_date', name='unique_price_period'),
+    )
+
+    def set_sale_price(self, sale_price):
+        self.sale_price_fen = to_fen(sale_price)
+        self.sale_price = float(fen_to_yuan(self.sale_price_fen))
+
+
+class ActivityLog(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    action = db.Column(db.String(100), nullable=False)
+    details = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+    user = db.relationship('User', backref=db.backref('activities', lazy=True))
+
+
+class Product(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # 跨数据库的全局唯一标识，用于桌面端与网页端之间的同步
+    sync_id = db.Column(db.String(32), unique=True, index=True, default=new_sync_id)
+    store_id = store_column()
+    name = db.Column(db.String(100), nullable=False, index=True)
+    type = db.Column(db.String(20), nullable=False, index=True)  # 'purchase', 'sale', or 'inventory_check'
+    price = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Float, nullable=False)
+    actual_quantity = db.Column(db.Float, default=0)  # For inventory check records
+    loss_quantity = db.Column(db.Float, default=0)
+    # 定点数表示，汇总计算以这些列为准：单价为 分/斤，数量为 克
+    price_fen = db.Column(db.BigInteger, default=0)
+    quantity_g = db.Column(db.BigInteger, default=0)
+    actual_quantity_g = db.Column(db.BigInteger, default=0)
+    loss_quantity_g = db.Column(db.BigInteger, default=0)
+    date = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+
+    __table_args__ = (
+        # 记录列表按门店内的 (date, id) 倒序做 keyset 分页
+        db.Index('ix_product_store_date_id', 'store_id', 'date', 'id'),
+        # 汇总、库存、预测按门店和商品查询
+        db.Index('ix_product_store_name_type_date', 'store_id', 'name', 'type', 'date'),
+    )
+
+    def set_amounts(self, price, quantity, actual_quantity=0, loss_quantity=0):
+        """同时写入定点列和兼容旧页面的 price/quantity 列"""
+        self.price_fen = to_fen(price)
+        self.quantity_g = to_grams(quantity)
+        self.actual_quantity_g = to_grams(actual_quantity or 0)
+        self.loss_quantity_g = to_grams(loss_quantity or 0)
+        self.price = float(fen_to_yuan(self.price_fen))
+        self.quantity = float(grams_to_jin(self.quantity_g))
+        self.actual_quantity = float(grams_to_jin(self.actual_quantity_g))
+        self.loss_quantity = float(grams_to_jin(self.loss_quantity_g))
+
+    # 显示用的 元/斤 数值按定点列换算，旧的 price/quantity 等浮点列只为兼容保留
+    @property
+    def price_yuan(self):
+        return fen_to_yuan(self.price_fen or 0)
+
+    @property
+    def quantity_jin(self):
+        return grams_to_jin(self.quantity_g or 0)
+
+    @property
+    def actual_quantity_jin(self):
+        return grams_to_jin(self.actual_quantity_g or 0)
+
+    @property
+    def loss_quantity_jin(self):
+        return grams_to_jin(self.loss_quantity_g or 0)
+
+
+class ProductTombstone(db.Model):
+    """已删除记录的 sync_id，同步时通知另一端删除；同一个 sync_id 的记录恢复时删除"""
+    id = db.Column(db.Integer, primary_key=True)
+    sync_id = db.Column(db.String(32), nullable=False, unique=True)
+    store_id = store_column(foreign_key=False)
+    date = db.Column(db.DateTime, nullable=False)  # 被删除记录的日期，用于结账检查
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        # 同步拉取按 (deleted_at, id) 水位线增量读取
+        db.Index('ix_product_tombstone_deleted_at_id', 'deleted_at', 'id'),
+    )
+
+
+class ReorderSuggestion(db.Model):
+    """每晚预先计算的进货建议，批量进货页面据此预填数量"""
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = store_column(foreign_key=False)
+    target_date = db.Column(db.Date, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    forecast_g = db.Column(db.BigInteger, default=0)  # 预测销量，单位：克
+    loss_rate = db.Column(db.Float, default=0)
+    stock_g = db.Column(db.BigInteger, default=0)  # 计算时的库存，单位：克
+    suggested_g = db.Column(db.BigInteger, default=0)  # 建议进货量，单位：克
+    computed_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'target_date', 'name', name='unique_suggestion_day'),
+    )
+
+
+class LossWeekly(db.Model):
+    """按周、按商品累计的盘点损耗，由 losses.py 增量更新"""
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = store_column(foreign_key=False)
+    week_start = db.Column(db.Date, nullable=False)  # 当周周一
+    name = db.Column(db.String(100), nullable=False)
+    checks = db.Column(db.Integer, default=0)
+    loss_g = db.Column(db.BigInteger, default=0)
+    purchased_g = db.Column(db.BigInteger, default=0)  # 上次盘点以来的进货数量
+    loss_value_fen = db.Column(db.BigInteger, default=0)  # 按最近进货价计算的损耗金额
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'week_start', 'name', name='unique_loss_week'),
+    )
+
+
+class LossProgress(db.Model):
+    """损耗统计已处理到的最大盘点记录 id"""
+    id = db.Column(db.Integer, primary_key=True)
+    last_check_id = db.Column(db.Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(db.Model):
+    """已处理过的提交及其结果，用于识别重复提交"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, nullable=True)  # 同步接口没有登录用户
+    endpoint = db.Column(db.String(100), nullable=False)
+    status_code = db.Column(db.Integer, nullable=False)
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+
+class StockLevel(db.Model):
+    """每个商品的当前库存，销售时原子扣减，由 stock.py 维护"""
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = store_column(foreign_key=False)
+    name = db.Column(db.String(100), nullable=False)
+    quantity_g = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'name', name='unique_stock_level'),
+    )
+
+
+class LiveEvent(db.Model):
+    """推送给打开页面的汇总更新，只保留最近一段时间"""
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = store_column(foreign_key=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+
+class ChangeRecord(db.Model):
+    """Product/ProductPrice 的变更记录，与变更在同一个事务中写入，id 即序号"""
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = store_column(foreign_key=False)
+    entity = db.Column(db.String(30), nullable=False)  # product 或 product_price
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # insert/update/delete
+    before = db.Column(db.Text)  # 变更前的行(JSON)，insert 时为空
+    after = db.Column(db.Text)  # 变更后的行(JSON)，delete 时为空
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
+
+    __table_args__ = (
+        db.Index('ix_change_record_entity_id', 'entity', 'id'),
+    )
+
+
+class ChangeConsumer(db.Model):
+    """每个下游消费者已处理到的变更序号"""
+    name = db.Column(db.String(50), primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class Job(db.Model):
+    """后台任务（导出、导入、分析快照等），由 jobs.py 的 worker 进程执行"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    params = db.Column(db.Text)  # JSON
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued/running/done/failed
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 0-100
+    message = db.Column(db.String(500))
+    result = db.Column(db.Text)  # 任务返回的摘要(JSON)
+    result_path = db.Column(db.String(500))  # 生成的文件
+    result_name = db.Column(db.String(200))  # 下载时的文件名
+    user_id = db.Column(db.Integer, nullable=True)
+    store_id = store_column(foreign_key=False)
+    worker = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_job_status_id', 'status', 'id'),
+        db.Index('ix_job_user_id', 'user_id', 'id'),
+    )
+
+
+class DayClose(db.Model):
+    """日结：结账日期及之前的记录不能再修改，需要管理员重新开账"""
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = store_column(foreign_key=False)
+    day = db.Column(db.Date, nullable=False)
+    closed_by = db.Column(db.Integer, nullable=True)  # 用户 id
+    closed_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'day', name='unique_day_close'),
+    )
+
+
+class DailySummary(db.Model):
+    """结账时保存的当天汇总，字段与 reports.daily_summary 的汇总行一致（分、克）"""
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = store_column(foreign_key=False)
+    day = db.Column(db.Date, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    purchase_g = db.Column(db.BigInteger, nullable=False, default=0)
+    purchase_fen = db.Column(db.BigInteger, nullable=False, default=0)
+    sale_g = db.Column(db.BigInteger, nullable=False, default=0)
+    sale_fen = db.Column(db.BigInteger, nullable=False, default=0)
+    actual_g = db.Column(db.BigInteger, nullable=False, default=0)
+    loss_g = db.Column(db.BigInteger, nullable=False, default=0)
+    profit_fen = db.Column(db.BigInteger, nullable=False, default=0)
+    stock_g = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'day', 'name', name='unique_daily_summary'),
+    )
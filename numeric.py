@@ -0,0 +1,65 @@
+"""金额与数量的定点表示
+
+金额以整数“分”(fen) 存储，数量以整数“克”(g) 存储，单价按每斤计。
+    金额(分) = 单价(分/斤) × 数量(克) / 500
+汇总时先在 SQL 或 int64 数组里对 单价 × 克数 做整数求和，最后只做一次
+除以 500 的舍入，保证报表金额精确且与记录条数无关。
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# 1 斤 = 500 克
+GRAMS_PER_JIN = 500
+FEN_PER_YUAN = 100
+
+
+def parse_decimal(value):
+    """把表单输入转成 Decimal，格式错误时抛出 ValueError"""
+    try:
+        result = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'invalid number: {value!r}')
+    if not result.is_finite():
+        raise ValueError(f'invalid number: {value!r}')
+    return result
+
+
+def to_fen(yuan):
+    """元 -> 分（四舍五入）"""
+    if yuan is None:
+        return None
+    return int((parse_decimal(yuan) * FEN_PER_YUAN).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def to_grams(jin):
+    """斤 -> 克（四舍五入）"""
+    if jin is None:
+        return None
+    return int((parse_decimal(jin) * GRAMS_PER_JIN).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def fen_to_yuan(fen):
+    return Decimal(fen or 0) / FEN_PER_YUAN
+
+
+def grams_to_jin(grams):
+    return Decimal(grams or 0) / GRAMS_PER_JIN
+
+
+def fen_grams_to_fen(value):
+    """单价(分) × 克数 的累计值 -> 金额(分)，四舍五入"""
+    value = int(value or 0)
+    quotient, remainder = divmod(value, GRAMS_PER_JIN)
+    return quotient + (1 if remainder * 2 >= GRAMS_PER_JIN else 0)
+
+
+def amount_fen(price_fen, quantity_g):
+    return fen_grams_to_fen(price_fen * quantity_g)
+
+
+def total_amount_fen(prices_fen, quantities_g):
+    """对多条记录的金额做向量化求和，返回总金额(分)"""
+    import numpy as np
+
+    prices = np.asarray(prices_fen, dtype=np.int64)
+    quantities = np.asarray(quantities_g, dtype=np.int64)
+    return fen_grams_to_fen(int(np.dot(prices, quantities)))
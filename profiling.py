@@ -0,0 +1,306 @@
+"""请求性能分析
+
+管理员在请求上加 ?_profile=1 或请求头 X-Profile: 1 时，用 cProfile 分析这个请求；
+值为 sample 时改用采样分析（每 PROFILE_INTERVAL 秒记录一次请求线程的调用栈，
+开销小，结果是近似的）。PROFILE_SAMPLE_RATE 大于 0 时，所有用户的请求按这个比例
+随机做采样分析，用来发现线上哪些页面慢。
+
+同时记录请求内执行的每条 SQL 及耗时。报告以 JSON 保存在 PROFILE_DIR 下，只保留
+最近 PROFILE_KEEP 份，管理员在 /admin/profiles 查看，也可以下载 collapsed stack
+格式的文件，用 flamegraph.pl、speedscope 等工具生成火焰图。
+
+cProfile 只记录调用关系而不是完整的调用栈，导出的调用栈按调用关系和耗时比例
+推算，同一个函数从多处调用时是近似值；采样分析的调用栈是实际记录的。
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+PARAM = '_profile'
+HEADER = 'X-Profile'
+REPORT_ID = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+# 推算 cProfile 调用栈时的最大深度和最小耗时(微秒)，避免调用图展开过大
+MAX_DEPTH = 64
+MIN_US = 20
+
+# cProfile 在 Python 3.12 起同一进程只能有一个在运行，其他请求改用采样
+_cprofile_lock = threading.Lock()
+
+config = {'dir': 'profiles', 'sample_rate': 0.0, 'interval': 0.005, 'keep': 200}
+
+
+def _label(filename, line, name):
+    if filename == '~':
+        # 内置函数，如 {method 'execute' of 'sqlite3.Cursor' objects}
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+class Sampler:
+    """后台线程定时记录指定线程的调用栈"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_label(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+def collapsed_from_cprofile(profile):
+    """把 cProfile 的调用关系展开成 {调用栈: 微秒}"""
+    stats = pstats.Stats(profile).stats
+    children = defaultdict(list)
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            children[caller].append((func, edge[3]))
+    stacks = Counter()
+
+    def walk(func, seconds, path, seen):
+        tt, ct = stats[func][2], stats[func][3]
+        # 这条路径分到的时间占该函数总时间的比例
+        scale = seconds / ct if ct else 0
+        path = path + [_label(*func)]
+        self_us = tt * scale * 1e6
+        parts = []
+        for child, child_ct in children.get(func, ()):
+            if child in seen:
+                # 递归调用不再展开，计入本帧
+                self_us += child_ct * scale * 1e6
+            else:
+                parts.append((child, child_ct * scale))
+        # 递归调用的耗时会在调用关系中重复计算，子调用合计不超过本帧的时间
+        total_us = self_us + sum(child_seconds for _, child_seconds in parts) * 1e6
+        if total_us > seconds * 1e6 > 0:
+            factor = seconds * 1e6 / total_us
+            self_us *= factor
+            parts = [(child, child_seconds * factor) for child, child_seconds in parts]
+        for child, child_seconds in parts:
+            if child_seconds * 1e6 >= MIN_US and len(path) < MAX_DEPTH:
+                walk(child, child_seconds, path, seen | {child})
+            else:
+                # 不再展开的子调用（太短或超过深度）计入本帧，总时间保持不变
+                self_us += child_seconds * 1e6
+        if self_us >= 1:
+            stacks[';'.join(path)] += int(self_us)
+
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if not callers:
+            walk(func, ct, [], {func})
+    return stacks
+
+
+def _top_cprofile(profile, limit=40):
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {'function': _label(*func), 'calls': nc, 'self_ms': round(tt * 1000, 2), 'total_ms': round(ct * 1000, 2)}
+        for func, (cc, nc, tt, ct, callers) in rows
+    ]
+
+
+def _top_samples(stacks, interval, limit=40):
+    """按采样次数估算每个函数的自身耗时和总耗时"""
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return [
+        {'function': frame, 'calls': None, 'self_ms': round(own[frame] * interval * 1000, 2),
+         'total_ms': round(count * interval * 1000, 2)}
+        for frame, count in total.most_common(limit)
+    ]
+
+
+def _requested_mode():
+    value = request.args.get(PARAM) or request.headers.get(HEADER)
+    if value and current_user.is_authenticated and current_user.is_admin():
+        return 'sample' if value == 'sample' else 'cprofile'
+    return None
+
+
+def _start():
+    if request.endpoint in (None, 'static') or (request.endpoint or '').startswith('profile'):
+        return
+    mode, trigger = _requested_mode(), 'flag'
+    if mode is None:
+        if not config['sample_rate'] or random.random() >= config['sample_rate']:
+            return
+        mode, trigger = 'sample', 'sample'
+    if mode == 'cprofile' and not _cprofile_lock.acquire(blocking=False):
+        mode = 'sample'
+
+    state = {'mode': mode, 'trigger': trigger, 'sql': [], 'started': time.perf_counter()}
+    if mode == 'cprofile':
+        state['profiler'] = cProfile.Profile()
+        state['profiler'].enable()
+    else:
+        state['sampler'] = Sampler(threading.get_ident(), config['interval'])
+        state['sampler'].start()
+    g.profile = state
+
+
+def _stop(state):
+    state['duration'] = time.perf_counter() - state['started']
+    if state['mode'] == 'cprofile':
+        state['profiler'].disable()
+        _cprofile_lock.release()
+    else:
+        state['sampler'].stop()
+
+
+def _finish(response):
+    state = g.pop('profile', None)
+    if state is None:
+        return response
+    _stop(state)
+    try:
+        report_id = save_report(state, response.status_code)
+        response.headers['X-Profile-Id'] = report_id
+    except Exception:
+        logger.exception("Saving profile for %s failed", request.path)
+    return response
+
+
+def _cleanup(exc):
+    # 请求异常结束、没有经过 after_request 时停止分析器
+    state = g.pop('profile', None)
+    if state is not None:
+        _stop(state)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profile' in g:
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profile' in g and conn.info.get('profile_started'):
+        elapsed = time.perf_counter() - conn.info['profile_started'].pop()
+        # 只记录语句和耗时，不保存参数
+        g.profile['sql'].append({'statement': statement[:2000], 'ms': round(elapsed * 1000, 3),
+                                 'rows': cursor.rowcount, 'many': executemany})
+
+
+def save_report(state, status):
+    if state['mode'] == 'cprofile':
+        stacks, unit = collapsed_from_cprofile(state['profiler']), 'us'
+        top = _top_cprofile(state['profiler'])
+    else:
+        stacks, unit = state['sampler'].stacks, 'samples'
+        top = _top_samples(stacks, config['interval'])
+
+    now = datetime.now()
+    report_id = f'{now:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}'
+    report = {
+        'id': report_id,
+        'created_at': now.isoformat(),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'user': current_user.username if current_user.is_authenticated else None,
+        'status': status,
+        'mode': state['mode'],
+        'trigger': state['trigger'],
+        'duration_ms': round(state['duration'] * 1000, 2),
+        'sql_count': len(state['sql']),
+        'sql_ms': round(sum(row['ms'] for row in state['sql']), 3),
+        'sql': state['sql'],
+        'top': top,
+        'unit': unit,
+        'interval': config['interval'] if unit == 'samples' else None,
+        'stacks': dict(stacks),
+    }
+    os.makedirs(config['dir'], exist_ok=True)
+    path = os.path.join(config['dir'], f'{report_id}.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    _prune()
+    return report_id
+
+
+def _prune():
+    names = sorted(name for name in os.listdir(config['dir']) if name.endswith('.json'))
+    for name in names[:-config['keep']] if config['keep'] > 0 else []:
+        try:
+            os.remove(os.path.join(config['dir'], name))
+        except FileNotFoundError:
+            pass
+
+
+def load_report(report_id):
+    """读取报告，id 不合法或不存在时返回 None"""
+    if not REPORT_ID.match(report_id):
+        return None
+    path = os.path.join(config['dir'], f'{report_id}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def list_reports(limit=200):
+    """最近的报告摘要，新的在前"""
+    if not os.path.isdir(config['dir']):
+        return []
+    names = sorted((name for name in os.listdir(config['dir']) if name.endswith('.json')), reverse=True)[:limit]
+    summaries = []
+    for name in names:
+        report = load_report(name[:-5])
+        if report is not None:
+            summaries.append({key: value for key, value in report.items() if key not in ('sql', 'top', 'stacks')})
+    return summaries
+
+
+def collapsed(report):
+    """flamegraph.pl / speedscope 使用的 collapsed stack 文本：每行 `栈;帧 数值`"""
+    return ''.join(f'{stack} {value}\n' for stack, value in sorted(report['stacks'].items()))
+
+
+def init_app(app):
+    config.update(dir=app.config['PROFILE_DIR'], sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                  interval=app.config['PROFILE_INTERVAL'], keep=app.config['PROFILE_KEEP'])
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_cleanup)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
@@ -0,0 +1,153 @@
+"""每日进销存汇总
+
+首页和库存页共用。所有求和都在 SQL 中以整数（分、克）完成，
+Python 端只做一次单位换算，不再逐条累加浮点数。
+库存以当天结束时为准，从最近一次盘点开始计算（见 stock.stock_as_of）。
+"""
+from datetime import datetime
+
+from sqlalchemy import select, func, case
+
+import stock
+from models import VEGETABLES, DEFAULT_STORE_ID, Product, Store
+from numeric import fen_grams_to_fen, fen_to_yuan, grams_to_jin
+
+
+def day_bounds(day):
+    return datetime.combine(day, datetime.min.time()), datetime.combine(day, datetime.max.time())
+
+
+def _divide_round(numerator, denominator):
+    quotient, remainder = divmod(numerator, denominator)
+    return quotient + (1 if remainder * 2 >= denominator else 0)
+
+
+def empty_row():
+    return {
+        'purchase_g': 0,
+        'purchase_fen': 0,
+        'sale_g': 0,
+        'sale_fen': 0,
+        'actual_g': 0,
+        'loss_g': 0,
+        'profit_fen': 0,
+        'stock_g': 0
+    }
+
+
+def daily_summary(session, day, names=VEGETABLES, store_id=DEFAULT_STORE_ID):
+    """返回 {商品名: 汇总行}，汇总行中的金额单位为分，数量单位为克"""
+    start_date, end_date = day_bounds(day)
+    summary = {name: empty_row() for name in names}
+
+    # 当天进货和销售
+    stmt = select(
+        Product.name,
+        Product.type,
+        func.coalesce(func.sum(Product.quantity_g), 0),
+        func.coalesce(func.sum(Product.price_fen * Product.quantity_g), 0)
+    ).where(
+        Product.store_id == store_id,
+        Product.date >= start_date,
+        Product.date <= end_date,
+        Product.type.in_(['purchase', 'sale']),
+        Product.name.in_(names)
+    ).group_by(Product.name, Product.type)
+    for name, type, quantity_g, fen_grams in session.execute(stmt):
+        row = summary[name]
+        if type == 'purchase':
+            row['purchase_g'] = int(quantity_g)
+            row['purchase_fen'] = fen_grams_to_fen(fen_grams)
+        else:
+            row['sale_g'] = int(quantity_g)
+            row['sale_fen'] = fen_grams_to_fen(fen_grams)
+
+    # 当天结束时的库存：最近一次盘点的实际数量加上盘点之后的进出
+    for name, stock_g in stock.stock_as_of(session, names, end_date, store_id).items():
+        summary[name]['stock_g'] = stock_g
+
+    # 当天的盘点：显示最后一次盘点的实际数量和损耗
+    checks = session.execute(
+        select(Product.name, Product.actual_quantity_g, Product.loss_quantity_g).where(
+            Product.store_id == store_id,
+            Product.date >= start_date,
+            Product.date <= end_date,
+            Product.type == 'inventory_check',
+            Product.name.in_(names)
+        ).order_by(Product.date, Product.id)
+    )
+    for name, actual_g, loss_g in checks:
+        summary[name]['actual_g'] = int(actual_g or 0)
+        summary[name]['loss_g'] = int(loss_g or 0)
+
+    # 利润 = 销售金额 - 按当天平均进货价计算的成本；当天没有进货时无法计算，记为 0
+    for row in summary.values():
+        if row['purchase_g'] > 0:
+            cost_fen = _divide_round(row['purchase_fen'] * row['sale_g'], row['purchase_g'])
+            row['profit_fen'] = row['sale_fen'] - cost_fen
+
+    return summary
+
+
+def to_display(summary):
+    """换算成页面使用的 元/斤，字段名与原来的 inventory_data 一致"""
+    return {
+        name: {
+            'purchase_quantity': grams_to_jin(row['purchase_g']),
+            'purchase_amount': fen_to_yuan(row['purchase_fen']),
+            'sale_quantity': grams_to_jin(row['sale_g']),
+            'sale_amount': fen_to_yuan(row['sale_fen']),
+            'actual_quantity': grams_to_jin(row['actual_g']),
+            'loss_quantity': grams_to_jin(row['loss_g']),
+            'profit': fen_to_yuan(row['profit_fen']),
+            'current_stock': grams_to_jin(row['stock_g'])
+        }
+        for name, row in summary.items()
+    }
+
+
+def totals(summary):
+    """返回 (进货总额, 销售总额, 总利润)，单位：元"""
+    return (
+        fen_to_yuan(sum(row['purchase_fen'] for row in summary.values())),
+        fen_to_yuan(sum(row['sale_fen'] for row in summary.values())),
+        fen_to_yuan(sum(row['profit_fen'] for row in summary.values()))
+    )
+
+
+def store_rollup(session, start, end):
+    """各门店在 [start, end] 内按商品汇总的进货、销售和损耗，全部在 SQL 中聚合
+
+    返回列表，每项为 {store_id, store, name, purchase_g, purchase_fen, sale_g, sale_fen, loss_g}。
+    """
+    def total(type, column):
+        return func.coalesce(func.sum(case((Product.type == type, column), else_=0)), 0)
+
+    stmt = select(
+        Product.store_id,
+        Store.name,
+        Product.name,
+        total('purchase', Product.quantity_g),
+        total('purchase', Product.price_fen * Product.quantity_g),
+        total('sale', Product.quantity_g),
+        total('sale', Product.price_fen * Product.quantity_g),
+        total('inventory_check', Product.loss_quantity_g)
+    ).join(Store, Store.id == Product.store_id).where(
+        Product.date >= start,
+        Product.date <= end
+    ).group_by(Product.store_id, Store.name, Product.name).order_by(Product.store_id, Product.name)
+
+    return [
+        {
+            'store_id': store_id,
+            'store': store_name,
+            'name': name,
+            'purchase_g': int(purchase_g),
+            'purchase_fen': fen_grams_to_fen(purchase_fen_grams),
+            'sale_g': int(sale_g),
+            'sale_fen': fen_grams_to_fen(sale_fen_grams),
+            'loss_g': int(loss_g)
+        }
+        for store_id, store_name, name, purchase_g, purchase_fen_grams, sale_g, sale_fen_grams, loss_g
+        in session.execute(stmt)
+    ]
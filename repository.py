@@ -0,0 +1,137 @@
+"""进销存数据访问层
+
+网页端 (app.py) 和桌面端 (main.py) 都通过这里读写 Product / ProductPrice，
+所有函数都接收一个 SQLAlchemy session：网页端传 db.session，桌面端传
+open_session() 创建的本地 session。函数只负责 add，不负责 commit。
+
+数据按门店隔离，函数都带 store_id 参数，默认为 DEFAULT_STORE_ID。
+"""
+from datetime import datetime
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+import stock
+from models import db, DEFAULT_STORE_ID, Product, ProductPrice
+from numeric import grams_to_jin
+
+
+def open_session(database_url):
+    """在 Flask 应用之外打开一个使用同一套模型的 session（桌面端使用）"""
+    engine = create_engine(database_url)
+    db.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def add_record(session, name, type, price, quantity, date=None, notes='',
+               actual_quantity=0, loss_quantity=0, check_stock=False, store_id=DEFAULT_STORE_ID):
+    """新增一条记录并更新实时库存
+
+    check_stock=True 时销售数量超过库存会抛出 stock.InsufficientStock。
+    """
+    product = Product(
+        store_id=store_id,
+        name=name,
+        type=type,
+        date=date or datetime.now(),
+        notes=notes
+    )
+    product.set_amounts(price, quantity, actual_quantity, loss_quantity)
+    stock.record_added(session, product, check_stock)
+    session.add(product)
+    return product
+
+
+def list_records(session, type=None, start_date=None, end_date=None, store_id=DEFAULT_STORE_ID):
+    query = session.query(Product).filter(Product.store_id == store_id)
+    if type:
+        query = query.filter(Product.type == type)
+    if start_date:
+        query = query.filter(Product.date >= start_date)
+    if end_date:
+        query = query.filter(Product.date <= end_date)
+    return query.order_by(Product.date.desc(), Product.id.desc()).all()
+
+
+def get_records(session, ids, store_id=DEFAULT_STORE_ID):
+    return session.query(Product).filter(Product.store_id == store_id, Product.id.in_(ids)).all()
+
+
+def encode_cursor(product):
+    return f"{product.date.isoformat()}_{product.id}"
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误时抛出 ValueError"""
+    date_str, id_str = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(date_str), int(id_str)
+
+
+def page_records(session, start_date=None, end_date=None, type=None, name=None, search=None,
+                 cursor=None, limit=50, store_id=DEFAULT_STORE_ID):
+    """按 (date, id) 倒序分页查询记录，返回 (记录列表, 下一页游标)
+
+    使用 keyset 分页：下一页从上一页最后一条记录之后开始，
+    翻页成本与页码无关。
+    """
+    query = session.query(Product).filter(Product.store_id == store_id)
+    if start_date:
+        query = query.filter(Product.date >= start_date)
+    if end_date:
+        query = query.filter(Product.date <= end_date)
+    if type:
+        query = query.filter(Product.type == type)
+    if name:
+        query = query.filter(Product.name == name)
+    if search:
+        query = query.filter(Product.notes.contains(search, autoescape=True))
+    if cursor:
+        date, id = decode_cursor(cursor)
+        query = query.filter((Product.date < date) | ((Product.date == date) & (Product.id < id)))
+
+    products = query.order_by(Product.date.desc(), Product.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(products[limit - 1]) if len(products) > limit else None
+    return products[:limit], next_cursor
+
+
+def record_to_json(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'type': product.type,
+        'price': float(product.price_yuan),
+        'quantity': float(product.quantity_jin),
+        'actual_quantity': float(product.actual_quantity_jin),
+        'loss_quantity': float(product.loss_quantity_jin),
+        'date': product.date.strftime('%Y-%m-%d %H:%M:%S'),
+        'notes': product.notes
+    }
+
+
+def get_sale_price(session, name, at=None, store_id=DEFAULT_STORE_ID):
+    """返回商品在指定时间有效的销售价格记录"""
+    at = at or datetime.now()
+    return session.query(ProductPrice).filter(
+        ProductPrice.store_id == store_id,
+        ProductPrice.name == name,
+        ProductPrice.start_date <= at,
+        (ProductPrice.end_date == None) | (ProductPrice.end_date > at)
+    ).order_by(ProductPrice.start_date.desc()).first()
+
+
+def latest_purchase(session, name, store_id=DEFAULT_STORE_ID):
+    return session.query(Product).filter(
+        Product.store_id == store_id,
+        Product.name == name,
+        Product.type == 'purchase'
+    ).order_by(Product.date.desc(), Product.id.desc()).first()
+
+
+def stock_by_name(session, names=None, until=None, store_id=DEFAULT_STORE_ID):
+    """按商品计算库存（最近一次盘点 + 之后的进货 - 销售），返回 {name: 数量(斤, Decimal)}"""
+    if names is None:
+        names = [name for (name,) in session.execute(
+            select(Product.name).where(Product.store_id == store_id).distinct()
+        )]
+    levels = stock.stock_as_of(session, list(names), until, store_id)
+    return {name: grams_to_jin(quantity_g) for name, quantity_g in levels.items()}
@@ -1,14 +1,21 @@
+import atexit
+import os
+
+# 日志由 logging_setup 在导入 app 时配置：输出到 stdout，并写入 logs/production.log
+# （可用 LOG_FILE 修改，LOG_FILE 为空时只输出到 stdout）
+os.environ.setdefault('LOG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'production.log'))
+
 from waitress import serve
 from app import app
-import logging
-
-# 配置日志
-logging.basicConfig(
-    filename='logs/production.log',
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s: %(message)s'
-)
+import jobs
+import warmup
 
 if __name__ == '__main__':
+    # 后台任务（导出、导入等）在单独的进程中执行
+    if app.config['JOB_WORKER_EMBEDDED']:
+        worker = jobs.start_worker_process()
+        atexit.register(worker.terminate)
+    # 启动前建立数据库连接、编译模板、读取价格和当天汇总
+    warmup.warm(app)
     print("Starting production server on http://127.0.0.1:5000")
     serve(app, host='127.0.0.1', port=5000, threads=4) 
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""分析快照的月度销售汇总
+
+后台任务导出分析快照 (analytics.export_snapshot) 时，按 (月份, 门店, 商品) 汇总
+销售数量(克)和 单价×数量(分·克)，保存为 ANALYTICS_DIR/sales_summary.json。
+网页端的 /api/analytics/* 只读取这个文件，在 Python 中筛选、合计，不加载
+pandas 和 pyarrow，gunicorn worker 不会因为这些报表多占内存。
+
+数据截止到最近一次导出分析快照的时间。
+"""
+import json
+import os
+
+from numeric import fen_grams_to_fen
+
+FILENAME = 'sales_summary.json'
+
+# 每行的字段：月份 (YYYY-MM)、门店、商品、销售数量(克)、单价×数量(分·克)
+COLUMNS = ['month', 'store_id', 'name', 'quantity_g', 'fen_grams']
+
+
+def path(base_dir):
+    return os.path.join(base_dir, FILENAME)
+
+
+def save(base_dir, rows, exported_at):
+    """rows 为按 COLUMNS 顺序的元组；先写临时文件再替换，读取方不会读到一半的文件"""
+    os.makedirs(base_dir, exist_ok=True)
+    target = path(base_dir)
+    tmp_path = target + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'exported_at': exported_at, 'columns': COLUMNS, 'rows': [list(row) for row in rows]},
+                  f, ensure_ascii=False)
+    os.replace(tmp_path, target)
+
+
+def load(base_dir):
+    """返回汇总行 (dict) 列表；还没有导出过分析快照时返回空列表"""
+    try:
+        with open(path(base_dir), encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return []
+    return [dict(zip(data['columns'], row)) for row in data['rows']]
+
+
+def monthly_sales(base_dir, start=None, end=None, names=None, store_id=None):
+    """按月、按商品的销售数量(克)和销售额(分)，start/end 为月份 (YYYY-MM)；store_id 为 None 时合计所有门店"""
+    totals = {}
+    for row in load(base_dir):
+        if start is not None and row['month'] < start:
+            continue
+        if end is not None and row['month'] > end:
+            continue
+        if names and row['name'] not in names:
+            continue
+        if store_id is not None and row['store_id'] != store_id:
+            continue
+        total = totals.setdefault((row['month'], row['name']), [0, 0])
+        total[0] += row['quantity_g']
+        total[1] += row['fen_grams']
+    return [
+        {'month': month, 'name': name, 'quantity_g': quantity_g, 'amount_fen': fen_grams_to_fen(fen_grams)}
+        for (month, name), (quantity_g, fen_grams) in sorted(totals.items())
+    ]
+
+
+def year_over_year(base_dir, year, names=None):
+    """year 与上一年逐月销售额对比，字段为 month, name, quantity_g, amount_fen, last_year_fen"""
+    sales = monthly_sales(base_dir, f'{year - 1}-01', f'{year}-12', names)
+    merged = {}
+    for row in sales:
+        last_year = row['month'].startswith(str(year - 1))
+        month = f"{year}{row['month'][4:]}"
+        item = merged.setdefault((month, row['name']), {
+            'month': month, 'name': row['name'], 'quantity_g': 0, 'amount_fen': 0, 'last_year_fen': 0
+        })
+        if last_year:
+            item['last_year_fen'] = row['amount_fen']
+        else:
+            item.update(quantity_g=row['quantity_g'], amount_fen=row['amount_fen'])
+    return [merged[key] for key in sorted(merged)]
@@ -0,0 +1,32 @@
+// 防止重复提交
+//
+// 用法：在需要保护的表单上加 data-idempotent，例如 batch_operation.html 中
+//   <form method="post" data-idempotent>
+// 页面加载时为表单生成一个幂等键放在隐藏字段 idempotency_key 中，
+// 连点或网络重试都会带上同一个键，服务端只处理第一次。
+// 提交后禁用提交按钮，服务端出错返回页面时会重新生成新的键。
+(function () {
+    function newKey() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID().replace(/-/g, '');
+        }
+        return Date.now().toString(16) + Math.random().toString(16).slice(2);
+    }
+
+    document.querySelectorAll('form[data-idempotent]').forEach(function (form) {
+        var input = form.querySelector('input[name="idempotency_key"]');
+        if (!input) {
+            input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = 'idempotency_key';
+            form.appendChild(input);
+        }
+        input.value = newKey();
+
+        form.addEventListener('submit', function () {
+            form.querySelectorAll('button[type="submit"], input[type="submit"]').forEach(function (button) {
+                button.disabled = true;
+            });
+        });
+    });
+})();
@@ -0,0 +1,50 @@
+// 首页/库存页汇总表的实时更新
+//
+// 用法：在汇总表上加
+//   <table id="summary-table"
+//          data-events-url="{{ url_for('events') }}"
+//          data-date="{{ date.strftime('%Y-%m-%d') }}">
+// 每个商品一行 <tr data-product="{{ vegetable }}">，需要更新的单元格加
+// data-field，取值与 inventory_data 的字段相同：purchase_quantity、
+// purchase_amount、sale_quantity、sale_amount、actual_quantity、
+// loss_quantity、profit、current_stock。
+// 只有事件日期与页面日期相同时才更新，更新的行短暂加上 table-warning 高亮。
+(function () {
+    var table = document.getElementById('summary-table');
+    if (!table || !window.EventSource) {
+        return;
+    }
+
+    function formatValue(value) {
+        var number = Number(value);
+        return isNaN(number) ? value : number.toFixed(2);
+    }
+
+    function patchRow(name, fields) {
+        var row = table.querySelector('tr[data-product="' + CSS.escape(name) + '"]');
+        if (!row) {
+            return;
+        }
+        Object.keys(fields).forEach(function (field) {
+            var cell = row.querySelector('[data-field="' + field + '"]');
+            if (cell) {
+                cell.textContent = formatValue(fields[field]);
+            }
+        });
+        row.classList.add('table-warning');
+        setTimeout(function () {
+            row.classList.remove('table-warning');
+        }, 2000);
+    }
+
+    var source = new EventSource(table.dataset.eventsUrl);
+    source.addEventListener('summary', function (event) {
+        var data = JSON.parse(event.data);
+        if (data.date !== table.dataset.date) {
+            return;
+        }
+        Object.keys(data.products).forEach(function (name) {
+            patchRow(name, data.products[name]);
+        });
+    });
+})();
@@ -0,0 +1,81 @@
+// 首页详细记录按需加载
+//
+// 用法：在 index.html 的记录表格上加
+//   <table id="records-table"
+//          data-records-url="{{ url_for('api_records') }}"
+//          data-date="{{ date.strftime('%Y-%m-%d') }}"
+//          data-next-cursor="{{ next_cursor or '' }}">
+// 并在表格下方放一个 <button id="records-more">加载更多</button>，
+// 筛选表单 #records-filter 中的 type / name / q 字段变化时会重新加载。
+(function () {
+    var table = document.getElementById('records-table');
+    if (!table) {
+        return;
+    }
+    var tbody = table.querySelector('tbody');
+    var moreButton = document.getElementById('records-more');
+    var filterForm = document.getElementById('records-filter');
+    var nextCursor = table.dataset.nextCursor || null;
+    var typeNames = {purchase: '进货', sale: '销售', inventory_check: '盘点'};
+
+    function buildUrl(cursor) {
+        var params = new URLSearchParams({date: table.dataset.date});
+        if (filterForm) {
+            new FormData(filterForm).forEach(function (value, key) {
+                if (value) {
+                    params.set(key, value);
+                }
+            });
+        }
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        return table.dataset.recordsUrl + '?' + params.toString();
+    }
+
+    function renderRow(record) {
+        var row = document.createElement('tr');
+        [record.date, record.name, typeNames[record.type] || record.type,
+         record.price, record.quantity, record.notes || ''].forEach(function (value) {
+            var cell = document.createElement('td');
+            cell.textContent = value;
+            row.appendChild(cell);
+        });
+        return row;
+    }
+
+    function load(cursor) {
+        return fetch(buildUrl(cursor), {credentials: 'same-origin'})
+            .then(function (resp) { return resp.json(); })
+            .then(function (data) {
+                if (!cursor) {
+                    tbody.innerHTML = '';
+                }
+                data.records.forEach(function (record) {
+                    tbody.appendChild(renderRow(record));
+                });
+                nextCursor = data.next_cursor;
+                if (moreButton) {
+                    moreButton.hidden = !nextCursor;
+                }
+            });
+    }
+
+    if (moreButton) {
+        moreButton.hidden = !nextCursor;
+        moreButton.addEventListener('click', function () {
+            if (nextCursor) {
+                load(nextCursor);
+            }
+        });
+    }
+    if (filterForm) {
+        filterForm.addEventListener('change', function () {
+            load(null);
+        });
+        filterForm.addEventListener('submit', function (event) {
+            event.preventDefault();
+            load(null);
+        });
+    }
+})();
@@ -0,0 +1,208 @@
+"""实时库存与销售扣减
+
+stock_level 表按门店、商品保存当前库存(克)，销售时用一条带条件的 UPDATE 扣减：
+
+    UPDATE stock_level SET quantity_g = quantity_g - :q
+    WHERE store_id = :store_id AND name = :name AND quantity_g >= :q
+
+库存不足时不更新任何行，整个检查和扣减由数据库原子完成。多个 gunicorn
+worker 或多个桌面端同时卖同一个商品也不会超卖：Postgres 上第二个事务会
+等待第一个事务释放行锁后重新判断条件，SQLite 上写事务本身是串行的。
+
+库存的定义：最近一次盘点的实际数量 + 盘点之后的进货 - 盘点之后的销售。
+盘点是可信的检查点，stock_as_of() 按同样的定义计算任意日期的库存，只累加
+检查点之后的记录，计算量与上次盘点以来的进出数量有关，与历史总长度无关。
+新增进货/销售时增量更新；盘点、修改、删除和同步合并的记录改变了历史，
+对涉及的商品调用 rebuild() 重新计算。某个商品还没有库存行时会先按上述
+定义从记录中算出来。
+"""
+from datetime import datetime
+
+from sqlalchemy import select, func, case, update, insert, union_all
+
+from models import DEFAULT_STORE_ID, Product, StockLevel
+
+
+class InsufficientStock(Exception):
+    def __init__(self, name, requested_g, available_g):
+        super().__init__(f'{name}: 库存不足')
+        self.name = name
+        self.requested_g = requested_g
+        self.available_g = available_g
+
+
+def _signed_quantity():
+    return case(
+        (Product.type == 'purchase', Product.quantity_g),
+        (Product.type == 'sale', -Product.quantity_g),
+        else_=0
+    )
+
+
+def latest_check(session, name, store_id=DEFAULT_STORE_ID):
+    return session.query(Product).filter(
+        Product.store_id == store_id,
+        Product.name == name,
+        Product.type == 'inventory_check'
+    ).order_by(Product.date.desc(), Product.id.desc()).first()
+
+
+def checkpoints(session, names, until=None, store_id=DEFAULT_STORE_ID):
+    """每个商品在 until 之前（含）最近一次盘点，返回 {商品名: (日期, id, 实际数量(克))}
+
+    每个商品一个按 (store_id, name, type, date) 索引倒序取一条的子查询，
+    用 UNION ALL 合并成一条语句。
+    """
+    latest = []
+    for name in names:
+        stmt = select(Product.name, Product.date, Product.id, Product.actual_quantity_g).where(
+            Product.store_id == store_id,
+            Product.name == name,
+            Product.type == 'inventory_check'
+        )
+        if until is not None:
+            stmt = stmt.where(Product.date <= until)
+        latest.append(select(stmt.order_by(Product.date.desc(), Product.id.desc()).limit(1).subquery()))
+    if not latest:
+        return {}
+    rows = session.execute(union_all(*latest))
+    return {name: (date, id, actual_g or 0) for name, date, id, actual_g in rows}
+
+
+def stock_as_of(session, names, until=None, store_id=DEFAULT_STORE_ID):
+    """until 时刻（含）的库存，返回 {商品名: 库存(克)}；until 为 None 时计算当前库存
+
+    只累加每个商品最近一次盘点之后的进货和销售，每个商品是一段索引范围扫描。
+    """
+    if not names:
+        return {}
+    anchors = checkpoints(session, names, until, store_id)
+    movements = []
+    for name in names:
+        stmt = select(Product.name, func.coalesce(func.sum(_signed_quantity()), 0)).where(
+            Product.store_id == store_id,
+            Product.name == name,
+            Product.type.in_(['purchase', 'sale'])
+        ).group_by(Product.name)
+        if name in anchors:
+            check_date, check_id, _ = anchors[name]
+            # 同一天在盘点之前录入的记录已经包含在盘点数量中
+            stmt = stmt.where(Product.date >= check_date, (Product.date > check_date) | (Product.id > check_id))
+        if until is not None:
+            stmt = stmt.where(Product.date <= until)
+        movements.append(stmt)
+
+    levels = {name: anchors[name][2] if name in anchors else 0 for name in names}
+    for name, quantity_g in session.execute(union_all(*movements)):
+        levels[name] += int(quantity_g)
+    return levels
+
+
+def compute_level(session, name, store_id=DEFAULT_STORE_ID):
+    """按记录重新计算库存(克)"""
+    return stock_as_of(session, [name], store_id=store_id)[name]
+
+
+def _level(store_id, name):
+    return (StockLevel.store_id == store_id) & (StockLevel.name == name)
+
+
+def _insert_if_missing(session, store_id, name, quantity_g):
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    values = {'store_id': store_id, 'name': name, 'quantity_g': quantity_g, 'updated_at': datetime.now()}
+    if dialect_insert is None:
+        if session.execute(select(StockLevel.id).where(_level(store_id, name))).first() is None:
+            session.execute(insert(StockLevel).values(**values))
+        return
+    # 多个进程同时初始化同一个商品时只保留第一个插入的行
+    session.execute(
+        dialect_insert(StockLevel).values(**values).on_conflict_do_nothing(index_elements=['store_id', 'name'])
+    )
+
+
+def ensure_level(session, name, store_id=DEFAULT_STORE_ID):
+    """商品没有库存行时按记录初始化"""
+    if session.execute(select(StockLevel.id).where(_level(store_id, name))).first() is not None:
+        return
+    with session.no_autoflush:
+        quantity_g = compute_level(session, name, store_id)
+    _insert_if_missing(session, store_id, name, quantity_g)
+
+
+def rebuild(session, names, store_id=DEFAULT_STORE_ID):
+    """按记录重新计算指定商品的库存；调用方负责 commit"""
+    session.flush()
+    for name in set(names):
+        quantity_g = compute_level(session, name, store_id)
+        result = session.execute(
+            update(StockLevel).where(_level(store_id, name))
+            .values(quantity_g=quantity_g, updated_at=datetime.now())
+        )
+        if result.rowcount == 0:
+            _insert_if_missing(session, store_id, name, quantity_g)
+
+
+def adjust(session, name, delta_g, store_id=DEFAULT_STORE_ID):
+    ensure_level(session, name, store_id)
+    session.execute(
+        update(StockLevel).where(_level(store_id, name))
+        .values(quantity_g=StockLevel.quantity_g + delta_g, updated_at=datetime.now())
+    )
+
+
+def reserve(session, name, quantity_g, store_id=DEFAULT_STORE_ID):
+    """原子扣减库存，不足时抛出 InsufficientStock，不做任何修改"""
+    ensure_level(session, name, store_id)
+    result = session.execute(
+        update(StockLevel)
+        .where(_level(store_id, name), StockLevel.quantity_g >= quantity_g)
+        .values(quantity_g=StockLevel.quantity_g - quantity_g, updated_at=datetime.now())
+    )
+    if result.rowcount != 1:
+        available_g = session.execute(
+            select(StockLevel.quantity_g).where(_level(store_id, name))
+        ).scalar()
+        raise InsufficientStock(name, quantity_g, available_g or 0)
+
+
+def record_added(session, product, check_stock=False):
+    """新记录加入 session 前调用，更新库存
+
+    check_stock=True 时销售记录先扣减库存，不足时抛出 InsufficientStock。
+    """
+    store_id = product.store_id
+    if product.type == 'inventory_check':
+        session.add(product)
+        rebuild(session, [product.name], store_id)
+        return
+
+    with session.no_autoflush:
+        check = latest_check(session, product.name, store_id)
+    # 日期早于最近一次盘点的补录记录已经包含在盘点数量中
+    if check is not None and product.date < check.date:
+        return
+
+    if product.type == 'sale' and check_stock:
+        reserve(session, product.name, product.quantity_g, store_id)
+    elif product.type == 'sale':
+        adjust(session, product.name, -product.quantity_g, store_id)
+    elif product.type == 'purchase':
+        adjust(session, product.name, product.quantity_g, store_id)
+
+
+def levels(session, names, store_id=DEFAULT_STORE_ID):
+    """返回 {商品名: 当前库存(克)}"""
+    for name in names:
+        ensure_level(session, name, store_id)
+    rows = session.execute(
+        select(StockLevel.name, StockLevel.quantity_g)
+        .where(StockLevel.store_id == store_id, StockLevel.name.in_(names))
+    )
+    return {name: quantity_g for name, quantity_g in rows}
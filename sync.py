@@ -0,0 +1,351 @@
+"""桌面端离线优先同步
+
+桌面端的每次写入都会在同一个本地事务里登记到 sync_outbox，联网时按批推送到
+网页端的 /api/sync/push；再以 updated_at 水位线从 /api/sync/pull 拉取增量。
+两端通过 Product.sync_id 识别同一条记录，冲突时以 updated_at 较新的一方为准。
+每台桌面端属于一个门店（环境变量 STORE_ID），只拉取本门店的记录。
+
+删除记录时在同一个事务里写入 product_tombstone（两端都由 session 的 flush 事件
+写入），推送和拉取时作为 deleted=True 的记录传给另一端，以删除时间参与同样的
+updated_at 比较：删除之后才修改的记录会恢复，修改之后的删除会删掉记录。
+"""
+import hashlib
+import json
+import logging
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, delete, event, select
+from sqlalchemy.orm import Session, declarative_base
+
+import stock
+from models import DEFAULT_STORE_ID, Product, ProductTombstone
+from numeric import fen_to_yuan, grams_to_jin
+
+logger = logging.getLogger(__name__)
+
+# 仅存在于桌面端本地数据库的表，不进入网页端的 db.metadata
+LocalBase = declarative_base()
+
+SYNC_FIELDS = ['name', 'type', 'notes']
+# 金额和数量以定点整数传输，避免两端浮点误差
+AMOUNT_FIELDS = ['price_fen', 'quantity_g', 'actual_quantity_g', 'loss_quantity_g']
+
+
+class SyncOutbox(LocalBase):
+    __tablename__ = 'sync_outbox'
+    id = Column(Integer, primary_key=True)
+    sync_id = Column(String(32), nullable=False, unique=True)
+
+
+class SyncState(LocalBase):
+    __tablename__ = 'sync_state'
+    key = Column(String(50), primary_key=True)
+    value = Column(String(100))
+
+
+def _add_tombstones(session, flush_context, instances):
+    # 删除的记录在同一次 flush 中写入 tombstone；在 flush 之前读取列值，删除之后不能再加载
+    deleted = [obj for obj in session.deleted if isinstance(obj, Product) and obj.sync_id]
+    if not deleted:
+        return
+    sync_ids = [product.sync_id for product in deleted]
+    session.execute(delete(ProductTombstone).where(ProductTombstone.sync_id.in_(sync_ids)))
+    now = datetime.now()
+    session.add_all(
+        ProductTombstone(sync_id=product.sync_id, store_id=product.store_id, date=product.date, deleted_at=now)
+        for product in deleted
+    )
+
+
+event.listen(Session, 'before_flush', _add_tombstones)
+
+
+def record_to_dict(product):
+    """Product 或 ProductTombstone 转为同步传输的格式，删除的记录只带 sync_id、门店、日期和删除时间"""
+    if isinstance(product, ProductTombstone):
+        return {
+            'sync_id': product.sync_id,
+            'store_id': product.store_id,
+            'date': product.date.isoformat(),
+            'updated_at': product.deleted_at.isoformat(),
+            'deleted': True,
+        }
+    data = {field: getattr(product, field) for field in SYNC_FIELDS + AMOUNT_FIELDS}
+    data['sync_id'] = product.sync_id
+    data['store_id'] = product.store_id
+    data['date'] = product.date.isoformat()
+    data['updated_at'] = product.updated_at.isoformat()
+    return data
+
+
+def apply_records(session, records, stamp=None, pending=(), overwrite=()):
+    """按 sync_id 合并一批记录，只接受比本地更新的版本，返回实际写入的条数
+
+    服务器端传入 stamp=当前时间，使推送上来的记录按服务器时钟进入拉取水位线，
+    否则其他客户端会因为水位线已越过客户端时间而漏掉这些记录。
+    pending 中的 sync_id 在本地有尚未推送的修改，拉取时跳过，以本地版本为准。
+    overwrite 中的 sync_id 不比较更新时间，直接使用传入的版本。
+    deleted=True 的记录删除本地记录；本地没有这条记录时保存 tombstone，转告其他客户端。
+    """
+    sync_ids = [record['sync_id'] for record in records]
+    existing = {
+        product.sync_id: product
+        for product in session.query(Product).filter(Product.sync_id.in_(sync_ids))
+    }
+    tombstones = {
+        tombstone.sync_id: tombstone
+        for tombstone in session.query(ProductTombstone).filter(ProductTombstone.sync_id.in_(sync_ids))
+    }
+
+    applied = 0
+    touched = set()
+    for record in records:
+        sync_id = record['sync_id']
+        if sync_id in pending:
+            continue
+        updated_at = datetime.fromisoformat(record['updated_at'])
+        product = existing.get(sync_id)
+        newer_local = (product is not None and product.updated_at and product.updated_at >= updated_at
+                       and sync_id not in overwrite)
+
+        if record.get('deleted'):
+            if product is None and sync_id not in tombstones:
+                tombstones[sync_id] = ProductTombstone(
+                    sync_id=sync_id, store_id=record.get('store_id') or DEFAULT_STORE_ID,
+                    date=datetime.fromisoformat(record['date']), deleted_at=stamp or updated_at)
+                session.add(tombstones[sync_id])
+                applied += 1
+            elif product is not None and not newer_local:
+                touched.add((product.store_id, product.name))
+                session.delete(product)
+                del existing[sync_id]
+                applied += 1
+            continue
+
+        if product is None:
+            tombstone = tombstones.pop(sync_id, None)
+            if tombstone is not None:
+                # 本地删除得更晚，保持删除
+                if tombstone.deleted_at >= updated_at and sync_id not in overwrite:
+                    tombstones[sync_id] = tombstone
+                    continue
+                session.delete(tombstone)
+            product = Product(sync_id=sync_id)
+            session.add(product)
+            existing[sync_id] = product
+        elif newer_local:
+            continue
+
+        if product.name:
+            touched.add((product.store_id, product.name))
+        # 旧版本客户端推送的记录没有门店，归到默认门店
+        product.store_id = record.get('store_id') or DEFAULT_STORE_ID
+        for field in SYNC_FIELDS:
+            setattr(product, field, record.get(field))
+        product.set_amounts(
+            fen_to_yuan(record['price_fen']),
+            grams_to_jin(record['quantity_g']),
+            grams_to_jin(record.get('actual_quantity_g')),
+            grams_to_jin(record.get('loss_quantity_g'))
+        )
+        product.date = datetime.fromisoformat(record['date'])
+        # 显式赋值 updated_at，避免 onupdate 把它改成本地时间
+        product.updated_at = stamp or updated_at
+        touched.add((product.store_id, product.name))
+        applied += 1
+
+    # 合并进来的记录可能改动历史，涉及的商品重新计算库存
+    for store_id in {store_id for store_id, _ in touched}:
+        stock.rebuild(session, [name for touched_store, name in touched if touched_store == store_id], store_id)
+    return applied
+
+
+def revert_rejected(session, rejected, current):
+    """服务器拒绝的本地修改（日期已结账）恢复为服务器上的版本，服务器上没有的记录删除
+
+    current 为服务器返回的这些记录的当前版本。返回恢复的条数，调用方负责 commit。
+    """
+    rejected = set(rejected)
+    apply_records(session, current, overwrite=rejected)
+    missing = rejected - {record['sync_id'] for record in current}
+    touched = set()
+    for product in session.query(Product).filter(Product.sync_id.in_(missing)):
+        touched.add((product.store_id, product.name))
+        session.delete(product)
+    session.flush()
+    for store_id in {store_id for store_id, _ in touched}:
+        stock.rebuild(session, [name for touched_store, name in touched if touched_store == store_id], store_id)
+    return len(rejected)
+
+
+def _after(model, time_column, since, after_id, limit, store_id, until):
+    stmt = select(model).order_by(time_column, model.id).limit(limit)
+    if until is not None:
+        stmt = stmt.where(time_column <= until)
+    if store_id is not None:
+        stmt = stmt.where(model.store_id == store_id)
+    if since is not None:
+        stmt = stmt.where((time_column > since) | ((time_column == since) & (model.id > after_id)))
+    return stmt
+
+
+def changes_since(session, since=None, after_id=0, limit=500, store_id=None, until=None, deleted=None):
+    """按 (updated_at, id) 水位线返回增量记录和新的水位线，store_id 为 None 时返回所有门店
+
+    updated_at 在提交前取值，时间较早的事务可能在较晚的事务之后提交。until 之后
+    更新的记录暂不返回，等这期间的事务都提交后再读，水位线不会越过未提交的记录。
+
+    deleted 为删除记录的水位线 (deleted_since, deleted_after_id) 时，同时按 (deleted_at, id)
+    返回最多 limit 条删除记录，水位线中带上 deleted_since/deleted_after_id；为 None 时
+    不返回删除记录（旧版本客户端不认识它们）。
+    """
+    products = session.scalars(_after(Product, Product.updated_at, since, after_id, limit, store_id, until)).all()
+    tombstones = []
+    if deleted is not None:
+        deleted_since, deleted_after_id = deleted
+        tombstones = session.scalars(_after(ProductTombstone, ProductTombstone.deleted_at, deleted_since,
+                                            deleted_after_id, limit, store_id, until)).all()
+    if not products and not tombstones:
+        return [], None
+
+    # 没有新记录的一边保持原来的水位线
+    watermark = {'since': since.isoformat() if since else None, 'after_id': after_id}
+    if products:
+        watermark = {'since': products[-1].updated_at.isoformat(), 'after_id': products[-1].id}
+    if deleted is not None:
+        watermark['deleted_since'] = deleted_since.isoformat() if deleted_since else None
+        watermark['deleted_after_id'] = deleted_after_id
+        if tombstones:
+            watermark['deleted_since'] = tombstones[-1].deleted_at.isoformat()
+            watermark['deleted_after_id'] = tombstones[-1].id
+    return [record_to_dict(record) for record in products + tombstones], watermark
+
+
+def mark_dirty(session, products):
+    """在当前事务中登记待推送的记录，调用方负责 commit"""
+    session.flush()
+    queued = {
+        row.sync_id for row in session.query(SyncOutbox.sync_id)
+        .filter(SyncOutbox.sync_id.in_([product.sync_id for product in products]))
+    }
+    for product in products:
+        if product.sync_id not in queued:
+            session.add(SyncOutbox(sync_id=product.sync_id))
+            queued.add(product.sync_id)
+
+
+def delete_records(session, products):
+    """删除本地记录并登记待推送的删除（推送时发送 tombstone），调用方负责 commit"""
+    mark_dirty(session, products)
+    touched = {(product.store_id, product.name) for product in products}
+    for product in products:
+        session.delete(product)
+    for store_id in {store_id for store_id, _ in touched}:
+        stock.rebuild(session, [name for touched_store, name in touched if touched_store == store_id], store_id)
+
+
+def batch_key(records):
+    """推送批次的幂等键：超时后重试同一批记录时服务器直接返回第一次的结果
+
+    按记录内容（含 updated_at）计算，重试前本地又修改过的记录会得到新的键，
+    不会被当成重复提交。
+    """
+    body = json.dumps(records, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+class SyncEngine:
+    def __init__(self, session_factory, base_url, token, batch_size=200, timeout=30, store_id=DEFAULT_STORE_ID):
+        self.session_factory = session_factory
+        self.store_id = store_id
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.batch_size = batch_size
+        self.timeout = timeout
+        # 最近一次推送中被服务器拒绝、已恢复为服务器版本的 sync_id，由界面提示后清空
+        self.reverted = []
+        LocalBase.metadata.create_all(session_factory.kw['bind'])
+
+    def _request(self, path, payload=None, idempotency_key=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        req = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            headers=headers,
+            method='POST' if data is not None else 'GET'
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+
+    def push(self):
+        """把 sync_outbox 中的记录分批推送到服务器，返回推送条数"""
+        pushed = 0
+        session = self.session_factory()
+        try:
+            while True:
+                queued = session.query(SyncOutbox).order_by(SyncOutbox.id).limit(self.batch_size).all()
+                if not queued:
+                    break
+                sync_ids = [item.sync_id for item in queued]
+                products = session.query(Product).filter(Product.sync_id.in_(sync_ids)).all()
+                # 本地已删除的记录推送 tombstone
+                products += session.query(ProductTombstone).filter(
+                    ProductTombstone.sync_id.in_(set(sync_ids) - {p.sync_id for p in products})
+                ).all()
+                records = sorted((record_to_dict(p) for p in products), key=lambda record: record['sync_id'])
+                result = self._request('/api/sync/push', {'records': records}, batch_key(records))
+                if result.get('rejected'):
+                    # 服务器上这些日期已结账，本地修改不会被接受；恢复为服务器上的版本，
+                    # 否则本地记录更新时间更新，拉取时不会被覆盖，两边一直不一致
+                    logger.warning("Server rejected %s records on closed days: %s",
+                                   len(result['rejected']), ', '.join(result['rejected'][:20]))
+                    if 'current' in result:
+                        revert_rejected(session, result['rejected'], result['current'])
+                        self.reverted.extend(result['rejected'])
+                for item in queued:
+                    session.delete(item)
+                session.commit()
+                pushed += len(products)
+        finally:
+            session.close()
+        return pushed
+
+    def pull(self):
+        """从服务器拉取水位线之后的增量，返回写入本地的条数"""
+        pulled = 0
+        session = self.session_factory()
+        try:
+            while True:
+                # 水位线保存在 sync_state 中，键为 pull_ 加水位线字段名
+                params = {'limit': self.batch_size, 'store_id': self.store_id, 'deleted': 1}
+                for key in ('since', 'after_id', 'deleted_since', 'deleted_after_id'):
+                    state = session.get(SyncState, 'pull_' + key)
+                    if state is not None:
+                        params[key] = state.value
+                result = self._request('/api/sync/pull?' + urllib.parse.urlencode(params))
+                if not result['records']:
+                    break
+
+                pending = {row.sync_id for row in session.query(SyncOutbox.sync_id)}
+                pulled += apply_records(session, result['records'], pending=pending)
+                for key, value in result['watermark'].items():
+                    if value is not None:
+                        session.merge(SyncState(key='pull_' + key, value=str(value)))
+                session.commit()
+        finally:
+            session.close()
+        return pulled
+
+    def run_once(self):
+        pushed = self.push()
+        pulled = self.pull()
+        logger.info("Sync finished: pushed %s, pulled %s", pushed, pulled)
+        return pushed, pulled
@@ -0,0 +1,48 @@
+"""测试使用临时目录中的 SQLite 数据库
+
+app.py 在导入时读取配置，所以环境变量在这里、导入 app 之前设置。所有测试共用
+一个网页端数据库，桌面端数据库每个测试单独创建。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = tempfile.mkdtemp(prefix='inventory-test-')
+os.environ.update(
+    DATABASE_URL=f'sqlite:///{DATA_DIR}/server.db',
+    JOB_WORKER_EMBEDDED='0',
+    LOG_LEVEL='WARNING',
+    SYNC_TOKEN='test-token',
+    # 测试中刚写入的记录立即可以拉取
+    SYNC_PULL_LAG='0',
+)
+
+ADMIN_PASSWORD = 'admin-password'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    from migrate_db import migrate_database
+    from models import db, User
+
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        migrate_database()
+        admin = User(username='admin', role='admin')
+        admin.set_password(ADMIN_PASSWORD)
+        db.session.add(admin)
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': ADMIN_PASSWORD})
+    return client
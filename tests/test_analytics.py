@@ -0,0 +1,19 @@
+import sales_summary
+
+
+def test_reports_read_sales_summary(app, admin_client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'ANALYTICS_DIR', str(tmp_path))
+    assert admin_client.get('/api/analytics/monthly_sales').get_json() == []
+
+    sales_summary.save(str(tmp_path), [
+        ('2025-03', 1, '西红柿', 1333, 399900),
+        ('2026-03', 1, '西红柿', 1500, 750000),
+        ('2026-03', 2, '西红柿', 500, 250000),
+    ], '2026-04-01T00:00:00')
+
+    rows = admin_client.get('/api/analytics/monthly_sales?start=2026-01&store_id=1').get_json()
+    assert rows == [{'month': '2026-03', 'name': '西红柿', 'quantity_g': 1500, 'amount_fen': 1500}]
+
+    rows = admin_client.get('/api/analytics/year_over_year?year=2026').get_json()
+    assert rows == [{'month': '2026-03', 'name': '西红柿', 'quantity_g': 2000, 'amount_fen': 2000,
+                     'last_year_fen': 800}]
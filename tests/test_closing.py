@@ -0,0 +1,55 @@
+from datetime import date, timedelta
+
+import pytest
+
+import closing
+from models import db, VEGETABLES, DayClose, Store, User
+
+
+@pytest.fixture
+def store(app, admin_client):
+    """单独的门店，结账不影响其他测试在默认门店写入的记录"""
+    with app.app_context():
+        store = Store(name=f'结账测试{Store.query.count()}')
+        db.session.add(store)
+        db.session.commit()
+        store_id = store.id
+    admin_client.post('/store/switch', data={'store_id': store_id})
+    return store_id
+
+
+def closed_days(app, store_id):
+    with app.app_context():
+        return [close.day for close in DayClose.query.filter_by(store_id=store_id)]
+
+
+def test_only_admin_can_close_day(app, store):
+    with app.app_context():
+        clerk = User(username='clerk', role='user', store_id=store)
+        clerk.set_password('clerk-password')
+        db.session.add(clerk)
+        db.session.commit()
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'clerk', 'password': 'clerk-password'})
+    assert '/login' not in response.headers['Location']
+
+    yesterday = date.today() - timedelta(days=1)
+    client.post('/day/close', data={'date': yesterday.isoformat()})
+    assert closed_days(app, store) == []
+
+
+def test_closing_today_needs_confirm(app, admin_client, store):
+    today = date.today()
+    admin_client.post('/day/close', data={'date': today.isoformat()})
+    assert closed_days(app, store) == []
+
+    admin_client.post('/day/close', data={'date': today.isoformat(), 'confirm': '1'})
+    assert closed_days(app, store) == [today]
+
+
+def test_snapshot_keeps_vegetable_order(app, store):
+    yesterday = date.today() - timedelta(days=1)
+    with app.app_context():
+        closing.close_day(db.session, yesterday, store_id=store, names=list(reversed(VEGETABLES)))
+        db.session.commit()
+        assert list(closing.snapshot(db.session, yesterday, store)) == VEGETABLES
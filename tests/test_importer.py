@@ -0,0 +1,35 @@
+import io
+from datetime import datetime
+
+import openpyxl
+
+import importer
+
+NOW = datetime(2026, 2, 1)
+
+
+def error_rows(stream, filename, chunk_size=2):
+    errors = []
+    for chunk in importer.read_chunks(stream, filename, chunk_size):
+        errors += importer.validate_chunk(chunk, default_type='sale', now=NOW)[1]
+    return [error['row'] for error in errors]
+
+
+def test_csv_error_rows_count_blank_lines():
+    data = '商品名称,数量,日期\n菜心,1,2026-01-01\n\n菜心,x,2026-01-01\n菜心,-1,2026-01-01\n,,\n菜心,1,2099-01-01\n'
+    assert error_rows(io.BytesIO(data.encode('utf-8')), 'records.csv') == [4, 5, 7]
+
+
+def test_xlsx_error_rows_count_blank_rows(tmp_path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['商品名称', '数量', '日期'])
+    sheet.append(['菜心', 1, '2026-01-01'])
+    sheet.append([])
+    sheet.append([None, None, None])
+    sheet.append(['菜心', 'x', '2026-01-01'])
+    sheet.append(['白萝卜', 0, '2026-01-01'])
+    path = tmp_path / 'records.xlsx'
+    workbook.save(path)
+    with open(path, 'rb') as stream:
+        assert error_rows(stream, 'records.xlsx') == [5, 6]
@@ -0,0 +1,39 @@
+import json
+from datetime import datetime, timedelta
+
+import jobs
+from models import db, Job
+
+
+def test_schedule_enqueues_due_jobs_once(app):
+    with app.app_context():
+        Job.query.filter_by(kind='loss_update').delete()
+        db.session.commit()
+
+        assert jobs.schedule(db.session, {'loss_update': 300, 'backup': 0}) == ['loss_update']
+        # 还在排队时不再插入
+        assert jobs.schedule(db.session, {'loss_update': 300}, now=datetime.now() + timedelta(hours=1)) == []
+
+        Job.query.filter_by(kind='loss_update').update({'status': 'done'})
+        db.session.commit()
+        assert jobs.schedule(db.session, {'loss_update': 300}) == []
+        assert jobs.schedule(db.session, {'loss_update': 300}, now=datetime.now() + timedelta(seconds=301)) == ['loss_update']
+
+
+def test_schedule_daily_job_after_its_hour(app):
+    with app.app_context():
+        Job.query.filter_by(kind='forecast').delete()
+        db.session.commit()
+
+        morning = datetime(2026, 5, 2, 8, 0)
+        evening = datetime(2026, 5, 2, 21, 30)
+        # worker 昨晚没有运行：早上补排昨晚的任务
+        assert jobs.schedule(db.session, daily={'forecast': 21}, now=morning) == ['forecast']
+        job = Job.query.filter_by(kind='forecast').one()
+        assert json.loads(job.params) == {'scheduled_at': '2026-05-01T21:00:00'}
+
+        job.status, job.created_at = 'done', morning
+        db.session.commit()
+        assert jobs.schedule(db.session, daily={'forecast': 21}, now=morning.replace(hour=20)) == []
+        assert jobs.schedule(db.session, daily={'forecast': 21}, now=evening) == ['forecast']
+        assert jobs.schedule(db.session, daily={'forecast': -1}, now=evening + timedelta(days=1)) == []
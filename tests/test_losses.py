@@ -0,0 +1,56 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import losses
+from models import db, Product, Store
+
+
+@pytest.fixture
+def store_id(app):
+    with app.app_context():
+        store = Store(name=f'损耗测试{Store.query.count()}')
+        db.session.add(store)
+        db.session.commit()
+        return store.id
+
+
+def add(store_id, type, day, quantity, price=2, actual=0, loss=0):
+    product = Product(store_id=store_id, name='西红柿', type=type, date=datetime.combine(day, datetime.min.time()))
+    product.set_amounts(price, quantity, actual, loss)
+    db.session.add(product)
+    db.session.commit()
+    return product
+
+
+def week(store_id):
+    start = losses.week_start(date.today() - timedelta(days=14))
+    rows = losses.weekly_losses(db.session, start, date.today(), ['西红柿'], store_id)
+    return {row['week_start']: (row['loss_quantity'], row['purchased_quantity'], row['loss_value']) for row in rows}
+
+
+def test_edits_to_past_records_rederive_weeks(app, store_id):
+    monday = losses.week_start(date.today()) - timedelta(days=7)
+    with app.app_context():
+        add(store_id, 'purchase', monday, 10)
+        check = add(store_id, 'inventory_check', monday + timedelta(days=1), 0, actual=8, loss=2)
+        losses.update(db.session, lag=0)
+        assert week(store_id) == {monday.isoformat(): (2, 10, 4)}
+
+        # 修改过去的盘点；和网页端一样先查询出整行，变更记录才有修改前的内容
+        check = Product.query.filter_by(id=check.id).one()
+        check.set_amounts(0, 0, 7, 3)
+        db.session.commit()
+        losses.update(db.session, lag=0)
+        assert week(store_id) == {monday.isoformat(): (3, 10, 6)}
+
+        # 补录盘点之前的进货
+        add(store_id, 'purchase', monday, 5, price=4)
+        losses.update(db.session, lag=0)
+        assert week(store_id) == {monday.isoformat(): (3, 15, 12)}
+
+        # 删除盘点
+        db.session.delete(Product.query.filter_by(id=check.id).one())
+        db.session.commit()
+        losses.update(db.session, lag=0)
+        assert week(store_id) == {}
@@ -0,0 +1,107 @@
+from datetime import datetime
+
+import pytest
+
+import repository
+import sync
+from models import db, Product, ProductTombstone
+
+
+@pytest.fixture
+def desktop(app, tmp_path):
+    """桌面端：本地 SQLite 数据库，同步请求直接交给网页端的测试客户端"""
+    Session = repository.open_session(f'sqlite:///{tmp_path}/desktop.db')
+    engine = sync.SyncEngine(Session, 'http://server', 'test-token')
+    client = app.test_client()
+
+    def request(path, payload=None, idempotency_key=None):
+        headers = {'Authorization': 'Bearer test-token'}
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        if payload is None:
+            response = client.get(path, headers=headers)
+        else:
+            response = client.post(path, json=payload, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_json()
+
+    engine._request = request
+    return Session, engine
+
+
+def server_product(app, sync_id):
+    with app.app_context():
+        return db.session.query(Product).filter_by(sync_id=sync_id).first()
+
+
+def test_desktop_delete_reaches_server(app, desktop):
+    Session, engine = desktop
+    session = Session()
+    record = repository.add_record(session, '菜心', 'purchase', 3, 10, datetime.now())
+    sync.mark_dirty(session, [record])
+    session.commit()
+    sync_id = record.sync_id
+    engine.push()
+    assert server_product(app, sync_id) is not None
+
+    sync.delete_records(session, [session.query(Product).filter_by(sync_id=sync_id).one()])
+    session.commit()
+    session.close()
+    engine.push()
+
+    assert server_product(app, sync_id) is None
+    with app.app_context():
+        assert db.session.query(ProductTombstone).filter_by(sync_id=sync_id).count() == 1
+
+
+def test_web_delete_reaches_desktop(app, admin_client, desktop):
+    Session, engine = desktop
+    with app.app_context():
+        record = repository.add_record(db.session, '空心菜', 'purchase', 2, 5, datetime.now())
+        db.session.commit()
+        record_id, sync_id = record.id, record.sync_id
+    engine.pull()
+    session = Session()
+    assert session.query(Product).filter_by(sync_id=sync_id).count() == 1
+
+    response = admin_client.get(f'/delete/{record_id}')
+    assert response.status_code == 302
+    assert server_product(app, sync_id) is None
+    engine.pull()
+
+    assert session.query(Product).filter_by(sync_id=sync_id).count() == 0
+
+
+def test_edit_after_delete_restores_record(app, desktop):
+    Session, engine = desktop
+    session = Session()
+    record = repository.add_record(session, '塔菜', 'purchase', 4, 6, datetime.now())
+    sync.mark_dirty(session, [record])
+    session.commit()
+    row = sync.record_to_dict(record)
+    engine.push()
+
+    with app.app_context():
+        db.session.delete(db.session.query(Product).filter_by(sync_id=row['sync_id']).one())
+        db.session.commit()
+        # 比删除旧的修改不会恢复记录，删除之后的修改会
+        assert sync.apply_records(db.session, [row]) == 0
+        row['updated_at'] = datetime.now().isoformat()
+        assert sync.apply_records(db.session, [row]) == 1
+        db.session.commit()
+    assert server_product(app, row['sync_id']) is not None
+
+
+@pytest.mark.parametrize('change', [
+    {'sync_id': None},
+    {'date': None},
+    {'updated_at': '昨天'},
+    {'deleted': True, 'date': 20250101},
+])
+def test_push_rejects_malformed_records(app, change):
+    record = {'sync_id': 'a' * 32, 'type': 'purchase', 'name': '菜心', 'price_fen': 300, 'quantity_g': 500,
+              'date': '2025-01-01T08:00:00', 'updated_at': '2025-01-01T08:00:00'}
+    record.update(change)
+    response = app.test_client().post('/api/sync/push', json={'records': [record]},
+                                      headers={'Authorization': 'Bearer test-token'})
+    assert response.status_code == 400
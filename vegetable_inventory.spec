@@ -7,7 +7,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=['tkcalendar'],
+    hiddenimports=['tkcalendar', 'sqlalchemy.dialects.sqlite'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
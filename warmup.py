@@ -0,0 +1,139 @@
+"""worker 预热
+
+gunicorn 的 worker 每处理 max_requests 个请求就会重启，新 worker 的前几个
+请求要建立数据库连接、编译 SQL 和 Jinja 模板、读取价格表，明显变慢。
+这里把这些工作放到 worker 开始接收请求之前：
+
+    prepare(app)      主进程 fork 之前：编译模板和常用查询，随后关闭主进程的数据库连接，
+                      worker 通过 fork 继承编译结果，但不会共用连接
+    after_fork(app)   worker 中：丢弃继承的连接池，预先建立连接，读取商品、当前价格和当天汇总
+
+gunicorn_config.py 的 when_ready/post_fork 钩子分别调用这两个函数；
+run_prod.py (waitress) 和开发服务器只有一个进程，启动前调用 warm(app)。
+/ready 在预热完成前返回 503，可以作为负载均衡的就绪检查。
+"""
+import logging
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import select, text
+
+logger = logging.getLogger(__name__)
+
+# 当前进程的预热状态，由 /ready 返回
+state = {'status': 'cold', 'pid': os.getpid(), 'steps': {}}
+
+
+def _step(name, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    state['steps'][name] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def compile_templates(app):
+    """加载并编译所有模板，结果保存在 jinja_env 的模板缓存中"""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def _engines(db):
+    return list(db.engines.values())
+
+
+def open_connections(db, count):
+    """同时签出 count 个连接再归还，连接留在池中；超出 pool_size 的部分归还时会被关闭，所以不超过它"""
+    opened = 0
+    for engine in _engines(db):
+        size = engine.pool.size() if hasattr(engine.pool, 'size') else count
+        connections = []
+        try:
+            for _ in range(min(count, size)):
+                connection = engine.connect()
+                connection.execute(text('SELECT 1'))
+                connections.append(connection)
+        finally:
+            for connection in connections:
+                connection.close()
+        opened += len(connections)
+    return opened
+
+
+def preload_data(app, db):
+    """执行首页、库存页、录入页的查询：编译 SQL 并把常用的数据页读入数据库缓存"""
+    import auth
+    import closing
+    import repository
+    from models import VEGETABLES, ProductPrice, Store
+
+    # 密码哈希算法前缀，第一次登录时才会计算
+    auth.needs_rehash('', app.config['PASSWORD_HASH_METHOD'])
+
+    today = datetime.now()
+    store_ids = db.session.scalars(select(Store.id)).all()
+    for store_id in store_ids:
+        db.session.scalars(select(ProductPrice).where(ProductPrice.store_id == store_id)).all()
+        closing.daily_summary(db.session, today, store_id)
+        repository.stock_by_name(db.session, VEGETABLES, store_id=store_id)
+        for name in VEGETABLES:
+            repository.latest_purchase(db.session, name, store_id=store_id)
+    db.session.rollback()
+    return len(store_ids)
+
+
+def prepare(app):
+    """在 gunicorn 主进程 fork 之前调用"""
+    from models import db
+
+    with app.app_context():
+        try:
+            compile_templates(app)
+            preload_data(app, db)
+        except Exception:
+            logger.exception("Warm-up in master failed")
+        finally:
+            db.session.remove()
+            # 主进程不再使用数据库，关闭连接，避免 worker 继承同一个 socket
+            for engine in _engines(db):
+                engine.dispose()
+
+
+def after_fork(app):
+    """在 worker 进程中、开始接收请求之前调用"""
+    from models import db
+
+    with app.app_context():
+        # 继承自主进程的连接留给主进程处理，这里只丢弃引用
+        for engine in _engines(db):
+            engine.dispose(close=False)
+    warm(app)
+
+
+def warm(app):
+    """预热当前进程，完成后 /ready 返回 200"""
+    from models import db
+
+    started = time.perf_counter()
+    state.update(status='warming', pid=os.getpid(), steps={}, started_at=datetime.now().isoformat())
+    with app.app_context():
+        try:
+            _step('templates', compile_templates, app)
+            _step('connections', open_connections, db, app.config['WARMUP_CONNECTIONS'])
+            _step('data', preload_data, app, db)
+        except Exception as e:
+            state.update(status='failed', error=f'{e.__class__.__name__}: {e}')
+            logger.exception("Warm-up failed in pid %s", os.getpid())
+            return False
+        finally:
+            db.session.remove()
+    state.update(status='ready', ready_at=datetime.now().isoformat(),
+                 duration_ms=round((time.perf_counter() - started) * 1000, 1))
+    logger.info("Worker %s warmed up in %.0f ms %s", os.getpid(), state['duration_ms'], state['steps'])
+    return True
+
+
+def is_ready():
+    return state['status'] == 'ready'
@@ -1,19 +1,16 @@
-import os
-import sys
 import logging
-from app import app, db
+from app import app
+from migrate_db import migrate_database
 
-# 配置日志
-logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+# 日志在导入 app 时已配置 (logging_setup.py)
 logger = logging.getLogger(__name__)
 
 def init_db():
     try:
-        with app.app_context():
-            db.create_all()
-            logger.info("Database tables created successfully")
-    except Exception as e:
-        logger.error(f"Error creating database tables: {str(e)}")
+        migrate_database()
+        logger.info("Database schema is up to date")
+    except Exception:
+        logger.exception("Error migrating database")
         raise
 
 # 在应用启动时初始化数据库